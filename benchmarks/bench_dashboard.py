@@ -0,0 +1,8 @@
+def refresh_and_wait(main_window):
+    main_window.dashboard_widget.refresh_data()
+    if main_window.query_executor:
+        main_window.query_executor.wait()
+
+
+def test_refresh_data(benchmark, main_window):
+    benchmark(refresh_and_wait, main_window)
@@ -0,0 +1,51 @@
+import pytest
+
+
+def wait_for_queries(main_window):
+    if main_window.query_executor:
+        main_window.query_executor.wait()
+
+
+def bench_open_form(benchmark, app_module, widget, open_form, window):
+    # Time from the click to the form being shown, the latency a desk user feels
+    def open_and_close():
+        getattr(widget, open_form)()
+        app_module.QApplication.processEvents()
+        getattr(widget, window).close()
+
+    benchmark(open_and_close)
+
+
+@pytest.fixture
+def book_selected(main_window):
+    inventory = main_window.inventory_widget
+    wait_for_queries(main_window)
+    inventory.table.setCurrentCell(0, 1)
+    return inventory
+
+
+@pytest.fixture
+def open_loan_selected(main_window):
+    reports = main_window.borrower_reports_widget
+    reports.status_combo.setCurrentText("Not Returned")
+    wait_for_queries(main_window)
+    reports.reports_table.setCurrentCell(0, 1)
+    yield reports
+    reports.status_combo.setCurrentText("All")
+    wait_for_queries(main_window)
+
+
+@pytest.mark.parametrize("open_form, window", [
+    ("update_record", "update_window"),
+    ("borrow_book", "borrow_window"),
+])
+def test_open_inventory_form(benchmark, app_module, book_selected, open_form, window):
+    bench_open_form(benchmark, app_module, book_selected, open_form, window)
+
+
+@pytest.mark.parametrize("open_form, window", [
+    ("return_book_from_report", "return_window"),
+    ("edit_borrower_details", "edit_window"),
+])
+def test_open_report_form(benchmark, app_module, open_loan_selected, open_form, window):
+    bench_open_form(benchmark, app_module, open_loan_selected, open_form, window)
@@ -0,0 +1,15 @@
+def test_import_append(benchmark, main_window, workdir, restore_database):
+    workbook = str(workdir / "catalogue.xlsx")
+    benchmark.pedantic(
+        main_window.inventory_widget.import_excel_file, args=(workbook,), kwargs={"merge": False},
+        setup=restore_database, rounds=3,
+    )
+
+
+def test_import_merge_unchanged(benchmark, main_window, workdir, restore_database):
+    workbook = str(workdir / "catalogue.xlsx")
+    restore_database()
+    main_window.inventory_widget.import_excel_file(workbook, merge=True)
+    benchmark.pedantic(
+        main_window.inventory_widget.import_excel_file, args=(workbook,), kwargs={"merge": True}, rounds=3,
+    )
@@ -0,0 +1,59 @@
+import pytest
+
+
+def run_and_wait(main_window, load):
+    # Loads are delivered asynchronously; time them up to the moment the table is filled
+    load()
+    if main_window.query_executor:
+        main_window.query_executor.wait()
+
+
+def test_load_records(benchmark, main_window):
+    benchmark(run_and_wait, main_window, main_window.inventory_widget.load_records)
+
+
+@pytest.mark.parametrize("query", ["reform", "B12", "zzz-no-match"])
+def test_search_record(benchmark, main_window, query):
+    inventory = main_window.inventory_widget
+    inventory.search_input.blockSignals(True)
+    inventory.search_input.setText(query)
+    inventory.search_input.blockSignals(False)
+    benchmark(run_and_wait, main_window, inventory.search_record)
+
+
+@pytest.mark.parametrize("query", ["agrarain reforn", "sustanable devlopment"])
+def test_fuzzy_search(benchmark, app_module, main_window, query):
+    # Misspelled titles miss the LIKE search and fall back to the trigram index
+    cursor = main_window.cursor
+    app_module.catalogue_trigrams.refresh(cursor)
+    records = benchmark(app_module.search_books, cursor, query)
+    assert records
+
+
+@pytest.mark.parametrize("filters", [
+    {"category": "JOURNAL"},
+    {"category": "JOURNAL", "year_from": 1990, "year_to": 2000, "available": True},
+    {"year_from": 2010, "status": "Fully Issued"},
+])
+def test_filter_records(benchmark, app_module, main_window, filters):
+    benchmark(app_module.inventory_page, main_window.cursor, "", filters)
+
+
+def test_facet_counts_uncached(benchmark, app_module, main_window):
+    facets = app_module.InventoryFacets()
+
+    def recount():
+        facets.version = None
+        return facets.counts(main_window.cursor, {"category": "BOOKS"})
+
+    benchmark(recount)
+
+
+@pytest.mark.parametrize("cached", [True, False])
+def test_book_lookup(benchmark, app_module, main_window, cached):
+    # The same book looked up again, served from the catalogue cache or read from Library every time
+    cache = app_module.CatalogueCache(capacity=5000 if cached else 0)
+    book_id = main_window.cursor.execute("SELECT BK_ID FROM Library LIMIT 1").fetchone()[0]
+    book = benchmark(cache.get, main_window.cursor, book_id)
+    assert book.book_id == book_id
+    benchmark.extra_info.update(cache.stats())
@@ -0,0 +1,84 @@
+import pytest
+
+from bench_inventory import run_and_wait
+
+
+@pytest.mark.parametrize("period", ["All", "This Month"])
+def test_load_borrower_reports(benchmark, main_window, period):
+    reports = main_window.borrower_reports_widget
+    reports.sort_combo.blockSignals(True)
+    reports.sort_combo.setCurrentText(period)
+    reports.sort_combo.blockSignals(False)
+    benchmark(run_and_wait, main_window, reports.load_borrower_reports)
+
+
+def test_export_data(benchmark, app_module, main_window, tmp_path, monkeypatch):
+    target = str(tmp_path / "borrowers.xlsx")
+    monkeypatch.setattr(app_module.QFileDialog, "getSaveFileName", staticmethod(lambda *args, **kwargs: (target, "")))
+    benchmark.pedantic(main_window.borrower_reports_widget.export_data, args=("All",), rounds=3)
+
+
+def test_export_changes(benchmark, app_module, main_window, tmp_path, restore_database):
+    # One day's worth of activity on top of the full history: the export should only pay for the day.
+    cursor = main_window.cursor
+    target = str(tmp_path / "changes.csv")
+
+    def export_changes():
+        app_module.export_loan_changes(cursor, target)
+        main_window.connector.commit()
+
+    def day_of_activity():
+        restore_database()
+        export_changes()
+        cursor.execute("""
+            UPDATE Borrowers SET DATE_RETURNED = strftime('%Y-%m-%d %H:%M', 'now')
+            WHERE BORROWER_ID IN (SELECT BORROWER_ID FROM Borrowers WHERE DATE_RETURNED IS NULL LIMIT 200)
+        """)
+        main_window.connector.commit()
+
+    benchmark.pedantic(export_changes, setup=day_of_activity, rounds=5)
+
+
+@pytest.mark.parametrize("export_format", ["Excel", "CSV", "JSON Lines", "Parquet"])
+def test_export_formats(benchmark, app_module, main_window, tmp_path, export_format):
+    if export_format == "Parquet":
+        pytest.importorskip("pyarrow")
+    extension = app_module.EXPORT_FORMATS[export_format][0]
+    target = tmp_path / f"borrowers{extension}"
+    rows = benchmark(app_module.export_loans, main_window.cursor, str(target), export_format)
+    benchmark.extra_info["rows"] = rows
+    benchmark.extra_info["bytes"] = target.stat().st_size
+
+
+def test_export_selected(benchmark, app_module, main_window, tmp_path):
+    reports = main_window.borrower_reports_widget
+    reports.set_all_check_states(app_module.Qt.Checked)
+    borrower_ids = reports.get_selected_borrower_ids()
+    reports.deselect_all_rows()
+    target = str(tmp_path / "selected.csv")
+    benchmark.extra_info["rows"] = benchmark(app_module.export_loans_by_id, main_window.cursor, target, borrower_ids)
+
+
+def test_export_all_matching(benchmark, app_module, main_window, tmp_path):
+    # Select All keeps the filters rather than loading every page, and exports through them
+    reports = main_window.borrower_reports_widget
+    reports.select_all_rows()
+    if main_window.query_executor:
+        main_window.query_executor.wait()
+    (period, status), count = reports.all_selected
+    reports.deselect_all_rows()
+    assert reports.reports_table.rowCount() <= app_module.TABLE_PAGE_SIZE
+    target = str(tmp_path / "matching.csv")
+    rows = benchmark(app_module.export_report_loans, main_window.cursor, target, period, status)
+    assert rows == count
+    benchmark.extra_info["rows"] = rows
+
+
+@pytest.mark.parametrize("sort", ["b.DATE_BORROWED", "b.DUE_DATE", "l.BK_NAME"])
+@pytest.mark.parametrize("descending", [False, True])
+def test_sort_report_page(benchmark, app_module, main_window, sort, descending):
+    # A page deep into the sorted loans costs the same as the first one
+    cursor = main_window.cursor
+    first_rows, after = app_module.borrower_report_page(cursor, "All", "All", sort, descending)
+    rows, _ = benchmark(app_module.borrower_report_page, cursor, "All", "All", sort, descending, after)
+    assert rows
@@ -0,0 +1,36 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def server_url(app_module):
+    server = app_module.LibraryServer("library.db", port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.ready.wait(10)
+    yield f"http://127.0.0.1:{server.port}"
+    server.stop()
+    thread.join(5)
+
+
+def test_remote_search(benchmark, app_module, server_url):
+    cursor = app_module.RemoteConnection(server_url).cursor()
+    benchmark(app_module.search_books, cursor, "reform")
+
+
+def test_remote_borrow_and_return(benchmark, app_module, server_url):
+    # One desk lending a free copy and taking it back, every statement over HTTP
+    connection = app_module.RemoteConnection(server_url)
+    cursor = connection.cursor()
+    cursor.execute("SELECT BK_ID FROM Library WHERE AVAILABLE_COPIES > 0 AND HOLDS_QUEUED = 0 LIMIT 1")
+    book_id = cursor.fetchone()[0]
+
+    def borrow_and_return():
+        copy_id = app_module.free_copy_id(cursor, book_id)
+        loan_id = app_module.insert_loan(cursor, book_id, copy_id, "Bench Desk", "09170000000", "desk@example.com", "Female", "Student")
+        connection.commit()
+        app_module.return_loan(cursor, loan_id, book_id, copy_id)
+        connection.commit()
+
+    benchmark(borrow_and_return)
@@ -0,0 +1,73 @@
+import importlib.util
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from generators import generate_library_db, generate_workbook  # noqa: E402
+
+APP_PATH = Path(__file__).resolve().parent.parent / "main 3.1.py"
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("library benchmarks")
+    group.addoption("--books", type=int, default=10000, help="books in the synthetic library.db")
+    group.addoption("--loans", type=int, default=50000, help="loans in the synthetic library.db")
+    group.addoption("--workbook-books", type=int, default=5000, help="books in the synthetic import workbook")
+
+
+@pytest.fixture(scope="session")
+def workdir(tmp_path_factory, pytestconfig):
+    path = tmp_path_factory.mktemp("library")
+    generate_library_db(str(path / "library.db"), pytestconfig.getoption("books"), pytestconfig.getoption("loans"))
+    generate_workbook(str(path / "catalogue.xlsx"), pytestconfig.getoption("workbook_books"))
+    return path
+
+
+@pytest.fixture(scope="session")
+def app_module(workdir):
+    # The app opens "library.db" relative to the working directory at import time.
+    previous = os.getcwd()
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("library_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    application = module.QApplication.instance() or module.QApplication([])
+
+    # Dialogs would block a headless run; answer them immediately.
+    for name in ("information", "warning", "critical"):
+        setattr(module.QMessageBox, name, staticmethod(lambda *args, **kwargs: module.QMessageBox.Ok))
+    module.QMessageBox.question = staticmethod(lambda *args, **kwargs: module.QMessageBox.Yes)
+
+    yield module
+    application.closeAllWindows()
+    os.chdir(previous)
+
+
+@pytest.fixture(scope="session")
+def main_window(app_module):
+    window = app_module.LibraryApp()
+    yield window
+    window.close()
+
+
+@pytest.fixture
+def restore_database(app_module):
+    # Snapshot the database once and copy it back before every round of a
+    # benchmark that writes to it.
+    pristine = sqlite3.connect(":memory:")
+    app_module.connector.backup(pristine)
+
+    def restore():
+        pristine.backup(app_module.connector)
+
+    yield restore
+    restore()
+    pristine.close()
@@ -0,0 +1,148 @@
+import argparse
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+CATEGORIES = {
+    "AB": "ANNOTATED BIBLIOGRAPHY",
+    "ADG": "ARTICLES ON DATA GATHERING",
+    "ANREP_CISC": "ANNUAL REPORTS_CISC",
+    "B": "BOOKS",
+    "C": "Census",
+    "CDS": "CONFERENCE/DIALOGUES/SYMPOSIUM/SEMINAR",
+    "DP": "DISCUSSION PAPER SERIES",
+    "J": "JOURNAL",
+    "M": "Manuals",
+    "MS": "MONOGRAPH SERIES",
+    "P": "PROCEEDINGS",
+    "PAM": "PAMPHLETS",
+}
+
+CLASSIFICATIONS = ["Student", "Faculty", "REPS", "Other"]
+WORDS = [
+    "agrarian", "reform", "forestry", "development", "policy", "rural", "land", "census",
+    "survey", "program", "annual", "report", "philippines", "community", "water", "farm",
+    "economics", "studies", "planning", "sustainable", "social", "integrated", "review",
+]
+
+
+def book_title(rng, number):
+    return f"{number}. " + " ".join(rng.choice(WORDS).title() for _ in range(rng.randint(3, 8)))
+
+
+def generate_books(rng, count):
+    codes = list(CATEGORIES)
+    for n in range(1, count + 1):
+        code = codes[n % len(codes)]
+        yield (
+            book_title(rng, n),
+            f"{code}{n}",
+            f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}",
+            rng.choice([0] + list(range(1960, 2025))),
+            CATEGORIES[code],
+            rng.randint(1, 5),
+        )
+
+
+def generate_loans(rng, book_ids, count, years=10):
+    start = datetime.now() - timedelta(days=365 * years)
+    span_minutes = 365 * years * 24 * 60
+    offsets = sorted(rng.randrange(span_minutes) for _ in range(count))
+    for offset in offsets:
+        borrowed = start + timedelta(minutes=offset)
+        returned = None
+        if rng.random() < 0.95:
+            returned = (borrowed + timedelta(days=rng.randint(1, 60))).strftime("%Y-%m-%d %H:%M")
+        yield (
+            rng.choice(book_ids),
+            f"Borrower {rng.randrange(count // 10 + 1)}",
+            f"0917{rng.randrange(10 ** 7):07d}",
+            f"patron{rng.randrange(10 ** 6)}@example.com",
+            rng.choice(["Male", "Female"]),
+            rng.choice(CLASSIFICATIONS),
+            borrowed.strftime("%Y-%m-%d %H:%M"),
+            returned,
+        )
+
+
+def generate_library_db(path, books=10000, loans=50000, seed=0):
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS Library (BK_NAME TEXT, BK_ID TEXT PRIMARY KEY NOT NULL, AUTHOR_NAME TEXT, YEAR_PUBLISHED INTEGER, CATEGORY TEXT, TOTAL_COPIES INTEGER, AVAILABLE_COPIES INTEGER, BK_STATUS TEXT)'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS Borrowers (BORROWER_ID INTEGER PRIMARY KEY AUTOINCREMENT, BK_ID TEXT NOT NULL, BORROWER_NAME TEXT, CONTACT_NUMBER TEXT, EMAIL TEXT, GENDER TEXT, CLASSIFICATION TEXT, DATE_BORROWED TEXT, DATE_RETURNED TEXT, FOREIGN KEY (BK_ID) REFERENCES Library (BK_ID))'
+    )
+    connection.executemany(
+        "INSERT INTO Library (BK_NAME, BK_ID, AUTHOR_NAME, YEAR_PUBLISHED, CATEGORY, TOTAL_COPIES, AVAILABLE_COPIES, BK_STATUS) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, 'Available')",
+        (book + (book[5],) for book in generate_books(rng, books)),
+    )
+    book_ids = [row[0] for row in connection.execute("SELECT BK_ID FROM Library")]
+    connection.executemany(
+        "INSERT INTO Borrowers (BK_ID, BORROWER_NAME, CONTACT_NUMBER, EMAIL, GENDER, CLASSIFICATION, DATE_BORROWED, DATE_RETURNED) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        generate_loans(rng, book_ids, loans),
+    )
+
+    # Keep the aggregate counts consistent with the open loans we just generated.
+    connection.execute("""
+        UPDATE Library SET
+            TOTAL_COPIES = MAX(TOTAL_COPIES, open_loans),
+            AVAILABLE_COPIES = MAX(TOTAL_COPIES, open_loans) - open_loans,
+            BK_STATUS = CASE WHEN MAX(TOTAL_COPIES, open_loans) - open_loans > 0 THEN 'Available' ELSE 'Fully Issued' END
+        FROM (SELECT BK_ID AS loan_bk_id, COUNT(*) AS open_loans FROM Borrowers WHERE DATE_RETURNED IS NULL GROUP BY BK_ID)
+        WHERE BK_ID = loan_bk_id
+    """)
+    connection.commit()
+    connection.close()
+    return path
+
+
+def generate_workbook(path, books=10000, seed=0):
+    rng = random.Random(seed)
+    codes = list(CATEGORIES)
+    per_sheet = {code: [] for code in codes}
+    for n in range(1, books + 1):
+        code = codes[n % len(codes)]
+        per_sheet[code].append((
+            len(per_sheet[code]) + 1,
+            book_title(rng, len(per_sheet[code]) + 1),
+            f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}",
+            rng.choice(["", 1975, 1990, 2005, 2019]),
+            rng.choice([1, 2, 3, "NO COPIES FOUND"]),
+        ))
+
+    # Same layout as the master workbook: a Categories_Key sheet, then one sheet
+    # per category code with a few banner rows above the real header.
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({"CODE": codes, "TITLE": [CATEGORIES[code] for code in codes]}).to_excel(
+            writer, sheet_name="Categories_Key", index=False
+        )
+        for code, rows in per_sheet.items():
+            sheet_name = code.replace("_CISC", " (CISC)")
+            banner = pd.DataFrame([["CISC READING ROOM"], [code], [""]])
+            banner.to_excel(writer, sheet_name=sheet_name, index=False, header=False)
+            frame = pd.DataFrame(rows, columns=[f"{code} No.", "Title", "Author/Publisher", "Year Published", "No. of Copies"])
+            frame.to_excel(writer, sheet_name=sheet_name, index=False, startrow=len(banner))
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic library.db and/or import workbook.")
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--loans", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="path of the library.db to create")
+    parser.add_argument("--workbook", help="path of the .xlsx workbook to create")
+    args = parser.parse_args()
+
+    if args.db:
+        generate_library_db(args.db, args.books, args.loans, args.seed)
+        print(f"Wrote {args.books} books and {args.loans} loans to {args.db}")
+    if args.workbook:
+        generate_workbook(args.workbook, args.books, args.seed)
+        print(f"Wrote {args.books} books to {args.workbook}")
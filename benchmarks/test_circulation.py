@@ -0,0 +1,49 @@
+def test_scan_copy_of_deleted_book(app_module, main_window, restore_database):
+    # A deleted book keeps its copies, but scanning one must not lend it
+    restore_database()
+    cursor, connector = main_window.cursor, main_window.connector
+    cursor.execute("""
+        SELECT c.BK_ID, c.BARCODE FROM Copies c JOIN Library l ON l.BK_ID = c.BK_ID
+        WHERE l.IS_DELETED = 0 AND l.HOLDS_QUEUED = 0 AND NOT EXISTS (
+            SELECT 1 FROM Borrowers b WHERE b.COPY_ID = c.COPY_ID AND b.DATE_RETURNED IS NULL AND b.IS_DELETED = 0
+        ) LIMIT 1
+    """)
+    book_id, barcode = cursor.fetchone()
+    cursor.execute(
+        "INSERT INTO Patrons (PATRON_ID, BORROWER_NAME, CONTACT_NUMBER, EMAIL, GENDER, CLASSIFICATION) VALUES (?, ?, ?, ?, ?, ?)",
+        ("TEST-CARD", "Test Patron", "09170000000", "test@example.com", "Female", "Student"),
+    )
+    cursor.execute("UPDATE Library SET IS_DELETED = 1, DELETED_AT = '2026-01-01 00:00' WHERE BK_ID = ?", (book_id,))
+    connector.commit()
+
+    assert app_module.lookup_barcode(cursor, barcode) is None
+    assert app_module.free_copy_id(cursor, book_id) is None
+
+    circulation = main_window.circulation_widget
+    cursor.execute("SELECT COUNT(*) FROM Borrowers")
+    loans_before = cursor.fetchone()[0]
+    for code in ("TEST-CARD", barcode):
+        circulation.scan_input.setText(code)
+        circulation.handle_scan()
+    circulation.end_session()
+
+    cursor.execute("SELECT COUNT(*) FROM Borrowers")
+    assert cursor.fetchone()[0] == loans_before
+    assert circulation.history_list.item(0).text().endswith(f"Unknown barcode or patron ID: {barcode}")
+    restore_database()
+
+
+def test_catalogue_cache_sees_cancelled_hold(app_module, main_window, restore_database):
+    # Cancelling a hold recounts HOLDS_QUEUED without logging an event; the cache must still notice
+    restore_database()
+    cursor, connector = main_window.cursor, main_window.connector
+    cache = app_module.CatalogueCache()
+    book_id = cursor.execute("SELECT BK_ID FROM Library WHERE IS_DELETED = 0 LIMIT 1").fetchone()[0]
+    hold_id = app_module.place_hold(cursor, book_id, "Test Patron", "09170000000", "test@example.com", "Female", "Student")
+    connector.commit()
+    assert cache.get(cursor, book_id).holds_queued == 1
+
+    app_module.cancel_hold(cursor, hold_id)
+    connector.commit()
+    assert cache.get(cursor, book_id).holds_queued == 0
+    restore_database()
@@ -0,0 +1,22 @@
+def test_reconstruct_state_includes_the_whole_as_of_minute(app_module, main_window, restore_database):
+    # EVENT_TIME has milliseconds; an as_of of "HH:MM" still covers everything logged in that minute
+    restore_database()
+    cursor, connector = main_window.cursor, main_window.connector
+    for event_time, event_type in (("2030-01-01 12:30:45.500", "borrow"), ("2030-01-01 12:31:10.000", "delete")):
+        cursor.execute(
+            "INSERT INTO CirculationEvents (EVENT_TIME, EVENT_TYPE, ENTITY, BK_ID, BORROWER_ID, ROW_DATA) VALUES (?, ?, 'loan', 'B1', 999999, ?)",
+            (event_time, event_type, '{"BORROWER_ID": 999999, "BK_ID": "B1"}')
+        )
+    connector.commit()
+
+    def has_loan(as_of):
+        return any(row["BORROWER_ID"] == 999999 for row in app_module.reconstruct_state(cursor, "loan", as_of))
+
+    assert not has_loan("2030-01-01 12:29")
+    assert has_loan("2030-01-01 12:30")
+    assert not has_loan("2030-01-01 12:30:44")
+    assert has_loan("2030-01-01 12:30:45")
+    assert not has_loan("2030-01-01 12:31")
+    assert not has_loan("2029-12-31")
+    assert not has_loan("2030-01-01")
+    restore_database()
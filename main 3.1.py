@@ -1,25 +1,50 @@
 import sqlite3
 import pandas as pd
+import numpy as np
 import re
+import math
+import csv
+import json
+import hashlib
 import random
 import traceback
+import time
+import threading
+import asyncio
+import http.client
+import uuid
+import ipaddress
+from array import array
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs, unquote
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QLabel, QLineEdit, QTableWidget, QTableWidgetItem,
     QMessageBox, QFileDialog, QComboBox, QFormLayout, QHeaderView,
     QDialog, QGridLayout, QFrame, QStackedWidget, QDesktopWidget,
-    QAction, QMenu
+    QAction, QMenu, QListWidget, QListWidgetItem, QGroupBox, QProgressBar, QSpinBox, QCheckBox
 )
 from PyQt5.QtGui import (
-    QFont, QColor, QPixmap, QPainter, QIcon, QPalette, QBrush
+    QFont, QColor, QPixmap, QPainter, QIcon, QPalette, QBrush, QPixmapCache
 )
 import os
 import sys
-from PyQt5.QtCore import Qt, QSize
+from PyQt5.QtCore import Qt, QSize, QObject, QTimer, QThreadPool, QRunnable, pyqtSignal
 from PyQt5.QtChart import (
-    QChart, QChartView, QPieSeries, QBarSet, QBarSeries, QBarCategoryAxis, QValueAxis, QPieSlice
+    QChart, QChartView, QPieSeries, QBarSet, QBarSeries, QBarCategoryAxis, QValueAxis, QPieSlice,
+    QLineSeries, QStackedBarSeries
 )
-from datetime import datetime
+from datetime import datetime, date, timedelta
+
+# Parquet export is offered only when pyarrow is installed
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 def resource_path(relative_path):
     try:
@@ -28,9 +53,506 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
-connector = sqlite3.connect("library.db")
+# Sizes the app draws images at; --prescale-images writes these to images/<width>x<height>/
+PRESCALED_IMAGES = [
+    ("images/books.png", 70, 70), ("images/issued.png", 70, 70), ("images/students.png", 70, 70),
+    ("images/faculty.png", 70, 70), ("images/researcher.png", 70, 70), ("images/other.png", 70, 70),
+    ("images/dashboard.png", 24, 24), ("images/library.png", 24, 24), ("images/reports.png", 24, 24),
+]
+
+def prescaled_path(relative_path, width, height):
+    folder, name = os.path.split(relative_path)
+    return os.path.join(folder, f"{width}x{height}", name)
+
+def cached_pixmap(relative_path, width=None, height=None, aspect_mode=Qt.KeepAspectRatio):
+    # Images are read and smooth-scaled once, then served from QPixmapCache. A pre-scaled copy
+    # from --prescale-images is loaded as is when there is one for the requested size.
+    key = f"{relative_path}@{width}x{height}/{int(aspect_mode)}"
+    pixmap = QPixmapCache.find(key)
+    if pixmap is not None:
+        return pixmap
+    pixmap = QPixmap()
+    if width and aspect_mode == Qt.KeepAspectRatio:
+        pixmap = QPixmap(resource_path(prescaled_path(relative_path, width, height)))
+    if pixmap.isNull():
+        pixmap = QPixmap(resource_path(relative_path))
+        if width and not pixmap.isNull():
+            pixmap = pixmap.scaled(width, height, aspect_mode, Qt.SmoothTransformation)
+    QPixmapCache.insert(key, pixmap)
+    return pixmap
+
+def cached_icon(relative_path, size):
+    return QIcon(cached_pixmap(relative_path, size, size))
+
+def prescale_images():
+    for relative_path, width, height in PRESCALED_IMAGES:
+        pixmap = QPixmap(resource_path(relative_path))
+        if pixmap.isNull():
+            print(f"Skipped {relative_path}: not found")
+            continue
+        target = resource_path(prescaled_path(relative_path, width, height))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        pixmap.scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation).save(target)
+        print(f"Wrote {target}")
+
+# The forms' look, parsed once for the whole application instead of every time a form opens.
+# Each form window is matched by its object name.
+FORM_STYLE = """
+    #{name}, #{name} QWidget {{
+        background-color: {background};
+        font-family: Helvetica;
+    }}
+    #{name} QLabel {{
+        font-size: 14px;
+        color: {label_color};
+    }}
+    #{name} QPushButton {{
+        border-radius: 5px;
+        padding: 10px;
+        font-size: 14px;
+        color: white;
+    }}
+"""
+FORM_INPUT_STYLE = """
+    #{name} QLineEdit, #{name} QComboBox {{
+        border: 2px solid {border};
+        border-radius: 5px;
+        padding: 8px;
+        font-size: 14px;
+        background-color: white;
+        color: black;
+    }}
+"""
+FORM_WINDOWS = [
+    # object name, background, label colour, input border (None: the form has no inputs)
+    ("addBookWindow", "white", "#2C3E50", "#3498DB"),
+    ("updateBookWindow", "white", "black", "#3498DB"),
+    ("borrowWindow", "#F5F5F5", "#2C3E50", "#3498DB"),
+    ("returnWindow", "#F9F9F9", "#2C3E50", None),
+    ("editBorrowerWindow", "white", "#2C3E50", "#219150"),
+]
+APP_STYLESHEET = "".join(
+    FORM_STYLE.format(name=name, background=background, label_color=label_color)
+    + (FORM_INPUT_STYLE.format(name=name, border=border) if border else "")
+    for name, background, label_color, border in FORM_WINDOWS
+) + """
+    #updateBookWindow QPushButton#updateButton {
+        background-color: #3498DB;
+    }
+    #updateBookWindow QPushButton#updateButton:hover {
+        background-color: #2980B9;
+    }
+    #updateBookWindow QPushButton#cancelButton {
+        background-color: #E74C3C;
+    }
+    #updateBookWindow QPushButton#cancelButton:hover {
+        background-color: #C0392B;
+    }
+    #borrowWindow QPushButton {
+        background-color: #3498DB;
+    }
+    #borrowWindow QPushButton:hover {
+        background-color: #2980B9;
+    }
+"""
+
+def add_column_if_missing(cursor, table, column, definition):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
+class BookIdAllocator:
+    # Remembers the next free "_n" suffix per base ID so repeated collisions
+    # don't re-probe from 1 every time.
+    def __init__(self, existing_ids=()):
+        self.used = set()
+        self.next_suffix = {}
+        self.next_unknown = 1
+        self.add(existing_ids)
+
+    @classmethod
+    def from_database(cls, cursor):
+        # Deleted books keep their IDs reserved, so a new book never takes over their copies, loans or history
+        cursor.execute("SELECT BK_ID FROM Library")
+        return cls(row[0] for row in cursor.fetchall())
+
+    def add(self, book_ids):
+        for book_id in book_ids:
+            self.used.add(book_id)
+            match = re.match(r"^(.+)_(\d+)$", book_id)
+            if match:
+                base_id, suffix = match.group(1), int(match.group(2))
+                if base_id == "UNKNOWN":
+                    self.next_unknown = max(self.next_unknown, suffix + 1)
+                else:
+                    self.next_suffix[base_id] = max(self.next_suffix.get(base_id, 1), suffix + 1)
+
+    def unknown_id(self):
+        while f"UNKNOWN_{self.next_unknown}" in self.used:
+            self.next_unknown += 1
+        new_id = f"UNKNOWN_{self.next_unknown}"
+        self.next_unknown += 1
+        return new_id
+
+    def allocate(self, base_id):
+        unique_id = base_id
+        if unique_id in self.used:
+            counter = self.next_suffix.get(base_id, 1)
+            while f"{base_id}_{counter}" in self.used:
+                counter += 1
+            unique_id = f"{base_id}_{counter}"
+            self.next_suffix[base_id] = counter + 1
+        self.used.add(unique_id)
+        return unique_id
+
+    def allocate_series(self, raw_ids, category_code):
+        cleaned = raw_ids.astype(str).str.strip().str.replace(r"[^a-zA-Z0-9_-]", "", regex=True)
+        unknown = cleaned.isin(["-", "", "nan"])
+        numeric = cleaned.str.extract(r"(\d+)", expand=False)
+        base_ids = (f"{category_code}" + numeric.fillna(cleaned)).astype(object)
+        base_ids.loc[unknown] = [self.unknown_id() for _ in range(int(unknown.sum()))]
+
+        # Only IDs that clash within the sheet or with known IDs go through the
+        # suffix allocator; the rest are accepted in one vectorized step.
+        clashing = base_ids.duplicated(keep=False) | base_ids.isin(self.used)
+        self.used.update(base_ids[~clashing])
+        base_ids.loc[clashing] = [self.allocate(base_id) for base_id in base_ids[clashing]]
+        return base_ids
+
+
+class QueryProfiler:
+    def __init__(self, slow_ms=200, log_path="slow_queries.log", max_samples=1000):
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self.max_samples = max_samples
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def query_shape(sql):
+        shape = re.sub(r"'(?:[^']|'')*'", "?", sql)
+        shape = re.sub(r"\b\d+(\.\d+)?\b", "?", shape)
+        shape = re.sub(r"\(\s*\?(\s*,\s*\?)*\s*\)", "(?)", shape)
+        return " ".join(shape.split())
+
+    def record(self, shape, seconds, rows, new_call):
+        with self.lock:
+            entry = self.stats.get(shape)
+            if entry is None:
+                entry = self.stats[shape] = {"calls": 0, "rows": 0, "total": 0.0, "samples": deque(maxlen=self.max_samples)}
+            entry["total"] += seconds
+            entry["rows"] += rows
+            if new_call or not entry["samples"]:
+                entry["calls"] += 1
+                entry["samples"].append(seconds)
+            else:
+                # Rows are produced lazily, so fetch time belongs to the same call.
+                entry["samples"][-1] += seconds
+            return entry["samples"][-1]
+
+    def log_slow(self, connection, sql, parameters, seconds, rows):
+        plan = []
+        if sql.lstrip().split(None, 1)[0].upper() in ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT"):
+            try:
+                plan = [row[-1] for row in sqlite3.Cursor(connection).execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+            except sqlite3.Error as e:
+                plan = [f"(no plan: {e})"]
+
+        print(f"Slow query ({seconds * 1000:.1f} ms, {rows} rows): {self.query_shape(sql)}")
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as log_file:
+                log_file.write(f"{datetime.now():%Y-%m-%d %H:%M:%S} {seconds * 1000:.1f} ms, {rows} rows\n")
+                log_file.write(f"    {' '.join(sql.split())}\n")
+                if parameters:
+                    log_file.write(f"    params: {parameters!r}\n")
+                for step in plan:
+                    log_file.write(f"    plan: {step}\n")
+        except OSError as e:
+            print(f"Error writing slow query log: {e}")
+
+    def summary(self):
+        rows = []
+        with self.lock:
+            for shape, entry in self.stats.items():
+                samples = sorted(entry["samples"])
+                percentile = lambda p: samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))] * 1000
+                rows.append({
+                    "shape": shape, "calls": entry["calls"], "rows": entry["rows"],
+                    "total_ms": entry["total"] * 1000, "p50_ms": percentile(50),
+                    "p95_ms": percentile(95), "p99_ms": percentile(99), "max_ms": samples[-1] * 1000,
+                })
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return rows
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+    def dump(self, out=None):
+        out = out or sys.stdout
+        out.write(f"{'calls':>7} {'rows':>9} {'total ms':>10} {'p50':>8} {'p95':>8} {'p99':>8}  query\n")
+        for row in self.summary():
+            out.write(f"{row['calls']:>7} {row['rows']:>9} {row['total_ms']:>10.1f} {row['p50_ms']:>8.2f} "
+                      f"{row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}  {row['shape']}\n")
+
+
+query_profiler = QueryProfiler(float(os.environ.get("LIBRARY_SLOW_QUERY_MS", 200)))
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._begin_profile(sql, parameters, time.perf_counter() - start)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        # The first parameter set stands in for the batch when a slow one is EXPLAINed
+        first = []
+
+        def remember_first(seq_of_parameters):
+            for parameters in seq_of_parameters:
+                if not first:
+                    first.append(parameters)
+                yield parameters
+
+        start = time.perf_counter()
+        super().executemany(sql, remember_first(seq_of_parameters))
+        self._begin_profile(sql, first[0] if first else (), time.perf_counter() - start)
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._continue_profile(time.perf_counter() - start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._continue_profile(time.perf_counter() - start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._continue_profile(time.perf_counter() - start, len(rows))
+        return rows
+
+    def _begin_profile(self, sql, parameters, seconds):
+        self._profile_sql = sql
+        self._profile_params = parameters
+        self._profile_shape = query_profiler.query_shape(sql)
+        self._profile_rows = max(self.rowcount, 0)
+        self._profile_logged = False
+        self._check_slow(query_profiler.record(self._profile_shape, seconds, self._profile_rows, True))
+
+    def _continue_profile(self, seconds, rows):
+        if getattr(self, "_profile_shape", None) is None:
+            return
+        self._profile_rows += rows
+        self._check_slow(query_profiler.record(self._profile_shape, seconds, rows, False))
+
+    def _check_slow(self, elapsed):
+        if self._profile_logged or elapsed * 1000 < query_profiler.slow_ms:
+            return
+        self._profile_logged = True
+        query_profiler.log_slow(self.connection, self._profile_sql, self._profile_params, elapsed, self._profile_rows)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def json_default(value):
+    # numpy scalars from the Excel import, dates passed as parameters
+    if hasattr(value, "item"):
+        return value.item()
+    if isinstance(value, (date, datetime)):
+        return str(value)
+    raise TypeError(f"Cannot send {type(value).__name__} to the library server")
+
+
+# Statements that change the schema or open other files; the library server refuses them from desks
+SCHEMA_STATEMENTS = ("CREATE", "DROP", "ALTER", "ATTACH", "DETACH", "REINDEX", "VACUUM")
+
+def statement_keyword(sql):
+    words = sql.lstrip().split(None, 1)
+    return words[0].upper() if words else ""
+
+
+class RemoteCursor:
+    # Stands in for sqlite3.Cursor when the app talks to a library server; each
+    # execute is one request and the whole result comes back with it.
+    arraysize = 1
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.position = 0
+        self.lastrowid = None
+        self.rowcount = -1
+        self.description = None
+
+    def execute(self, sql, parameters=()):
+        if statement_keyword(sql) in SCHEMA_STATEMENTS:
+            # The server owns the schema and sets it up when it starts, so the desk's own setup is skipped
+            self._load({"rows": [], "lastrowid": None, "rowcount": -1, "columns": None})
+            return self
+        params = parameters if isinstance(parameters, dict) else list(parameters)
+        self._load(self.connection.request("/query", {"sql": sql, "params": params}))
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._load(self.connection.request("/query", {"sql": sql, "many": [list(params) for params in seq_of_parameters]}))
+        return self
+
+    def _load(self, result):
+        self.rows = [tuple(row) for row in result["rows"]]
+        self.position = 0
+        self.lastrowid = result["lastrowid"]
+        self.rowcount = result["rowcount"]
+        self.description = result["columns"] and tuple((name, None, None, None, None, None, None) for name in result["columns"])
+
+    def fetchone(self):
+        if self.position >= len(self.rows):
+            return None
+        self.position += 1
+        return self.rows[self.position - 1]
+
+    def fetchmany(self, size=None):
+        rows = self.rows[self.position:self.position + (size or self.arraysize)]
+        self.position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self.rows = []
+
+
+class RemoteConnection:
+    # The sqlite3.Connection methods the app uses, forwarded to a LibraryServer over HTTP.
+    # The session ID lets the server keep this client's uncommitted writes together.
+    def __init__(self, url, token=None, timeout=60):
+        parts = urlsplit(url)
+        self.url = url
+        self.token = token or os.environ.get("LIBRARY_SERVER_TOKEN")
+        self.session = uuid.uuid4().hex
+        self.http = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+        self.lock = threading.Lock()
+
+    def request(self, path, payload=None, method="POST"):
+        body = json.dumps(payload or {}, default=json_default).encode("utf-8")
+        headers = {"Content-Type": "application/json", "X-Library-Session": self.session}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+
+        with self.lock:
+            try:
+                try:
+                    self.http.request(method, path, body, headers)
+                    response = self.http.getresponse()
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    # The server dropped an idle keep-alive connection before this request reached it
+                    self.http.close()
+                    self.http.request(method, path, body, headers)
+                    response = self.http.getresponse()
+                result = json.loads(response.read())
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                self.http.close()
+                raise sqlite3.OperationalError(f"Library server {self.url} unreachable: {e}")
+
+        if response.status != 200:
+            error = getattr(sqlite3, result.get("error", ""), None)
+            if not (isinstance(error, type) and issubclass(error, sqlite3.Error)):
+                error = sqlite3.OperationalError
+            raise error(result.get("message", response.reason))
+        return result
+
+    def cursor(self):
+        return RemoteCursor(self)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        self.request("/commit")
+
+    def rollback(self):
+        self.request("/rollback")
+
+    def close(self):
+        self.http.close()
+
+
+def open_library_connection(database_path="library.db"):
+    # With LIBRARY_SERVER_URL set the app works through a library server instead of opening the file
+    server_url = os.environ.get("LIBRARY_SERVER_URL")
+    if server_url and "--serve" not in sys.argv:
+        return RemoteConnection(server_url)
+    return sqlite3.connect(database_path, factory=ProfiledConnection)
+
+
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "afs", "ncpfs", "9p", "fuse.sshfs", "davfs", "ceph", "glusterfs"}
+
+def on_local_disk(path):
+    # True unless the file sits on a network share: a UNC path or mapped network drive on Windows,
+    # or an NFS/SMB-style mount elsewhere. Platforms we cannot ask are taken to be local.
+    path = os.path.abspath(path)
+    if sys.platform == "win32":
+        if path.startswith("\\\\"):
+            return False
+        import ctypes
+        return ctypes.windll.kernel32.GetDriveTypeW(os.path.splitdrive(path)[0] + "\\") != 4  # DRIVE_REMOTE
+    try:
+        with open("/proc/mounts", encoding="utf-8") as mounts:
+            entries = [line.split()[1:3] for line in mounts if len(line.split()) > 2]
+    except OSError:
+        return True
+    mount_point, filesystem = max(
+        ((point, kind) for point, kind in entries if path == point or path.startswith(point.rstrip("/") + "/")),
+        key=lambda entry: len(entry[0]), default=("/", "")
+    )
+    return filesystem not in NETWORK_FILESYSTEMS
+
+connector = open_library_connection("library.db")
 cursor = connector.cursor()
 
+# WAL lets the background readers (the pages' query threads, scheduled reports, the server's reader pool)
+# read while a desk commits; with a rollback journal a long read holds its lock until it finishes and a
+# borrow or return waits for it. WAL's shared-memory index only works when every process is on the same
+# machine, so it is used when library.db is on a local disk, never on a network share. LIBRARY_WAL=0 keeps
+# the rollback journal (for a folder other desks open over the network); LIBRARY_WAL=1 forces WAL.
+if isinstance(connector, sqlite3.Connection):
+    wal_setting = os.environ.get("LIBRARY_WAL")
+    if "--serve" in sys.argv or wal_setting == "1" or (wal_setting != "0" and on_local_disk("library.db")):
+        connector.execute("PRAGMA journal_mode = WAL")
+    else:
+        try:
+            # Files switched to WAL by earlier versions go back to a rollback journal once no one else has them open
+            connector.execute("PRAGMA journal_mode = DELETE")
+        except sqlite3.OperationalError:
+            pass
+
 connector.execute(
     'CREATE TABLE IF NOT EXISTS Library (BK_NAME TEXT, BK_ID TEXT PRIMARY KEY NOT NULL, AUTHOR_NAME TEXT, YEAR_PUBLISHED INTEGER, CATEGORY TEXT, TOTAL_COPIES INTEGER, AVAILABLE_COPIES INTEGER, BK_STATUS TEXT)'
 )
@@ -39,6 +561,1814 @@ cursor.execute(
     'CREATE TABLE IF NOT EXISTS Borrowers (BORROWER_ID INTEGER PRIMARY KEY AUTOINCREMENT, BK_ID TEXT NOT NULL, BORROWER_NAME TEXT, CONTACT_NUMBER TEXT, EMAIL TEXT, GENDER TEXT, CLASSIFICATION TEXT, DATE_BORROWED TEXT, DATE_RETURNED TEXT, FOREIGN KEY (BK_ID) REFERENCES Library (BK_ID))'
 )
 
+# Content hashes from the last merge import, used to skip unchanged sheets and rows
+cursor.execute(
+    'CREATE TABLE IF NOT EXISTS ImportSheets (WORKBOOK TEXT NOT NULL, SHEET_NAME TEXT NOT NULL, CONTENT_HASH TEXT, IMPORTED_AT TEXT, PRIMARY KEY (WORKBOOK, SHEET_NAME))'
+)
+
+cursor.execute(
+    'CREATE TABLE IF NOT EXISTS ImportRows (BK_ID TEXT PRIMARY KEY NOT NULL, WORKBOOK TEXT, SHEET_NAME TEXT, ROW_HASH TEXT)'
+)
+
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_importrows_sheet ON ImportRows (WORKBOOK, SHEET_NAME)')
+
+# Where in its sheet an imported book came from: the sheet's own ID cell, numbered when the sheet repeats it
+add_column_if_missing(cursor, "ImportRows", "ROW_KEY", "TEXT")
+
+IMPORT_ROWS_UPSERT = """
+    INSERT INTO ImportRows (BK_ID, WORKBOOK, SHEET_NAME, ROW_KEY, ROW_HASH) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(BK_ID) DO UPDATE SET WORKBOOK = excluded.WORKBOOK, SHEET_NAME = excluded.SHEET_NAME,
+        ROW_KEY = excluded.ROW_KEY, ROW_HASH = excluded.ROW_HASH
+"""
+
+# Books and loans are soft-deleted so their history stays auditable; listings skip IS_DELETED rows
+for table in ("Library", "Borrowers"):
+    add_column_if_missing(cursor, table, "IS_DELETED", "INTEGER NOT NULL DEFAULT 0")
+    add_column_if_missing(cursor, table, "DELETED_AT", "TEXT")
+
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_library_live ON Library (BK_ID) WHERE IS_DELETED = 0')
+
+# Inventory facet filters: category (with a year range) or a year range alone, and the grouped
+# facet count query reads the first index without touching the table
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_library_facets ON Library (CATEGORY, YEAR_PUBLISHED, BK_STATUS, AVAILABLE_COPIES) WHERE IS_DELETED = 0')
+
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_library_year ON Library (YEAR_PUBLISHED, BK_STATUS, AVAILABLE_COPIES) WHERE IS_DELETED = 0')
+
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_borrowers_live ON Borrowers (BORROWER_ID) WHERE IS_DELETED = 0')
+
+# Loan periods per borrower classification; anything unlisted uses "Other"
+cursor.execute(
+    'CREATE TABLE IF NOT EXISTS LoanPolicies (CLASSIFICATION TEXT PRIMARY KEY NOT NULL, LOAN_DAYS INTEGER NOT NULL)'
+)
+cursor.executemany(
+    'INSERT OR IGNORE INTO LoanPolicies (CLASSIFICATION, LOAN_DAYS) VALUES (?, ?)',
+    [("Student", 7), ("Faculty", 30), ("REPS", 14), ("Other", 7)]
+)
+
+add_column_if_missing(cursor, "Borrowers", "DUE_DATE", "TEXT")
+
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_borrowers_open_due ON Borrowers (DUE_DATE) WHERE DATE_RETURNED IS NULL')
+
+# Columns the Inventory and Reports tables sort on. Index entries end with the rowid (the Borrower ID
+# for loans), which is also the page key, so each sorted page is a single index range scan.
+for index_name, table, column in [
+    ("idx_borrowers_borrowed", "Borrowers", "DATE_BORROWED"),
+    ("idx_borrowers_returned", "Borrowers", "DATE_RETURNED"),
+    ("idx_borrowers_due", "Borrowers", "DUE_DATE"),
+    ("idx_borrowers_name", "Borrowers", "BORROWER_NAME"),
+    ("idx_library_title", "Library", "BK_NAME"),
+    ("idx_library_author", "Library", "AUTHOR_NAME"),
+]:
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({column}) WHERE IS_DELETED = 0')
+
+cursor.execute("""
+    UPDATE Borrowers SET DUE_DATE = date(substr(DATE_BORROWED, 1, 10), '+' || IFNULL(
+        (SELECT LOAN_DAYS FROM LoanPolicies p WHERE p.CLASSIFICATION = Borrowers.CLASSIFICATION),
+        (SELECT LOAN_DAYS FROM LoanPolicies WHERE CLASSIFICATION = 'Other')
+    ) || ' days')
+    WHERE DUE_DATE IS NULL AND DATE_RETURNED IS NULL
+""")
+
+# FIFO reservation queue per book; a hold is waiting until LOAN_ID points at the loan it became
+cursor.execute(
+    'CREATE TABLE IF NOT EXISTS Holds (HOLD_ID INTEGER PRIMARY KEY AUTOINCREMENT, BK_ID TEXT NOT NULL, BORROWER_NAME TEXT, CONTACT_NUMBER TEXT, EMAIL TEXT, GENDER TEXT, CLASSIFICATION TEXT, QUEUED_AT TEXT NOT NULL, LOAN_ID INTEGER, ASSIGNED_AT TEXT, FOREIGN KEY (BK_ID) REFERENCES Library (BK_ID))'
+)
+
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_holds_queue ON Holds (BK_ID, QUEUED_AT) WHERE LOAN_ID IS NULL')
+
+# One row per physical copy; open loans point at the copy that is out
+cursor.execute(
+    'CREATE TABLE IF NOT EXISTS Copies (COPY_ID INTEGER PRIMARY KEY AUTOINCREMENT, BK_ID TEXT NOT NULL, BARCODE TEXT UNIQUE, ADDED_AT TEXT, FOREIGN KEY (BK_ID) REFERENCES Library (BK_ID))'
+)
+
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_copies_book ON Copies (BK_ID)')
+
+add_column_if_missing(cursor, "Borrowers", "COPY_ID", "INTEGER REFERENCES Copies (COPY_ID)")
+
+# A copy can only be on one open loan at a time; a deleted loan no longer holds its copy
+cursor.execute('DROP INDEX IF EXISTS idx_borrowers_open_copy')
+cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_borrowers_live_open_copy ON Borrowers (COPY_ID) WHERE DATE_RETURNED IS NULL AND IS_DELETED = 0 AND COPY_ID IS NOT NULL')
+
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_borrowers_open_book ON Borrowers (BK_ID) WHERE DATE_RETURNED IS NULL')
+
+# TOTAL_COPIES, AVAILABLE_COPIES and BK_STATUS are a cache of Copies and the open loans. The triggers
+# recount them from those rows (two index range counts) instead of adjusting them, so they cannot drift.
+RECOUNT_COPIES_SQL = """
+    UPDATE Library SET
+        TOTAL_COPIES = (SELECT COUNT(*) FROM Copies WHERE BK_ID = {book}),
+        AVAILABLE_COPIES = (SELECT COUNT(*) FROM Copies WHERE BK_ID = {book})
+            - (SELECT COUNT(*) FROM Borrowers WHERE BK_ID = {book} AND DATE_RETURNED IS NULL AND IS_DELETED = 0)
+    WHERE BK_ID = {book};
+"""
+
+for trigger_name, trigger_event, book_refs in [
+    ("copies_insert_counts", "AFTER INSERT ON Copies", ["NEW.BK_ID"]),
+    ("copies_delete_counts", "AFTER DELETE ON Copies", ["OLD.BK_ID"]),
+    ("borrowers_insert_counts", "AFTER INSERT ON Borrowers WHEN NEW.DATE_RETURNED IS NULL", ["NEW.BK_ID"]),
+    ("borrowers_delete_counts", "AFTER DELETE ON Borrowers WHEN OLD.DATE_RETURNED IS NULL", ["OLD.BK_ID"]),
+    ("borrowers_update_counts",
+     "AFTER UPDATE OF DATE_RETURNED, BK_ID, IS_DELETED ON Borrowers WHEN (OLD.DATE_RETURNED IS NULL) != (NEW.DATE_RETURNED IS NULL) "
+     "OR OLD.BK_ID != NEW.BK_ID OR OLD.IS_DELETED != NEW.IS_DELETED",
+     ["OLD.BK_ID", "NEW.BK_ID"]),
+]:
+    # Recreated on every start so databases from older versions pick up the current definition
+    cursor.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+    cursor.execute(
+        f"CREATE TRIGGER {trigger_name} {trigger_event} BEGIN "
+        + "".join(RECOUNT_COPIES_SQL.format(book=book) for book in book_refs)
+        + " END"
+    )
+
+cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS library_status AFTER UPDATE OF AVAILABLE_COPIES ON Library BEGIN
+        UPDATE Library SET BK_STATUS = CASE WHEN NEW.AVAILABLE_COPIES > 0 THEN 'Available' ELSE 'Fully Issued' END
+        WHERE BK_ID = NEW.BK_ID;
+    END
+""")
+
+# Copies added without a printed label get a library barcode derived from their id
+cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS copies_default_barcode AFTER INSERT ON Copies WHEN NEW.BARCODE IS NULL BEGIN
+        UPDATE Copies SET BARCODE = printf('C%08d', NEW.COPY_ID) WHERE COPY_ID = NEW.COPY_ID;
+    END
+""")
+
+# Registered library cards, so the circulation desk can lend against a scanned patron ID
+cursor.execute(
+    'CREATE TABLE IF NOT EXISTS Patrons (PATRON_ID TEXT PRIMARY KEY NOT NULL, BORROWER_NAME TEXT NOT NULL, CONTACT_NUMBER TEXT, EMAIL TEXT, GENDER TEXT, CLASSIFICATION TEXT)'
+)
+
+add_column_if_missing(cursor, "Borrowers", "PATRON_ID", "TEXT REFERENCES Patrons (PATRON_ID)")
+
+# Append-only audit log. Triggers write one event per change in the same transaction as the change,
+# with a JSON image of the row afterwards, so the log can be replicated by EVENT_ID and replayed to
+# rebuild the books and loans as they were at any time.
+cursor.execute(
+    'CREATE TABLE IF NOT EXISTS CirculationEvents (EVENT_ID INTEGER PRIMARY KEY AUTOINCREMENT, EVENT_TIME TEXT NOT NULL, EVENT_TYPE TEXT NOT NULL, ENTITY TEXT NOT NULL, BK_ID TEXT, BORROWER_ID INTEGER, ROW_DATA TEXT)'
+)
+
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_loan ON CirculationEvents (BORROWER_ID, EVENT_ID) WHERE ENTITY = \'loan\'')
+
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_book ON CirculationEvents (BK_ID, EVENT_ID) WHERE ENTITY = \'book\'')
+
+LOAN_ROW_JSON = """json_object('BORROWER_ID', {r}.BORROWER_ID, 'BK_ID', {r}.BK_ID, 'COPY_ID', {r}.COPY_ID, 'PATRON_ID', {r}.PATRON_ID,
+    'BORROWER_NAME', {r}.BORROWER_NAME, 'CONTACT_NUMBER', {r}.CONTACT_NUMBER, 'EMAIL', {r}.EMAIL, 'GENDER', {r}.GENDER,
+    'CLASSIFICATION', {r}.CLASSIFICATION, 'DATE_BORROWED', {r}.DATE_BORROWED, 'DATE_RETURNED', {r}.DATE_RETURNED,
+    'DUE_DATE', {r}.DUE_DATE, 'IS_DELETED', {r}.IS_DELETED)"""
+
+BOOK_ROW_JSON = """json_object('BK_ID', {r}.BK_ID, 'BK_NAME', {r}.BK_NAME, 'AUTHOR_NAME', {r}.AUTHOR_NAME,
+    'YEAR_PUBLISHED', {r}.YEAR_PUBLISHED, 'CATEGORY', {r}.CATEGORY, 'TOTAL_COPIES', {r}.TOTAL_COPIES, 'IS_DELETED', {r}.IS_DELETED)"""
+
+LOAN_EDIT_COLUMNS = ["BK_ID", "COPY_ID", "PATRON_ID", "BORROWER_NAME", "CONTACT_NUMBER", "EMAIL", "GENDER", "CLASSIFICATION", "DATE_BORROWED", "DUE_DATE"]
+BOOK_EDIT_COLUMNS = ["BK_NAME", "AUTHOR_NAME", "YEAR_PUBLISHED", "CATEGORY", "TOTAL_COPIES"]
+
+SOFT_DELETE_EVENT = "CASE WHEN NEW.IS_DELETED = 1 THEN 'delete' ELSE 'restore' END"
+
+for trigger_name, trigger_event, event_type, entity, row in [
+    ("events_loan_borrow", "AFTER INSERT ON Borrowers", "'borrow'", "loan", "NEW"),
+    ("events_loan_return", "AFTER UPDATE OF DATE_RETURNED ON Borrowers WHEN OLD.DATE_RETURNED IS NULL AND NEW.DATE_RETURNED IS NOT NULL", "'return'", "loan", "NEW"),
+    ("events_loan_edit", f"AFTER UPDATE OF {', '.join(LOAN_EDIT_COLUMNS)} ON Borrowers WHEN "
+        + " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in LOAN_EDIT_COLUMNS), "'edit'", "loan", "NEW"),
+    ("events_loan_delete", "AFTER UPDATE OF IS_DELETED ON Borrowers WHEN NEW.IS_DELETED != OLD.IS_DELETED", SOFT_DELETE_EVENT, "loan", "NEW"),
+    ("events_loan_purge", "AFTER DELETE ON Borrowers", "'purge'", "loan", "OLD"),
+    ("events_book_add", "AFTER INSERT ON Library", "'add'", "book", "NEW"),
+    ("events_book_edit", f"AFTER UPDATE OF {', '.join(BOOK_EDIT_COLUMNS)} ON Library WHEN "
+        + " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in BOOK_EDIT_COLUMNS), "'edit'", "book", "NEW"),
+    ("events_book_delete", "AFTER UPDATE OF IS_DELETED ON Library WHEN NEW.IS_DELETED != OLD.IS_DELETED", SOFT_DELETE_EVENT, "book", "NEW"),
+    ("events_book_purge", "AFTER DELETE ON Library", "'purge'", "book", "OLD"),
+]:
+    row_json = (LOAN_ROW_JSON if entity == "loan" else BOOK_ROW_JSON).format(r=row)
+    borrower_id = f"{row}.BORROWER_ID" if entity == "loan" else "NULL"
+    cursor.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+    cursor.execute(f"""
+        CREATE TRIGGER {trigger_name} {trigger_event} BEGIN
+            INSERT INTO CirculationEvents (EVENT_TIME, EVENT_TYPE, ENTITY, BK_ID, BORROWER_ID, ROW_DATA)
+            VALUES (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'), {event_type}, '{entity}', {row}.BK_ID, {borrower_id}, {row_json});
+        END
+    """)
+
+cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS events_append_only_update BEFORE UPDATE ON CirculationEvents BEGIN
+        SELECT RAISE(ABORT, 'CirculationEvents is append-only');
+    END
+""")
+cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS events_append_only_delete BEFORE DELETE ON CirculationEvents BEGIN
+        SELECT RAISE(ABORT, 'CirculationEvents is append-only');
+    END
+""")
+
+# High-water marks of incremental exports: the last CirculationEvents row each export has shipped
+cursor.execute(
+    'CREATE TABLE IF NOT EXISTS ExportState (EXPORT_NAME TEXT PRIMARY KEY NOT NULL, LAST_EVENT_ID INTEGER NOT NULL DEFAULT 0, LAST_EXPORTED_AT TEXT, FILE_PATH TEXT)'
+)
+
+# Scheduled report jobs; SCHEDULE is a cron expression ("0 18 * * 1-5") or @daily/@weekly/@monthly
+cursor.execute(
+    'CREATE TABLE IF NOT EXISTS ReportJobs (JOB_ID INTEGER PRIMARY KEY AUTOINCREMENT, JOB_NAME TEXT NOT NULL UNIQUE, SCHEDULE TEXT NOT NULL, PERIOD TEXT NOT NULL DEFAULT \'All\', STATUS_FILTER TEXT NOT NULL DEFAULT \'All\', EXPORT_FORMAT TEXT NOT NULL DEFAULT \'Excel\', DESTINATION TEXT NOT NULL DEFAULT \'reports\', ENABLED INTEGER NOT NULL DEFAULT 1, NEXT_RUN_AT TEXT, LAST_RUN_AT TEXT, LAST_RESULT TEXT)'
+)
+
+# The first run records what already exists as a baseline to replay from
+cursor.execute("SELECT 1 FROM CirculationEvents LIMIT 1")
+if cursor.fetchone() is None:
+    cursor.execute(f"""
+        INSERT INTO CirculationEvents (EVENT_TIME, EVENT_TYPE, ENTITY, BK_ID, BORROWER_ID, ROW_DATA)
+        SELECT strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'), 'baseline', 'book', BK_ID, NULL, {BOOK_ROW_JSON.format(r='Library')}
+        FROM Library
+    """)
+    cursor.execute(f"""
+        INSERT INTO CirculationEvents (EVENT_TIME, EVENT_TYPE, ENTITY, BK_ID, BORROWER_ID, ROW_DATA)
+        SELECT strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'), 'baseline', 'loan', BK_ID, BORROWER_ID, {LOAN_ROW_JSON.format(r='Borrowers')}
+        FROM Borrowers ORDER BY BORROWER_ID
+    """)
+
+# Waiting holds per book, kept next to AVAILABLE_COPIES so the inventory never counts the queue
+if add_column_if_missing(cursor, "Library", "HOLDS_QUEUED", "INTEGER NOT NULL DEFAULT 0"):
+    cursor.execute("""
+        UPDATE Library SET HOLDS_QUEUED = (SELECT COUNT(*) FROM Holds h WHERE h.BK_ID = Library.BK_ID AND h.LOAN_ID IS NULL)
+    """)
+
+# The cached counts change without an event (copy and hold recounts), so each change stamps the
+# book with a new VERSION; one row per book, so the table stays the size of the catalogue
+cursor.execute('CREATE TABLE IF NOT EXISTS BookVersions (BK_ID TEXT PRIMARY KEY NOT NULL, VERSION INTEGER NOT NULL)')
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_book_versions ON BookVersions (VERSION)')
+# No OR REPLACE here: inside a trigger the conflict policy of the outer statement (an import's upsert) wins
+cursor.execute("DROP TRIGGER IF EXISTS library_counts_version")
+cursor.execute("""
+    CREATE TRIGGER library_counts_version AFTER UPDATE OF TOTAL_COPIES, AVAILABLE_COPIES, HOLDS_QUEUED, BK_STATUS ON Library
+    WHEN OLD.TOTAL_COPIES IS NOT NEW.TOTAL_COPIES OR OLD.AVAILABLE_COPIES IS NOT NEW.AVAILABLE_COPIES
+        OR OLD.HOLDS_QUEUED IS NOT NEW.HOLDS_QUEUED OR OLD.BK_STATUS IS NOT NEW.BK_STATUS
+    BEGIN
+        INSERT INTO BookVersions (BK_ID, VERSION) SELECT NEW.BK_ID, 0
+        WHERE NOT EXISTS (SELECT 1 FROM BookVersions WHERE BK_ID = NEW.BK_ID);
+        UPDATE BookVersions SET VERSION = (SELECT MAX(VERSION) + 1 FROM BookVersions) WHERE BK_ID = NEW.BK_ID;
+    END
+""")
+connector.commit()
+
+
+def as_of_date(as_of=None):
+    if as_of is None:
+        return date.today().isoformat()
+    if isinstance(as_of, (date, datetime)):
+        return as_of.strftime("%Y-%m-%d")
+    return str(as_of)[:10]
+
+def loan_due_date(cursor, classification, borrowed_at=None):
+    cursor.execute("""
+        SELECT LOAN_DAYS FROM LoanPolicies
+        WHERE CLASSIFICATION IN (?, 'Other')
+        ORDER BY CLASSIFICATION = ? DESC LIMIT 1
+    """, (classification, classification))
+    row = cursor.fetchone()
+    loan_days = row[0] if row else 7
+    return ((borrowed_at or datetime.now()) + timedelta(days=loan_days)).strftime("%Y-%m-%d")
+
+def overdue_loans(cursor, as_of=None):
+    as_of = as_of_date(as_of)
+    cursor.execute("""
+        SELECT b.BORROWER_ID, b.BK_ID, l.BK_NAME, b.BORROWER_NAME, b.CONTACT_NUMBER, b.EMAIL,
+            b.CLASSIFICATION, b.DATE_BORROWED, b.DUE_DATE,
+            CAST(julianday(?) - julianday(b.DUE_DATE) AS INTEGER) AS DAYS_OVERDUE
+        FROM Borrowers b
+        LEFT JOIN Library l ON b.BK_ID = l.BK_ID
+        WHERE b.DATE_RETURNED IS NULL AND b.DUE_DATE < ? AND b.IS_DELETED = 0
+        ORDER BY b.DUE_DATE ASC
+    """, (as_of, as_of))
+    return cursor.fetchall()
+
+def count_overdue_loans(cursor, as_of=None):
+    as_of = as_of_date(as_of)
+    cursor.execute("SELECT COUNT(*) FROM Borrowers WHERE DATE_RETURNED IS NULL AND DUE_DATE < ? AND IS_DELETED = 0", (as_of,))
+    return cursor.fetchone()[0]
+
+def write_overdue_notices(cursor, file_path, as_of=None):
+    count = 0
+    with open(file_path, "w", newline="", encoding="utf-8") as notices_file:
+        writer = csv.writer(notices_file)
+        writer.writerow(["Borrower ID", "Borrower Name", "Email", "Contact", "Book ID", "Book Title",
+                         "Date Borrowed", "Due Date", "Days Overdue", "Notice"])
+        for (borrower_id, book_id, book_name, borrower_name, contact, email,
+                classification, date_borrowed, due_date, days_overdue) in overdue_loans(cursor, as_of):
+            notice = (f"Dear {borrower_name}, the book \"{book_name}\" ({book_id}) you borrowed on "
+                      f"{str(date_borrowed)[:10]} was due on {due_date} and is now {days_overdue} day(s) overdue. "
+                      f"Please return it to the CISC Reading Room.")
+            writer.writerow([borrower_id, borrower_name, email, contact, book_id, book_name,
+                             date_borrowed, due_date, days_overdue, notice])
+            count += 1
+    return count
+
+
+def sync_copies(cursor, book_ids=None):
+    # TOTAL_COPIES written by the import and the book forms is the number of copies wanted;
+    # add or remove free copies until Copies agrees with it, then recount from the rows.
+    query = """
+        SELECT BK_ID, TOTAL_COPIES - (SELECT COUNT(*) FROM Copies c WHERE c.BK_ID = l.BK_ID) FROM Library l
+        WHERE TOTAL_COPIES != (SELECT COUNT(*) FROM Copies c WHERE c.BK_ID = l.BK_ID)
+    """
+    if book_ids is None:
+        cursor.execute(query)
+    else:
+        book_ids = list(book_ids)
+        cursor.execute(query + f" AND BK_ID IN ({','.join('?' * len(book_ids))})", book_ids)
+    changes = cursor.fetchall()
+
+    added_at = datetime.now().strftime("%Y-%m-%d %H:%M")
+    cursor.executemany(
+        "INSERT INTO Copies (BK_ID, ADDED_AT) VALUES (?, ?)",
+        [(book_id, added_at) for book_id, difference in changes for _ in range(max(difference, 0))]
+    )
+    for book_id, difference in changes:
+        if difference < 0:
+            cursor.execute("""
+                DELETE FROM Copies WHERE COPY_ID IN (
+                    SELECT COPY_ID FROM Copies c WHERE c.BK_ID = ? AND NOT EXISTS (
+                        SELECT 1 FROM Borrowers b WHERE b.COPY_ID = c.COPY_ID AND b.DATE_RETURNED IS NULL AND b.IS_DELETED = 0
+                    ) ORDER BY COPY_ID DESC LIMIT ?
+                )
+            """, (book_id, -difference))
+    cursor.executemany(RECOUNT_COPIES_SQL.format(book="?"), [(book_id,) * 4 for book_id, difference in changes])
+
+    # New copies go to the oldest waiting holds before anyone else can borrow them
+    added = {book_id: difference for book_id, difference in changes if difference > 0}
+    if added:
+        cursor.execute("SELECT DISTINCT BK_ID FROM Holds WHERE LOAN_ID IS NULL")
+        for (book_id,) in cursor.fetchall():
+            for _ in range(added.get(book_id, 0)):
+                copy_id = free_copy_id(cursor, book_id)
+                if copy_id is None or assign_next_hold(cursor, book_id, copy_id) is None:
+                    break
+    return len(changes)
+
+def retire_deleted_copies(cursor, book_ids):
+    # A deleted book that an import brings back starts with new copies; its old barcodes stay retired
+    cursor.executemany(
+        "DELETE FROM Copies WHERE BK_ID = ? AND EXISTS (SELECT 1 FROM Library l WHERE l.BK_ID = Copies.BK_ID AND l.IS_DELETED = 1)",
+        [(book_id,) for book_id in book_ids]
+    )
+
+def free_copy_id(cursor, book_id):
+    # Copies of deleted books are kept with the book, but never lent
+    cursor.execute("""
+        SELECT c.COPY_ID FROM Copies c JOIN Library l ON l.BK_ID = c.BK_ID AND l.IS_DELETED = 0
+        WHERE c.BK_ID = ? AND NOT EXISTS (
+            SELECT 1 FROM Borrowers b WHERE b.COPY_ID = c.COPY_ID AND b.DATE_RETURNED IS NULL AND b.IS_DELETED = 0
+        ) ORDER BY COPY_ID LIMIT 1
+    """, (book_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def link_open_loans_to_copies(cursor):
+    # Loans made before copies were tracked are matched to any free copy of their book
+    cursor.execute("SELECT BORROWER_ID, BK_ID FROM Borrowers WHERE DATE_RETURNED IS NULL AND IS_DELETED = 0 AND COPY_ID IS NULL")
+    linked = 0
+    for borrower_id, book_id in cursor.fetchall():
+        copy_id = free_copy_id(cursor, book_id)
+        if copy_id is not None:
+            cursor.execute("UPDATE Borrowers SET COPY_ID = ? WHERE BORROWER_ID = ?", (copy_id, borrower_id))
+            linked += 1
+    return linked
+
+def lookup_barcode(cursor, barcode):
+    # One keyed lookup: the copy, its book and the open loan on it (if any)
+    cursor.execute("""
+        SELECT c.COPY_ID, c.BK_ID, l.BK_NAME, b.BORROWER_ID, b.BORROWER_NAME, b.DUE_DATE
+        FROM Copies c
+        JOIN Library l ON l.BK_ID = c.BK_ID AND l.IS_DELETED = 0
+        LEFT JOIN Borrowers b ON b.COPY_ID = c.COPY_ID AND b.DATE_RETURNED IS NULL AND b.IS_DELETED = 0
+        WHERE c.BARCODE = ?
+    """, (barcode,))
+    return cursor.fetchone()
+
+def book_copies(cursor, book_id):
+    cursor.execute("""
+        SELECT c.BARCODE, b.BORROWER_NAME, b.DUE_DATE FROM Copies c
+        LEFT JOIN Borrowers b ON b.COPY_ID = c.COPY_ID AND b.DATE_RETURNED IS NULL AND b.IS_DELETED = 0
+        WHERE c.BK_ID = ? ORDER BY c.COPY_ID
+    """, (book_id,))
+    return cursor.fetchall()
+
+# One rule for borrower contact details on every form: an optional +, then 10-15 digits
+def is_valid_phone(phone):
+    return re.match(r'^\+?\d{10,15}$', phone) is not None
+
+def is_valid_email(email):
+    return re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email) is not None
+
+def insert_loan(cursor, book_id, copy_id, borrower_name, contact_number, email, gender, classification, date_borrowed=None, patron_id=None):
+    date_borrowed = date_borrowed or datetime.now().strftime("%Y-%m-%d %H:%M")
+    cursor.execute(
+        """INSERT INTO Borrowers (BK_ID, COPY_ID, PATRON_ID, BORROWER_NAME, CONTACT_NUMBER, EMAIL, GENDER, CLASSIFICATION, DATE_BORROWED, DUE_DATE)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (book_id, copy_id, patron_id, borrower_name, contact_number, email, gender, classification, date_borrowed,
+         loan_due_date(cursor, classification, datetime.strptime(date_borrowed[:16], "%Y-%m-%d %H:%M")))
+    )
+    return cursor.lastrowid
+
+def find_patron(cursor, patron_id):
+    cursor.execute(
+        "SELECT PATRON_ID, BORROWER_NAME, CONTACT_NUMBER, EMAIL, GENDER, CLASSIFICATION FROM Patrons WHERE PATRON_ID = ?",
+        (patron_id,)
+    )
+    return cursor.fetchone()
+
+# One-time data migrations; the row in Migrations records that one has run, so later starts skip it
+cursor.execute('CREATE TABLE IF NOT EXISTS Migrations (NAME TEXT PRIMARY KEY NOT NULL, APPLIED_AT TEXT)')
+
+def run_migration(cursor, name, migrate):
+    cursor.execute("INSERT OR IGNORE INTO Migrations (NAME, APPLIED_AT) VALUES (?, ?)",
+                   (name, datetime.now().strftime("%Y-%m-%d %H:%M")))
+    if cursor.rowcount == 1:
+        migrate(cursor)
+
+run_migration(cursor, "copies", lambda cursor: (sync_copies(cursor), link_open_loans_to_copies(cursor)))
+connector.commit()
+
+
+def place_hold(cursor, book_id, borrower_name, contact_number, email, gender, classification):
+    cursor.execute(
+        """INSERT INTO Holds (BK_ID, BORROWER_NAME, CONTACT_NUMBER, EMAIL, GENDER, CLASSIFICATION, QUEUED_AT)
+        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (book_id, borrower_name, contact_number, email, gender, classification,
+         datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    )
+    hold_id = cursor.lastrowid
+    cursor.execute("UPDATE Library SET HOLDS_QUEUED = HOLDS_QUEUED + 1 WHERE BK_ID = ?", (book_id,))
+    return hold_id
+
+def cancel_hold(cursor, hold_id):
+    # Drops a waiting hold and recounts the book's queue; holds already turned into loans stay. The caller commits.
+    cursor.execute("SELECT BK_ID FROM Holds WHERE HOLD_ID = ? AND LOAN_ID IS NULL", (hold_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    book_id = row[0]
+    cursor.execute("DELETE FROM Holds WHERE HOLD_ID = ?", (hold_id,))
+    cursor.execute("UPDATE Library SET HOLDS_QUEUED = (SELECT COUNT(*) FROM Holds WHERE BK_ID = ? AND LOAN_ID IS NULL) WHERE BK_ID = ?",
+                   (book_id, book_id))
+    return book_id
+
+def hold_queue_position(cursor, hold_id):
+    # Counts only the holds ahead of this one for the same book, straight off idx_holds_queue
+    cursor.execute("""
+        SELECT COUNT(*) FROM Holds h JOIN Holds mine ON mine.HOLD_ID = ?
+        WHERE h.BK_ID = mine.BK_ID AND h.LOAN_ID IS NULL AND (h.QUEUED_AT, h.HOLD_ID) <= (mine.QUEUED_AT, mine.HOLD_ID)
+    """, (hold_id,))
+    return cursor.fetchone()[0]
+
+def waiting_holds(cursor, book_id):
+    cursor.execute("""
+        SELECT HOLD_ID, BORROWER_NAME, CONTACT_NUMBER, EMAIL, QUEUED_AT FROM Holds
+        WHERE BK_ID = ? AND LOAN_ID IS NULL ORDER BY QUEUED_AT, HOLD_ID
+    """, (book_id,))
+    return cursor.fetchall()
+
+def assign_next_hold(cursor, book_id, copy_id=None):
+    # Turns the oldest waiting hold into a loan of copy_id (or any free copy). Runs inside the
+    # caller's transaction, so a returned copy goes straight to the next patron.
+    cursor.execute("""
+        SELECT HOLD_ID, BORROWER_NAME, CONTACT_NUMBER, EMAIL, GENDER, CLASSIFICATION FROM Holds
+        WHERE BK_ID = ? AND LOAN_ID IS NULL ORDER BY QUEUED_AT, HOLD_ID LIMIT 1
+    """, (book_id,))
+    hold = cursor.fetchone()
+    if not hold:
+        return None
+
+    hold_id, borrower_name, contact_number, email, gender, classification = hold
+    assigned_at = datetime.now().strftime("%Y-%m-%d %H:%M")
+    if copy_id is None:
+        copy_id = free_copy_id(cursor, book_id)
+    loan_id = insert_loan(cursor, book_id, copy_id, borrower_name, contact_number, email, gender, classification, assigned_at)
+    cursor.execute("UPDATE Holds SET LOAN_ID = ?, ASSIGNED_AT = ? WHERE HOLD_ID = ?", (loan_id, assigned_at, hold_id))
+    cursor.execute("UPDATE Library SET HOLDS_QUEUED = HOLDS_QUEUED - 1 WHERE BK_ID = ?", (book_id,))
+    return borrower_name
+
+def return_loan(cursor, borrower_id, book_id, copy_id):
+    # Closes the loan and hands the copy to the next hold, if any; the caller commits
+    cursor.execute("UPDATE Borrowers SET DATE_RETURNED = ? WHERE BORROWER_ID = ?",
+                   (datetime.now().strftime("%Y-%m-%d %H:%M"), borrower_id))
+    return assign_next_hold(cursor, book_id, copy_id)
+
+def events_since(cursor, after_event_id=0, limit=None):
+    # Replication feed: everything after the last EVENT_ID a replica has applied
+    cursor.execute(
+        "SELECT EVENT_ID, EVENT_TIME, EVENT_TYPE, ENTITY, BK_ID, BORROWER_ID, ROW_DATA FROM CirculationEvents "
+        "WHERE EVENT_ID > ? ORDER BY EVENT_ID LIMIT ?",
+        (after_event_id, -1 if limit is None else limit)
+    )
+    return cursor.fetchall()
+
+def event_time_bound(as_of):
+    # EVENT_TIME carries milliseconds, so as_of covers the whole day, minute or second it names;
+    # returns the first EVENT_TIME after it
+    for time_format, step in (("%Y-%m-%d %H:%M:%S", timedelta(seconds=1)), ("%Y-%m-%d %H:%M", timedelta(minutes=1)),
+                              ("%Y-%m-%d", timedelta(days=1))):
+        try:
+            return (datetime.strptime(as_of, time_format) + step).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            pass
+    raise ValueError(f"Unknown time {as_of!r}: use YYYY-MM-DD[ HH:MM[:SS]]")
+
+def reconstruct_state(cursor, entity, as_of):
+    # Latest image of every book or loan at or before as_of ("YYYY-MM-DD[ HH:MM[:SS]]"), minus deleted ones
+    key = "BORROWER_ID" if entity == "loan" else "BK_ID"
+    cursor.execute(f"""
+        SELECT ROW_DATA FROM (
+            SELECT ROW_DATA, EVENT_TYPE, ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY EVENT_ID DESC) AS newest
+            FROM CirculationEvents WHERE ENTITY = ? AND EVENT_TIME < ?
+        )
+        WHERE newest = 1 AND EVENT_TYPE NOT IN ('delete', 'purge')
+    """, (entity, event_time_bound(as_of)))
+    return [json.loads(row_data) for (row_data,) in cursor.fetchall()]
+
+LOAN_EXPORT_COLUMNS = ["Borrower ID", "Book ID", "Book Title", "Borrower Name", "Contact", "Email", "Gender",
+                       "Classification", "Date Borrowed", "Date Returned", "Due Date"]
+
+LOAN_EXPORT_FIELDS = """b.BORROWER_ID, b.BK_ID, l.BK_NAME, b.BORROWER_NAME, b.CONTACT_NUMBER,
+        b.EMAIL, b.GENDER, b.CLASSIFICATION, b.DATE_BORROWED, b.DATE_RETURNED, b.DUE_DATE"""
+LOAN_EXPORT_SOURCE = """Borrowers b
+    JOIN Library l ON b.BK_ID = l.BK_ID
+    WHERE b.IS_DELETED = 0"""
+LOAN_EXPORT_SELECT = f"""
+    SELECT {LOAN_EXPORT_FIELDS}
+    FROM {LOAN_EXPORT_SOURCE}
+"""
+LOAN_EXPORT_QUERY = LOAN_EXPORT_SELECT + " ORDER BY b.BORROWER_ID ASC"
+
+def export_csv(file_path, columns, batches, append=False):
+    # Appending adds rows to the end; the header is only written to a new or empty file
+    write_header = not (append and os.path.exists(file_path) and os.path.getsize(file_path) > 0)
+    with open(file_path, "a" if append else "w", newline="", encoding="utf-8") as export_file:
+        writer = csv.writer(export_file)
+        if write_header:
+            writer.writerow(columns)
+        for rows in batches:
+            writer.writerows(rows)
+
+def export_jsonl(file_path, columns, batches, append=False):
+    with open(file_path, "a" if append else "w", encoding="utf-8") as export_file:
+        for rows in batches:
+            export_file.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+
+def export_xlsx(file_path, columns, batches):
+    # Write-only workbooks stream rows to disk instead of building the sheet in memory
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Borrowers")
+    sheet.append(columns)
+    for rows in batches:
+        for row in rows:
+            sheet.append(row)
+    workbook.save(file_path)
+
+# Parquet column types for the loan export; dates are stored as real timestamps
+LOAN_PARQUET_TYPES = {
+    "Borrower ID": "int64",
+    "Date Borrowed": "%Y-%m-%d %H:%M",
+    "Date Returned": "%Y-%m-%d %H:%M",
+    "Due Date": "%Y-%m-%d",
+}
+
+def export_parquet(file_path, columns, batches):
+    def column_array(name, values):
+        kind = LOAN_PARQUET_TYPES.get(name)
+        if kind == "int64":
+            return pa.array([None if value in (None, "") else int(value) for value in values], type=pa.int64())
+        array = pa.array([None if value is None else str(value) for value in values], type=pa.string())
+        if kind:
+            return pc.strptime(array, format=kind, unit="s", error_is_null=True)
+        return array
+
+    writer = None
+    try:
+        for rows in batches:
+            if not rows:
+                continue
+            table = pa.table({name: column_array(name, values) for name, values in zip(columns, zip(*rows))})
+            if writer is None:
+                writer = pq.ParquetWriter(file_path, table.schema, compression="zstd")
+            writer.write_table(table)
+        if writer is None:
+            pq.write_table(pa.table({name: column_array(name, []) for name in columns}), file_path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+# Name -> (file extension, save dialog filter, writer). Writers take an iterable of row batches
+# and write them as they arrive, so no format holds the whole result set in memory.
+EXPORT_FORMATS = {
+    "Excel": (".xlsx", "Excel Files (*.xlsx)", export_xlsx),
+    "CSV": (".csv", "CSV Files (*.csv)", export_csv),
+    "JSON Lines": (".jsonl", "JSON Lines (*.jsonl)", export_jsonl),
+}
+# Formats whose writers can add rows to the end of an existing file
+APPENDABLE_EXPORT_FORMATS = {"CSV", "JSON Lines"}
+if pa is not None:
+    EXPORT_FORMATS["Parquet"] = (".parquet", "Parquet Files (*.parquet)", export_parquet)
+
+def export_file_filter():
+    return ";;".join(file_filter for extension, file_filter, writer in EXPORT_FORMATS.values())
+
+def export_format_for(file_path, selected_filter=""):
+    for name, (extension, file_filter, writer) in EXPORT_FORMATS.items():
+        if file_path.lower().endswith(extension):
+            return name
+    for name, (extension, file_filter, writer) in EXPORT_FORMATS.items():
+        if selected_filter == file_filter:
+            return name
+    if file_path.lower().endswith(".parquet"):
+        raise ValueError("Parquet export needs the optional pyarrow package")
+    raise ValueError(f"Unknown export format for {file_path}: use .xlsx, .csv, .jsonl or .parquet")
+
+def fetch_batches(cursor, batch_size=5000):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+def write_export(file_path, batches, columns=LOAN_EXPORT_COLUMNS, export_format=None, append=False):
+    export_format = export_format or export_format_for(file_path)
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Export format not available: {export_format}")
+    if append and export_format not in APPENDABLE_EXPORT_FORMATS:
+        raise ValueError(f"Only CSV and JSON Lines exports can be appended to; choose a new {export_format} file")
+    extension, file_filter, writer = EXPORT_FORMATS[export_format]
+    count = 0
+
+    def counted(batches):
+        nonlocal count
+        for rows in batches:
+            count += len(rows)
+            yield rows
+
+    if append:
+        writer(file_path, columns, counted(batches), append=True)
+    else:
+        writer(file_path, columns, counted(batches))
+    return count
+
+def export_query(cursor, file_path, query, parameters=(), columns=LOAN_EXPORT_COLUMNS, export_format=None):
+    # Headless entry point: runs the query and streams it to file_path in batches
+    cursor.execute(query, parameters)
+    return write_export(file_path, fetch_batches(cursor), columns, export_format)
+
+def export_loans(cursor, file_path, export_format=None):
+    return export_query(cursor, file_path, LOAN_EXPORT_QUERY, export_format=export_format)
+
+def loans_by_id(cursor, borrower_ids, batch_size=500):
+    # One primary-key IN (...) lookup per batch of IDs, in BORROWER_ID order, typed as stored
+    borrower_ids = sorted(set(borrower_ids))
+    for start in range(0, len(borrower_ids), batch_size):
+        batch = borrower_ids[start:start + batch_size]
+        cursor.execute(
+            LOAN_EXPORT_SELECT + f" AND b.BORROWER_ID IN ({', '.join('?' * len(batch))}) ORDER BY b.BORROWER_ID ASC",
+            batch
+        )
+        yield cursor.fetchall()
+
+def export_loans_by_id(cursor, file_path, borrower_ids, export_format=None):
+    return write_export(file_path, loans_by_id(cursor, borrower_ids), export_format=export_format)
+
+REPORT_PERIODS = ["All", "This Day", "This Week", "This Month"]
+REPORT_STATUSES = ["All", "Returned", "Not Returned", "Overdue"]
+
+TABLE_PAGE_SIZE = 500
+
+def keyset_page(cursor, columns, source, params, key, sort=None, descending=False, after=None, page_size=TABLE_PAGE_SIZE):
+    # One page of `SELECT columns FROM source` in (sort, key) order. `after` is the (sort value,
+    # key value) of the last row already shown, so each page is an index range scan instead of an
+    # OFFSET that reads past every earlier row. SQLite sorts NULLs first, so a nullable sort column
+    # is read in two runs, its NULL rows by key and then the rest.
+    # Returns the rows and the `after` for the next page, or None on the last page.
+    sort = sort or key
+    order, past = ("DESC", "<") if descending else ("ASC", ">")
+    runs = ["IS NULL", "IS NOT NULL"] if sort != key else [None]
+    if descending:
+        runs.reverse()
+    if after is not None and sort != key:
+        runs = runs[runs.index("IS NULL" if after[0] is None else "IS NOT NULL"):]
+
+    rows = []
+    for run in runs:
+        condition, run_params = f" AND {sort} {run}" if run else "", []
+        if after is not None and run == runs[0]:
+            if run == "IS NULL":
+                condition += f" AND {key} {past} ?"
+                run_params = [after[1]]
+            else:
+                condition += f" AND ({sort}, {key}) {past} (?, ?)"
+                run_params = list(after)
+        cursor.execute(
+            f"SELECT {columns}, {sort}, {key} FROM {source}{condition} ORDER BY {sort} {order}, {key} {order} LIMIT ?",
+            list(params) + run_params + [page_size + 1 - len(rows)]
+        )
+        rows += cursor.fetchall()
+        if len(rows) > page_size:
+            break
+
+    next_after = tuple(rows[page_size - 1][-2:]) if len(rows) > page_size else None
+    return [row[:-2] for row in rows[:page_size]], next_after
+
+def borrower_report_filter(period="All", status="All"):
+    # The Borrower Reports filters as SQL; shared by the Reports page and scheduled report jobs
+    query = ""
+
+    if period == "This Day":
+        query += " AND substr(b.DATE_BORROWED, 1, 10) = DATE('now')"
+    elif period == "This Week":
+        query += " AND substr(b.DATE_BORROWED, 1, 10) >= DATE('now', '-6 days')"
+    elif period == "This Month":
+        query += " AND substr(b.DATE_BORROWED, 1, 7) = strftime('%Y-%m', 'now')"
+
+    if status == "Returned":
+        query += " AND b.DATE_RETURNED IS NOT NULL"
+    elif status == "Not Returned":
+        query += " AND b.DATE_RETURNED IS NULL"
+    elif status == "Overdue":
+        query += " AND b.DATE_RETURNED IS NULL AND b.DUE_DATE < DATE('now', 'localtime')"
+
+    return query
+
+def borrower_report_query(period="All", status="All"):
+    return LOAN_EXPORT_SELECT + borrower_report_filter(period, status) + " ORDER BY b.BORROWER_ID ASC"
+
+# Sortable Reports page columns, by table column (column 0 holds the checkboxes)
+REPORT_SORT_COLUMNS = [None] + [column.strip() for column in LOAN_EXPORT_FIELDS.split(",")]
+
+def borrower_report_page(cursor, period="All", status="All", sort=None, descending=False, after=None):
+    return keyset_page(cursor, LOAN_EXPORT_FIELDS, LOAN_EXPORT_SOURCE + borrower_report_filter(period, status), [],
+                       "b.BORROWER_ID", sort, descending, after)
+
+def borrower_report_count(cursor, period="All", status="All"):
+    cursor.execute(f"SELECT COUNT(*) FROM {LOAN_EXPORT_SOURCE}{borrower_report_filter(period, status)}")
+    return cursor.fetchone()[0]
+
+def export_report_loans(cursor, file_path, period="All", status="All", export_format=None):
+    return export_query(cursor, file_path, borrower_report_query(period, status), export_format=export_format)
+
+def delete_report_loans(cursor, period="All", status="All"):
+    # Soft-deletes every loan the Reports filters match in one UPDATE; each open loan's copy then
+    # goes to the holds queue first. The caller commits.
+    source = LOAN_EXPORT_SOURCE + borrower_report_filter(period, status)
+    cursor.execute(f"SELECT b.BK_ID, b.COPY_ID FROM {source} AND b.DATE_RETURNED IS NULL")
+    open_loans = cursor.fetchall()
+    cursor.execute(f"UPDATE Borrowers SET IS_DELETED = 1, DELETED_AT = ? WHERE BORROWER_ID IN (SELECT b.BORROWER_ID FROM {source})",
+                   (datetime.now().strftime("%Y-%m-%d %H:%M"),))
+    deleted = cursor.rowcount
+    for book_id, copy_id in open_loans:
+        assign_next_hold(cursor, book_id, copy_id)
+    return deleted
+
+def last_export(cursor, export_name):
+    cursor.execute("SELECT LAST_EVENT_ID, LAST_EXPORTED_AT, FILE_PATH FROM ExportState WHERE EXPORT_NAME = ?", (export_name,))
+    return cursor.fetchone() or (0, None, None)
+
+def export_loan_changes(cursor, file_path, export_name="registrar", append=False):
+    # Writes only the loans added, returned, edited or deleted since this export last ran, found by
+    # an EVENT_ID range scan of CirculationEvents, so the cost follows the day's activity rather
+    # than the size of Borrowers. The caller commits, which moves the high-water mark.
+    # Only CSV and JSON Lines can be appended to; Excel and Parquet are written as new files.
+    export_format = export_format_for(file_path)
+    if append and not os.path.exists(file_path):
+        append = False
+    last_event_id = last_export(cursor, export_name)[0]
+    cursor.execute("SELECT IFNULL(MAX(EVENT_ID), 0) FROM CirculationEvents")
+    high_water_mark = cursor.fetchone()[0]
+
+    cursor.execute("""
+        SELECT b.BORROWER_ID, b.BK_ID, l.BK_NAME, b.BORROWER_NAME, b.CONTACT_NUMBER, b.EMAIL, b.GENDER,
+            b.CLASSIFICATION, b.DATE_BORROWED, b.DATE_RETURNED, b.DUE_DATE,
+            CASE WHEN b.IS_DELETED = 1 THEN 'delete' ELSE e.EVENT_TYPE END, e.EVENT_TIME
+        FROM (
+            SELECT BORROWER_ID, EVENT_TYPE, EVENT_TIME, MAX(EVENT_ID) FROM CirculationEvents
+            WHERE EVENT_ID > ? AND EVENT_ID <= ? AND ENTITY = 'loan'
+            GROUP BY BORROWER_ID
+        ) e
+        JOIN Borrowers b ON b.BORROWER_ID = e.BORROWER_ID
+        LEFT JOIN Library l ON l.BK_ID = b.BK_ID
+        ORDER BY b.BORROWER_ID
+    """, (last_event_id, high_water_mark))
+    exported = write_export(file_path, fetch_batches(cursor), LOAN_EXPORT_COLUMNS + ["Change", "Changed At"], export_format, append)
+
+    cursor.execute("""
+        INSERT INTO ExportState (EXPORT_NAME, LAST_EVENT_ID, LAST_EXPORTED_AT, FILE_PATH) VALUES (?, ?, ?, ?)
+        ON CONFLICT(EXPORT_NAME) DO UPDATE SET LAST_EVENT_ID = excluded.LAST_EVENT_ID,
+            LAST_EXPORTED_AT = excluded.LAST_EXPORTED_AT, FILE_PATH = excluded.FILE_PATH
+    """, (export_name, high_water_mark, datetime.now().strftime("%Y-%m-%d %H:%M"), file_path))
+    return exported
+
+# Per-book truth in one pass: one grouped scan each of Copies, open loans and waiting holds
+BOOK_COUNTS_SQL = """
+    SELECT l.BK_ID, l.TOTAL_COPIES, l.AVAILABLE_COPIES, l.BK_STATUS, l.HOLDS_QUEUED,
+        IFNULL(c.copies, 0) AS copies, IFNULL(o.open_loans, 0) AS open_loans, IFNULL(h.waiting, 0) AS waiting
+    FROM Library l
+    LEFT JOIN (SELECT BK_ID, COUNT(*) AS copies FROM Copies GROUP BY BK_ID) c ON c.BK_ID = l.BK_ID
+    LEFT JOIN (SELECT BK_ID, COUNT(*) AS open_loans FROM Borrowers WHERE DATE_RETURNED IS NULL AND IS_DELETED = 0 GROUP BY BK_ID) o ON o.BK_ID = l.BK_ID
+    LEFT JOIN (SELECT BK_ID, COUNT(*) AS waiting FROM Holds WHERE LOAN_ID IS NULL GROUP BY BK_ID) h ON h.BK_ID = l.BK_ID
+"""
+
+BOOK_COUNT_MISMATCH_SQL = """
+    {t}TOTAL_COPIES != {t}copies OR {t}AVAILABLE_COPIES != {t}copies - {t}open_loans OR {t}HOLDS_QUEUED != {t}waiting
+    OR {t}BK_STATUS IS NOT (CASE WHEN {t}copies - {t}open_loans > 0 THEN 'Available' ELSE 'Fully Issued' END)
+    OR {t}open_loans > {t}copies
+"""
+
+def check_integrity(cursor):
+    issues = []
+
+    cursor.execute(f"SELECT * FROM ({BOOK_COUNTS_SQL}) WHERE {BOOK_COUNT_MISMATCH_SQL.format(t='')}")
+    for book_id, total, available, status, holds_queued, copies, open_loans, waiting in cursor.fetchall():
+        if open_loans > copies:
+            issues.append(("Over-issued book", book_id, f"{open_loans} open loans but only {copies} copies"))
+        if total != copies or available != copies - open_loans:
+            issues.append(("Copy count mismatch", book_id,
+                           f"recorded {available}/{total} available, actual {copies - open_loans}/{copies}"))
+        if holds_queued != waiting:
+            issues.append(("Hold count mismatch", book_id, f"recorded {holds_queued} waiting, actual {waiting}"))
+        if status != ("Available" if copies - open_loans > 0 else "Fully Issued"):
+            issues.append(("Status mismatch", book_id, f"status is {status!r}"))
+
+    cursor.execute("""
+        SELECT b.BORROWER_ID, b.BK_ID, b.DATE_RETURNED IS NULL FROM Borrowers b
+        WHERE b.IS_DELETED = 0 AND NOT EXISTS (SELECT 1 FROM Library l WHERE l.BK_ID = b.BK_ID)
+    """)
+    for borrower_id, book_id, is_open in cursor.fetchall():
+        issues.append(("Orphaned loan", book_id, f"Borrower ID {borrower_id}" + (" (still open)" if is_open else "")))
+
+    cursor.execute("""
+        SELECT b.BORROWER_ID, b.BK_ID, b.COPY_ID FROM Borrowers b
+        WHERE b.COPY_ID IS NOT NULL AND b.IS_DELETED = 0
+            AND NOT EXISTS (SELECT 1 FROM Copies c WHERE c.COPY_ID = b.COPY_ID AND c.BK_ID = b.BK_ID)
+    """)
+    for borrower_id, book_id, copy_id in cursor.fetchall():
+        issues.append(("Loan of unknown copy", book_id, f"Borrower ID {borrower_id} points at copy {copy_id}"))
+
+    for table, key, issue in (("Copies", "BARCODE", "Orphaned copy"), ("Holds", "HOLD_ID", "Orphaned hold")):
+        cursor.execute(f"SELECT t.{key}, t.BK_ID FROM {table} t WHERE NOT EXISTS (SELECT 1 FROM Library l WHERE l.BK_ID = t.BK_ID)")
+        for row_key, book_id in cursor.fetchall():
+            issues.append((issue, book_id, f"{key} {row_key}"))
+
+    return issues
+
+def repair_integrity(cursor):
+    # Soft-deletes loans and deletes copies and holds whose book is gone, then recomputes every
+    # cached count from the rows in a single UPDATE ... FROM. Over-issued books are only counted:
+    # which loans or copies are wrong is for a librarian to decide. The caller commits.
+    repaired = {}
+
+    cursor.execute("""
+        UPDATE Borrowers SET COPY_ID = NULL WHERE COPY_ID IS NOT NULL AND IS_DELETED = 0
+            AND NOT EXISTS (SELECT 1 FROM Copies c WHERE c.COPY_ID = Borrowers.COPY_ID AND c.BK_ID = Borrowers.BK_ID)
+    """)
+    repaired["dangling copy links"] = cursor.rowcount
+
+    cursor.execute("""
+        UPDATE Borrowers SET IS_DELETED = 1, DELETED_AT = ?
+        WHERE IS_DELETED = 0 AND NOT EXISTS (SELECT 1 FROM Library l WHERE l.BK_ID = Borrowers.BK_ID)
+    """, (datetime.now().strftime("%Y-%m-%d %H:%M"),))
+    repaired["orphaned borrowers"] = cursor.rowcount
+
+    for table in ("Holds", "Copies"):
+        cursor.execute(f"DELETE FROM {table} WHERE NOT EXISTS (SELECT 1 FROM Library l WHERE l.BK_ID = {table}.BK_ID)")
+        repaired[f"orphaned {table.lower()}"] = cursor.rowcount
+
+    cursor.execute(f"SELECT COUNT(*) FROM ({BOOK_COUNTS_SQL}) WHERE open_loans > copies")
+    repaired["over-issued books (not repaired)"] = cursor.fetchone()[0]
+
+    cursor.execute(f"""
+        UPDATE Library SET
+            TOTAL_COPIES = counts.copies,
+            AVAILABLE_COPIES = counts.copies - counts.open_loans,
+            HOLDS_QUEUED = counts.waiting,
+            BK_STATUS = CASE WHEN counts.copies - counts.open_loans > 0 THEN 'Available' ELSE 'Fully Issued' END
+        FROM ({BOOK_COUNTS_SQL}) AS counts
+        WHERE Library.BK_ID = counts.BK_ID AND counts.open_loans <= counts.copies
+            AND ({BOOK_COUNT_MISMATCH_SQL.format(t='counts.')})
+    """)
+    repaired["books recounted"] = cursor.rowcount
+    return repaired
+
+
+CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+CRON_ALIASES = {"@hourly": "0 * * * *", "@daily": "0 0 * * *", "@weekly": "0 0 * * 0", "@monthly": "0 0 1 * *"}
+
+def parse_schedule(schedule):
+    # Minute, hour, day of month, month, day of week (0 or 7 = Sunday); supports *, lists, ranges and /steps
+    fields = CRON_ALIASES.get(schedule.strip(), schedule).split()
+    if len(fields) != 5:
+        raise ValueError(f"Schedule must have 5 fields: {schedule!r}")
+
+    parsed = []
+    for field, (low, high) in zip(fields, CRON_RANGES):
+        values = set()
+        for part in field.split(","):
+            spec, _, step = part.partition("/")
+            if spec == "*":
+                start, end = low, high
+            elif "-" in spec:
+                start, end = (int(value) for value in spec.split("-", 1))
+            else:
+                start = end = int(spec)
+                if step:
+                    end = high
+            if not low <= start <= end <= high:
+                raise ValueError(f"{part!r} is out of range {low}-{high} in {schedule!r}")
+            values.update(range(start, end + 1, int(step or 1)))
+        parsed.append(values)
+
+    minutes, hours, days, months, weekdays = parsed
+    if 7 in weekdays:
+        weekdays = (weekdays - {7}) | {0}
+    # Like cron, a restricted day of month and day of week match either one
+    any_day = (fields[2] == "*", fields[4] == "*")
+    return minutes, hours, days, months, weekdays, any_day
+
+def next_run_time(schedule, after):
+    minutes, hours, days, months, weekdays, (any_dom, any_dow) = parse_schedule(schedule)
+    start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    day = start.date()
+    for _ in range(366 * 5):
+        dom_match = day.day in days
+        dow_match = day.isoweekday() % 7 in weekdays
+        if any_dom or any_dow:
+            day_match = dom_match and dow_match
+        else:
+            day_match = dom_match or dow_match
+        if day.month in months and day_match:
+            for hour in sorted(hours):
+                for minute in sorted(minutes):
+                    candidate = datetime(day.year, day.month, day.day, hour, minute)
+                    if candidate >= start:
+                        return candidate
+        day += timedelta(days=1)
+    raise ValueError(f"Schedule never runs: {schedule!r}")
+
+def add_report_job(cursor, name, schedule, period="All", status="All", export_format="Excel", destination="reports"):
+    if period not in REPORT_PERIODS or status not in REPORT_STATUSES:
+        raise ValueError(f"Unknown report filter: {period} / {status}")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    next_run = next_run_time(schedule, datetime.now())
+    cursor.execute("""
+        INSERT INTO ReportJobs (JOB_NAME, SCHEDULE, PERIOD, STATUS_FILTER, EXPORT_FORMAT, DESTINATION, NEXT_RUN_AT)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (name, schedule, period, status, export_format, destination, next_run.strftime("%Y-%m-%d %H:%M")))
+    return cursor.lastrowid
+
+def report_jobs(cursor):
+    cursor.execute("""
+        SELECT JOB_ID, JOB_NAME, SCHEDULE, PERIOD, STATUS_FILTER, EXPORT_FORMAT, DESTINATION, ENABLED,
+            NEXT_RUN_AT, LAST_RUN_AT, LAST_RESULT
+        FROM ReportJobs ORDER BY JOB_NAME
+    """)
+    return cursor.fetchall()
+
+def run_report_job(read_cursor, name, period, status, export_format, destination, now):
+    os.makedirs(destination, exist_ok=True)
+    file_path = os.path.join(destination, f"{name}_{now:%Y%m%d_%H%M}{EXPORT_FORMATS[export_format][0]}")
+    count = export_report_loans(read_cursor, file_path, period, status, export_format)
+    return file_path, count
+
+def run_due_report_jobs(database_path="library.db", now=None):
+    # Reports are read through a read-only connection; only the ReportJobs bookkeeping writes.
+    # A job that missed several runs while nothing was running runs once, and its next run
+    # is computed from now, so downtime never causes a burst of catch-up reports. Each job is
+    # claimed by moving its NEXT_RUN_AT before it runs, so two schedulers never both run it.
+    now = now or datetime.now()
+    now_text = now.strftime("%Y-%m-%d %H:%M")
+    reader = sqlite3.connect(f"file:{os.path.abspath(database_path)}?mode=ro", uri=True, factory=ProfiledConnection)
+    writer = sqlite3.connect(database_path, timeout=30)
+    results = []
+    try:
+        due_jobs = writer.execute("""
+            SELECT JOB_ID, JOB_NAME, SCHEDULE, PERIOD, STATUS_FILTER, EXPORT_FORMAT, DESTINATION, NEXT_RUN_AT
+            FROM ReportJobs WHERE ENABLED = 1 AND (NEXT_RUN_AT IS NULL OR NEXT_RUN_AT <= ?)
+        """, (now_text,)).fetchall()
+        for job_id, name, schedule, period, status, export_format, destination, next_run_at in due_jobs:
+            try:
+                next_run = next_run_time(schedule, now).strftime("%Y-%m-%d %H:%M")
+            except ValueError as e:
+                writer.execute("UPDATE ReportJobs SET ENABLED = 0, LAST_RESULT = ? WHERE JOB_ID = ?", (f"Disabled: {e}", job_id))
+                writer.commit()
+                continue
+
+            claimed = writer.execute(
+                "UPDATE ReportJobs SET NEXT_RUN_AT = ? WHERE JOB_ID = ? AND NEXT_RUN_AT IS ?", (next_run, job_id, next_run_at)
+            ).rowcount == 1
+            writer.commit()
+            if not claimed or next_run_at is None:
+                continue
+
+            try:
+                file_path, count = run_report_job(reader.cursor(), name, period, status, export_format, destination, now)
+                result = f"{count} rows to {file_path}"
+            except Exception as e:
+                result = f"Failed: {e}"
+            writer.execute("UPDATE ReportJobs SET LAST_RUN_AT = ?, LAST_RESULT = ? WHERE JOB_ID = ?", (now_text, result, job_id))
+            writer.commit()
+            results.append((name, result))
+            print(f"Report job {name}: {result}")
+    finally:
+        reader.close()
+        writer.close()
+    return results
+
+
+class ReportScheduler:
+    # Checks ReportJobs on a background thread; each check uses its own connections
+    def __init__(self, database_path="library.db", interval_seconds=30):
+        self.database_path = os.path.abspath(database_path)
+        self.interval = interval_seconds
+        self.results = deque(maxlen=50)
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="report-scheduler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+    def run_now(self):
+        self.wake.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.results.extend(run_due_report_jobs(self.database_path))
+            except sqlite3.Error as e:
+                print(f"Error running scheduled reports: {e}")
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+
+READ_STATEMENTS = ("SELECT", "WITH", "EXPLAIN", "VALUES")
+
+# Desks may read and change rows, but not the schema, other database files or connection settings.
+# ATTACH also covers VACUUM, which attaches the file it writes.
+DESK_DENIED_ACTIONS = {
+    value for name, value in vars(sqlite3).items() if name.startswith(("SQLITE_CREATE_", "SQLITE_DROP_"))
+} | {sqlite3.SQLITE_ALTER_TABLE, sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH, sqlite3.SQLITE_REINDEX}
+DESK_PRAGMAS = ("table_info", "data_version")
+
+def desk_authorizer(action, arg1, arg2, database, source):
+    if action in DESK_DENIED_ACTIONS or (action == sqlite3.SQLITE_PRAGMA and (arg1 or "").lower() not in DESK_PRAGMAS):
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+def is_loopback_host(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def rows_as_dicts(cursor, rows):
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+class LibraryServer:
+    # Owns library.db for the desk clients: one writer connection that a client keeps for
+    # the length of its transaction, a pool of read-only reader threads, and an HTTP/JSON
+    # API served by asyncio. Clients never touch the file, so there is no file locking
+    # between stations.
+    def __init__(self, database_path="library.db", host="127.0.0.1", port=8765, readers=4, token=None, lock_timeout=30):
+        if not token and not is_loopback_host(host):
+            # /query runs the SQL it is sent, so anyone who can reach the port must prove who they are
+            raise ValueError(f"Set LIBRARY_SERVER_TOKEN to serve on {host}; without a token the server only listens on 127.0.0.1")
+        self.database_path = os.path.abspath(database_path)
+        self.host = host
+        self.port = port
+        self.token = token
+        self.lock_timeout = lock_timeout
+        self.writer = sqlite3.connect(self.database_path, timeout=lock_timeout, check_same_thread=False, factory=ProfiledConnection)
+        self.writer_pool = ThreadPoolExecutor(1, thread_name_prefix="library-writer")
+        self.reader_pool = ThreadPoolExecutor(readers, thread_name_prefix="library-reader")
+        self.readers = threading.local()
+        self.writer_owner = None
+        self.preempted = set()
+        self.writer_busy = 0
+        self.owner_last_seen = 0
+        self.writer_released = None
+        self.loop = None
+        self.server = None
+        self.ready = threading.Event()
+
+    def reader_connection(self):
+        connection = getattr(self.readers, "connection", None)
+        if connection is None:
+            connection = self.readers.connection = sqlite3.connect(
+                f"file:{self.database_path}?mode=ro", uri=True, factory=ProfiledConnection
+            )
+        return connection
+
+    def run_statement(self, connection, sql, params, many=None):
+        statement = connection.cursor()
+        connection.set_authorizer(desk_authorizer)
+        try:
+            if many is not None:
+                statement.executemany(sql, many)
+            else:
+                statement.execute(sql, params)
+        finally:
+            connection.set_authorizer(None)
+        rows = statement.fetchall()
+        return {
+            "rows": rows, "lastrowid": statement.lastrowid, "rowcount": statement.rowcount,
+            "columns": [column[0] for column in statement.description] if statement.description else None,
+        }
+
+    def read_statement(self, sql, params):
+        return self.run_statement(self.reader_connection(), sql, params)
+
+    def run_read(self, operation, *args):
+        return operation(self.reader_connection().cursor(), *args)
+
+    def run_write(self, operation, *args):
+        # A whole API call in one transaction on the writer
+        try:
+            status, result = operation(self.writer.cursor(), *args)
+        except Exception:
+            self.writer.rollback()
+            raise
+        if status == 200:
+            self.writer.commit()
+        else:
+            self.writer.rollback()
+        return status, result
+
+    async def on_reader(self, function, *args):
+        return await self.loop.run_in_executor(self.reader_pool, function, *args)
+
+    async def on_writer(self, function, *args):
+        return await self.loop.run_in_executor(self.writer_pool, function, *args)
+
+    async def acquire_writer(self, session):
+        deadline = time.monotonic() + self.lock_timeout
+        while self.writer_owner not in (None, session):
+            if self.writer_busy == 0 and time.monotonic() - self.owner_last_seen > self.lock_timeout:
+                # A client that went quiet mid-transaction loses it instead of blocking every desk
+                print(f"Rolling back the idle transaction of client {self.writer_owner}")
+                await self.on_writer(self.writer.rollback)
+                # Its next statements must fail until it rolls back, or half its work would be committed
+                self.preempted.add(self.writer_owner)
+                self.release_writer()
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise sqlite3.OperationalError("database is locked")
+            self.writer_released.clear()
+            try:
+                await asyncio.wait_for(self.writer_released.wait(), min(remaining, 1))
+            except asyncio.TimeoutError:
+                pass
+        self.writer_owner = session
+        self.owner_last_seen = time.monotonic()
+
+    def release_writer(self):
+        self.writer_owner = None
+        self.writer_released.set()
+
+    def check_preempted(self, session):
+        if session in self.preempted:
+            raise sqlite3.OperationalError("transaction was rolled back: the client was idle for too long; roll back and retry")
+
+    async def query(self, session, payload):
+        sql, params, many = payload["sql"], payload.get("params", []), payload.get("many")
+        self.check_preempted(session)
+        if statement_keyword(sql) in SCHEMA_STATEMENTS:
+            raise sqlite3.DatabaseError(f"{statement_keyword(sql)} is not allowed through the library server")
+        # Reads see committed data from the pool, unless this client has uncommitted writes of its own
+        if self.writer_owner != session and many is None and statement_keyword(sql) in READ_STATEMENTS:
+            return await self.on_reader(self.read_statement, sql, params)
+
+        await self.acquire_writer(session)
+        self.writer_busy += 1
+        try:
+            return await self.on_writer(self.run_statement, self.writer, sql, params, many)
+        finally:
+            self.writer_busy -= 1
+            self.owner_last_seen = time.monotonic()
+            if not self.writer.in_transaction:
+                self.release_writer()
+
+    async def end_transaction(self, session, commit):
+        if not commit:
+            self.preempted.discard(session)
+        self.check_preempted(session)
+        if self.writer_owner != session:
+            return
+        try:
+            await self.on_writer(self.writer.commit if commit else self.writer.rollback)
+        finally:
+            self.release_writer()
+
+    async def write(self, operation, *args):
+        session = f"api-{uuid.uuid4().hex}"
+        await self.acquire_writer(session)
+        try:
+            return await self.on_writer(self.run_write, operation, *args)
+        finally:
+            self.release_writer()
+
+    # --- API operations: (cursor, ...) -> (status, JSON body) ---
+
+    def get_books(self, cursor, params):
+        limit = int(params.get("limit", 500))
+        return 200, {"books": rows_as_dicts(cursor, search_books(cursor, params.get("search", "").strip())[:limit])}
+
+    def get_book(self, cursor, book_id):
+        cursor.execute(f"SELECT {INVENTORY_COLUMNS} FROM Library WHERE BK_ID = ? AND IS_DELETED = 0", (book_id,))
+        book = cursor.fetchone()
+        if book is None:
+            return 404, {"error": "NotFound", "message": f"No book with ID {book_id}"}
+        result = rows_as_dicts(cursor, [book])[0]
+        copies = book_copies(cursor, book_id)
+        result["copies"] = rows_as_dicts(cursor, copies)
+        holds = waiting_holds(cursor, book_id)
+        result["holds"] = rows_as_dicts(cursor, holds)
+        return 200, result
+
+    def get_copy(self, cursor, barcode):
+        copy = lookup_barcode(cursor, barcode)
+        if copy is None:
+            return 404, {"error": "NotFound", "message": f"No copy with barcode {barcode}"}
+        return 200, rows_as_dicts(cursor, [copy])[0]
+
+    def get_loans(self, cursor, params):
+        period, status = params.get("period", "All"), params.get("status", "All")
+        if period not in REPORT_PERIODS or status not in REPORT_STATUSES:
+            return 400, {"error": "BadRequest", "message": f"Unknown report filter: {period} / {status}"}
+        cursor.execute(borrower_report_query(period, status))
+        return 200, {"loans": rows_as_dicts(cursor, cursor.fetchall())}
+
+    def get_overdue(self, cursor, params):
+        loans = overdue_loans(cursor, params.get("as_of"))
+        return 200, {"loans": rows_as_dicts(cursor, loans)}
+
+    def get_events(self, cursor, params):
+        events = events_since(cursor, int(params.get("after", 0)), int(params.get("limit", 1000)))
+        events = rows_as_dicts(cursor, events)
+        for event in events:
+            event["ROW_DATA"] = json.loads(event["ROW_DATA"])
+        return 200, {"events": events}
+
+    def post_loan(self, cursor, payload):
+        # Same rules as the circulation desk: a free copy, no holds waiting, a known patron or borrower details
+        if payload.get("barcode"):
+            copy = lookup_barcode(cursor, payload["barcode"])
+            if copy is None:
+                return 404, {"error": "NotFound", "message": f"No copy with barcode {payload['barcode']}"}
+            copy_id, book_id, borrower_id = copy[0], copy[1], copy[3]
+            if borrower_id is not None:
+                return 409, {"error": "Conflict", "message": f"Copy {payload['barcode']} is already on loan"}
+        else:
+            book_id, copy_id = payload["book_id"], None
+
+        cursor.execute("SELECT HOLDS_QUEUED FROM Library WHERE BK_ID = ? AND IS_DELETED = 0", (book_id,))
+        book = cursor.fetchone()
+        if book is None:
+            return 404, {"error": "NotFound", "message": f"No book with ID {book_id}"}
+        if book[0] > 0:
+            return 409, {"error": "Conflict", "message": f"{book_id} has holds waiting"}
+        if copy_id is None:
+            copy_id = free_copy_id(cursor, book_id)
+            if copy_id is None:
+                return 409, {"error": "Conflict", "message": f"No copies of {book_id} are available; place a hold instead"}
+
+        if payload.get("patron_id"):
+            patron = find_patron(cursor, payload["patron_id"])
+            if patron is None:
+                return 404, {"error": "NotFound", "message": f"No patron with card {payload['patron_id']}"}
+            patron_id, name, contact_number, email, gender, classification = patron
+        else:
+            patron_id = None
+            name, contact_number, email = payload["borrower_name"], payload["contact_number"], payload["email"]
+            gender, classification = payload.get("gender", ""), payload.get("classification", "Other")
+
+        loan_id = insert_loan(cursor, book_id, copy_id, name, contact_number, email, gender, classification, patron_id=patron_id)
+        cursor.execute("SELECT DUE_DATE FROM Borrowers WHERE BORROWER_ID = ?", (loan_id,))
+        return 200, {"borrower_id": loan_id, "book_id": book_id, "copy_id": copy_id, "due_date": cursor.fetchone()[0]}
+
+    def post_return(self, cursor, payload):
+        if payload.get("barcode"):
+            copy = lookup_barcode(cursor, payload["barcode"])
+            loan = copy and (copy[3], copy[1], copy[0])
+        else:
+            cursor.execute(
+                "SELECT BORROWER_ID, BK_ID, COPY_ID FROM Borrowers WHERE BORROWER_ID = ? AND DATE_RETURNED IS NULL AND IS_DELETED = 0",
+                (payload["borrower_id"],)
+            )
+            loan = cursor.fetchone()
+        if not loan or loan[0] is None:
+            return 409, {"error": "Conflict", "message": "No open loan to return"}
+
+        borrower_id, book_id, copy_id = loan
+        hold_borrower = return_loan(cursor, borrower_id, book_id, copy_id)
+        return 200, {"borrower_id": borrower_id, "book_id": book_id, "next_hold": hold_borrower}
+
+    def post_hold(self, cursor, payload):
+        cursor.execute("SELECT 1 FROM Library WHERE BK_ID = ? AND IS_DELETED = 0", (payload["book_id"],))
+        if cursor.fetchone() is None:
+            return 404, {"error": "NotFound", "message": f"No book with ID {payload['book_id']}"}
+        hold_id = place_hold(cursor, payload["book_id"], payload["borrower_name"], payload["contact_number"],
+                             payload["email"], payload.get("gender", ""), payload.get("classification", "Other"))
+        return 200, {"hold_id": hold_id, "position": hold_queue_position(cursor, hold_id)}
+
+    def delete_hold(self, cursor, hold_id):
+        book_id = cancel_hold(cursor, int(hold_id))
+        if book_id is None:
+            return 404, {"error": "NotFound", "message": f"No waiting hold with ID {hold_id}"}
+        return 200, {"hold_id": int(hold_id), "book_id": book_id}
+
+    async def dispatch(self, method, target, headers, body, sessions):
+        if self.token and headers.get("authorization") != f"Bearer {self.token}":
+            return 401, {"error": "Unauthorized", "message": "Missing or wrong server token"}
+
+        parts = urlsplit(target)
+        path = unquote(parts.path).rstrip("/") or "/"
+        params = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+        session = headers.get("x-library-session", "")
+
+        try:
+            payload = json.loads(body) if body else {}
+            if method == "GET":
+                if path == "/health":
+                    return 200, {"ok": True, "database": self.database_path}
+                if path == "/books":
+                    return await self.on_reader(self.run_read, self.get_books, params)
+                if path.startswith("/books/"):
+                    return await self.on_reader(self.run_read, self.get_book, path[len("/books/"):])
+                if path.startswith("/copies/"):
+                    return await self.on_reader(self.run_read, self.get_copy, path[len("/copies/"):])
+                if path == "/loans":
+                    return await self.on_reader(self.run_read, self.get_loans, params)
+                if path == "/overdue":
+                    return await self.on_reader(self.run_read, self.get_overdue, params)
+                if path == "/events":
+                    return await self.on_reader(self.run_read, self.get_events, params)
+            elif method == "POST":
+                if path == "/loans":
+                    return await self.write(self.post_loan, payload)
+                if path == "/returns":
+                    return await self.write(self.post_return, payload)
+                if path == "/holds":
+                    return await self.write(self.post_hold, payload)
+                if path in ("/query", "/commit", "/rollback"):
+                    if not session:
+                        return 400, {"error": "BadRequest", "message": "X-Library-Session header is required"}
+                    sessions.add(session)
+                    if path == "/query":
+                        return 200, await self.query(session, payload)
+                    await self.end_transaction(session, path == "/commit")
+                    return 200, {"ok": True}
+            elif method == "DELETE":
+                if path.startswith("/holds/"):
+                    return await self.write(self.delete_hold, path[len("/holds/"):])
+            return 404, {"error": "NotFound", "message": f"No route for {method} {path}"}
+        except sqlite3.Error as e:
+            return 400, {"error": type(e).__name__, "message": str(e)}
+        except (KeyError, TypeError, ValueError) as e:
+            return 400, {"error": "BadRequest", "message": f"Bad request: {e!r}"}
+
+    async def handle_client(self, reader, writer):
+        sessions = set()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+
+                status, result = await self.dispatch(method, target, headers, body, sessions)
+                payload = json.dumps(result, default=str).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError, ValueError):
+            pass
+        finally:
+            # A desk that disconnects mid-transaction must not keep the writer
+            if self.writer_owner in sessions:
+                await self.end_transaction(self.writer_owner, commit=False)
+            self.preempted.difference_update(sessions)
+            writer.close()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.writer_released = asyncio.Event()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"Library server on http://{self.host}:{self.port} serving {self.database_path}")
+        self.ready.set()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+
+
+
+class EventLoopWatchdog(QObject):
+    WATCHED_WIDGETS = ("InventoryWidget", "BorrowerReportsWidget", "DashboardWidget", "DiagnosticsWidget", "LibraryApp")
+
+    def __init__(self, threshold_ms=250, interval_ms=50, report_path="ui_stalls.log", max_entries=200):
+        super().__init__()
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.report_path = report_path
+        self.entries = deque(maxlen=max_entries)
+        self.main_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.stall = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        self.heartbeat = QTimer(self)
+        self.heartbeat.setInterval(interval_ms)
+        self.heartbeat.timeout.connect(self.beat)
+        self.monitor = threading.Thread(target=self.watch, name="event-loop-watchdog", daemon=True)
+
+    def start(self):
+        self.last_beat = time.monotonic()
+        self.heartbeat.start()
+        self.monitor.start()
+
+    def stop(self):
+        self.heartbeat.stop()
+        self.stopped.set()
+
+    def beat(self):
+        now = time.monotonic()
+        with self.lock:
+            self.last_beat = now
+            stall, self.stall = self.stall, None
+        if stall:
+            self.finish_stall(stall, now)
+
+    def watch(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                if time.monotonic() - self.last_beat < self.threshold:
+                    continue
+                frame = sys._current_frames().get(self.main_thread_id)
+                if frame is None:
+                    continue
+                if self.stall is None:
+                    self.stall = {"started": self.last_beat, "culprits": {}, "stack": traceback.extract_stack(frame)}
+                # Sample the stack on every tick so long stalls are blamed on the
+                # method that spent the most time blocking.
+                culprit = self.find_culprit(frame)
+                self.stall["culprits"][culprit] = self.stall["culprits"].get(culprit, 0) + 1
+                if culprit == max(self.stall["culprits"], key=self.stall["culprits"].get):
+                    self.stall["stack"] = traceback.extract_stack(frame)
+
+    def find_culprit(self, frame):
+        while frame is not None:
+            code = frame.f_code
+            qualname = getattr(code, "co_qualname", None)
+            if qualname is None:
+                owner = frame.f_locals.get("self")
+                qualname = f"{type(owner).__name__}.{code.co_name}" if owner is not None else code.co_name
+            parts = qualname.split(".")
+            if len(parts) > 1 and parts[0] in self.WATCHED_WIDGETS:
+                return f"{parts[0]}.{parts[1]}"
+            frame = frame.f_back
+        return "(outside widget code)"
+
+    def finish_stall(self, stall, ended):
+        duration_ms = (ended - stall["started"]) * 1000
+        culprit = max(stall["culprits"], key=stall["culprits"].get)
+        self.entries.append({
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "duration_ms": duration_ms,
+            "culprit": culprit,
+            "stack": "".join(traceback.format_list(stall["stack"][-12:])),
+        })
+        print(f"UI stalled for {duration_ms:.0f} ms in {culprit}")
+
+        try:
+            with open(self.report_path, "w", encoding="utf-8") as report_file:
+                for entry in self.entries:
+                    report_file.write(f"{entry['time']}  stalled {entry['duration_ms']:.0f} ms in {entry['culprit']}\n")
+                    report_file.write(entry["stack"])
+                    report_file.write("\n")
+        except OSError as e:
+            print(f"Error writing UI stall report: {e}")
+
+
+class ReportingSnapshot:
+    # In-memory copy of the database for dashboard and report queries, so they
+    # never hold locks on library.db while the desk is lending and returning.
+    # The copy is taken on a query thread and swapped in whole; queries read
+    # whichever copy is current when they start.
+    def __init__(self, source):
+        self.source = source
+        self.current = None
+        self.version = None
+        self.refreshed_at = None
+        self.copying = False
+        self.waiting = {}
+
+    def source_version(self):
+        return self.source.execute("PRAGMA data_version").fetchone()[0], self.source.total_changes
+
+    def copy(self, cursor):
+        start = time.perf_counter()
+        connection = sqlite3.connect(":memory:", check_same_thread=False, factory=ProfiledConnection)
+        cursor.connection.backup(connection)
+        connection.execute("PRAGMA query_only = ON")
+        print(f"Reporting snapshot copied in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return connection
+
+    def install(self, connection, version):
+        # The old copy closes once the queries still reading it let go
+        self.current = (connection, threading.Lock())
+        self.version = version
+        self.refreshed_at = datetime.now()
+        self.copying = False
+
+    def query(self, cursor, function, *args):
+        # cursor is the query thread's own connection, used only until the first copy is in
+        current = self.current
+        if current is None:
+            return function(cursor, *args)
+        connection, lock = current
+        with lock:
+            return function(connection.cursor(), *args)
+
+
+class QueryTask(QRunnable):
+    def __init__(self, executor, request_id, function, args):
+        super().__init__()
+        self.executor = executor
+        self.request_id = request_id
+        self.function = function
+        self.args = args
+
+    def run(self):
+        try:
+            result = self.function(self.executor.connection().cursor(), *self.args)
+        except Exception as e:
+            self.executor.failed.emit(self.request_id, str(e))
+            return
+        self.executor.finished.emit(self.request_id, result)
+
+
+class QueryExecutor(QObject):
+    # Runs the pages' read queries on a QThreadPool, each pool thread with its own read-only
+    # connection, and hands the rows back to the GUI thread through queued signals. Only the
+    # newest request per key is delivered, so typing in a search box never shows stale rows.
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+    def __init__(self, database_path="library.db", max_threads=2):
+        super().__init__()
+        self.database_path = os.path.abspath(database_path)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.local = threading.local()
+        self.next_request_id = 0
+        self.latest = {}
+        self.callbacks = {}
+        self.finished.connect(self.deliver)
+        self.failed.connect(self.deliver_error)
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            if os.environ.get("LIBRARY_SERVER_URL"):
+                connection = open_library_connection(self.database_path)
+            else:
+                connection = sqlite3.connect(f"file:{self.database_path}?mode=ro", uri=True, factory=ProfiledConnection)
+            self.local.connection = connection
+        return connection
+
+    def submit(self, key, function, args, on_result, on_error):
+        self.next_request_id += 1
+        self.latest[key] = self.next_request_id
+        self.callbacks[self.next_request_id] = (key, on_result, on_error)
+        self.pool.start(QueryTask(self, self.next_request_id, function, args))
+
+    def take_callbacks(self, request_id):
+        key, on_result, on_error = self.callbacks.pop(request_id)
+        if self.latest.get(key) != request_id:
+            return None, None
+        return on_result, on_error
+
+    def deliver(self, request_id, result):
+        on_result, on_error = self.take_callbacks(request_id)
+        if on_result:
+            on_result(result)
+
+    def deliver_error(self, request_id, message):
+        on_result, on_error = self.take_callbacks(request_id)
+        if on_error:
+            on_error(message)
+
+    def wait(self):
+        # Blocks until every submitted query has been delivered; for scripts and benchmarks
+        self.pool.waitForDone()
+        QApplication.processEvents()
+
+
+def submit_query(executor, key, cursor, function, args, on_result, on_error):
+    # Without an executor the query runs right here, on the GUI thread's cursor
+    if executor is None:
+        try:
+            result = function(cursor, *args)
+        except sqlite3.Error as e:
+            on_error(str(e))
+            return
+        on_result(result)
+        return
+    executor.submit(key, function, args, on_result, on_error)
+
+
+class LoadingIndicator(QProgressBar):
+    # Busy bar shown while a page waits for a background query; it only appears after a
+    # short delay, so fast loads don't flicker.
+    def __init__(self, delay_ms=150):
+        super().__init__()
+        self.setRange(0, 0)
+        self.setTextVisible(False)
+        self.setFixedHeight(6)
+        self.setStyleSheet("QProgressBar { border: none; background: transparent; } QProgressBar::chunk { background-color: #3498DB; }")
+        self.delay = QTimer(self)
+        self.delay.setSingleShot(True)
+        self.delay.setInterval(delay_ms)
+        self.delay.timeout.connect(self.show)
+        self.hide()
+
+    def start(self):
+        self.delay.start()
+
+    def stop(self):
+        self.delay.stop()
+        self.hide()
+
+
+class TablePager:
+    # Header clicks sort in SQL and the rest of the rows load page by page while scrolling.
+    # fetch(after) loads the page past `after`, or reloads from the top when it is None.
+    def __init__(self, table, sort_columns, fetch):
+        self.table = table
+        self.sort_columns = sort_columns
+        self.fetch = fetch
+        self.sort_column = None
+        self.descending = False
+        self.next_page = None
+        table.horizontalHeader().setSectionsClickable(True)
+        table.horizontalHeader().sectionClicked.connect(self.sort_by)
+        table.verticalScrollBar().valueChanged.connect(self.scrolled)
+
+    def sort(self):
+        return (self.sort_columns[self.sort_column] if self.sort_column is not None else None), self.descending
+
+    def scrolled(self, value):
+        if value >= self.table.verticalScrollBar().maximum() - 5 and self.next_page is not None:
+            self.fetch(self.next_page)
+
+    def sort_by(self, column):
+        if not self.sort_columns[column]:
+            return
+        if column == self.sort_column:
+            self.descending = not self.descending
+        else:
+            self.sort_column, self.descending = column, False
+        header = self.table.horizontalHeader()
+        header.setSortIndicatorShown(True)
+        header.setSortIndicator(column, Qt.DescendingOrder if self.descending else Qt.AscendingOrder)
+        self.fetch(None)
+
+
+class LoanAnalytics:
+    # Loan facts kept as parallel NumPy columns: one entry per loan with the
+    # month borrowed (year * 12 + month - 1) and integer-coded category and
+    # classification. New loans are appended incrementally.
+    CLASSIFICATIONS = ["Student", "Faculty", "REPS", "Other"]
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.clear()
+
+    def clear(self):
+        self.last_event_id = 0
+        self.max_loan_id = 0
+        self.months = np.empty(0, dtype=np.int32)
+        self.category_codes = np.empty(0, dtype=np.int32)
+        self.classification_codes = np.empty(0, dtype=np.int32)
+        self.categories = []
+        self.category_index = {}
+
+    def refresh(self, cursor=None):
+        # MAX(EVENT_ID) is the data version: every loan or book write is logged by the triggers
+        cursor = cursor or self.cursor
+        cursor.execute("SELECT IFNULL(MAX(EVENT_ID), 0) FROM CirculationEvents")
+        latest = cursor.fetchone()[0]
+        if latest == self.last_event_id:
+            return False
+
+        # New loans past max_loan_id and returns are appended; anything else (edits, deletes,
+        # book changes, a replaced database) means a full reload.
+        reload = latest < self.last_event_id
+        if not reload:
+            cursor.execute("""
+                SELECT COUNT(*) FROM CirculationEvents
+                WHERE EVENT_ID > ? AND EVENT_ID <= ? AND NOT (ENTITY = 'loan' AND (
+                    EVENT_TYPE = 'return' OR (EVENT_TYPE = 'borrow' AND BORROWER_ID > ?)))
+            """, (self.last_event_id, latest, self.max_loan_id))
+            reload = cursor.fetchone()[0] > 0
+        if reload:
+            self.clear()
+
+        new_loans = self.load_loans(cursor, self.max_loan_id)
+        self.append(new_loans)
+        if not new_loans.empty:
+            self.max_loan_id = int(new_loans["BORROWER_ID"].max())
+        self.last_event_id = latest
+        return True
+
+    def load_loans(self, cursor, after_loan_id):
+        cursor.execute("""
+            SELECT b.BORROWER_ID, b.DATE_BORROWED, b.CLASSIFICATION, IFNULL(l.CATEGORY, 'Unknown')
+            FROM Borrowers b
+            LEFT JOIN Library l ON b.BK_ID = l.BK_ID
+            WHERE b.BORROWER_ID > ? AND b.IS_DELETED = 0
+        """, (after_loan_id,))
+        return pd.DataFrame(cursor.fetchall(), columns=["BORROWER_ID", "DATE_BORROWED", "CLASSIFICATION", "CATEGORY"])
+
+    def append(self, loans):
+        if loans.empty:
+            return
+
+        dates = loans["DATE_BORROWED"].fillna("").astype(str)
+        years = pd.to_numeric(dates.str.slice(0, 4), errors="coerce")
+        months = pd.to_numeric(dates.str.slice(5, 7), errors="coerce")
+        month_index = (years * 12 + months - 1).fillna(-1).to_numpy(np.int32)
+
+        for category in pd.unique(loans["CATEGORY"]):
+            if category not in self.category_index:
+                self.category_index[category] = len(self.categories)
+                self.categories.append(category)
+        category_codes = loans["CATEGORY"].map(self.category_index).to_numpy(np.int32)
+
+        classification_codes = loans["CLASSIFICATION"].map(
+            {name: code for code, name in enumerate(self.CLASSIFICATIONS)}
+        ).fillna(self.CLASSIFICATIONS.index("Other")).to_numpy(np.int32)
+
+        self.months = np.concatenate([self.months, month_index])
+        self.category_codes = np.concatenate([self.category_codes, category_codes])
+        self.classification_codes = np.concatenate([self.classification_codes, classification_codes])
+
+    def monthly_counts_by_category(self, months=12, end=None):
+        if end is None:
+            end = datetime.now().year * 12 + datetime.now().month - 1
+        start = end - months + 1
+        mask = (self.months >= start) & (self.months <= end)
+        counts = np.bincount(
+            self.category_codes[mask] * months + (self.months[mask] - start),
+            minlength=len(self.categories) * months
+        ).reshape(len(self.categories), months)
+        labels = [datetime(((start + i) // 12), (start + i) % 12 + 1, 1).strftime("%b %y") for i in range(months)]
+        return labels, self.categories, counts
+
+    def yearly_counts_by_classification(self, years=10, end=None):
+        if end is None:
+            end = datetime.now().year
+        start = end - years + 1
+        loan_years = self.months // 12
+        mask = (self.months >= 0) & (loan_years >= start) & (loan_years <= end)
+        counts = np.bincount(
+            self.classification_codes[mask] * years + (loan_years[mask] - start),
+            minlength=len(self.CLASSIFICATIONS) * years
+        ).reshape(len(self.CLASSIFICATIONS), years)
+        return [str(start + i) for i in range(years)], self.CLASSIFICATIONS, counts
+
+
 class SidebarButton(QPushButton):
     def __init__(self, text, icon_path=None):
         super().__init__(text)
@@ -46,7 +2376,7 @@ class SidebarButton(QPushButton):
         self.setCursor(Qt.PointingHandCursor)
         
         if icon_path:
-            self.setIcon(QIcon(icon_path))
+            self.setIcon(cached_icon(icon_path, 24))
             self.setIconSize(QSize(24, 24))
             
         self.setStyleSheet("""
@@ -71,18 +2401,20 @@ class SidebarButton(QPushButton):
         self.setCheckable(True)
 
 class DashboardWidget(QWidget):
-    def __init__(self, cursor, connector):
+    def __init__(self, cursor, connector, query_executor=None, main_window=None):
         super().__init__()
         self.cursor = cursor
         self.connector = connector
+        self.query_executor = query_executor
+        self.main_window = main_window
+        self.refreshing = False
+        self.refresh_again = False
         self.layout = QVBoxLayout()
         self.setLayout(self.layout)
         self.initUI()
 
     def initUI(self):
-        image_path = resource_path("images/librarybackground.jpg")
-        pixmap = QPixmap(image_path)
-        scaled_pixmap = pixmap.scaled(self.size(), Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+        scaled_pixmap = cached_pixmap("images/librarybackground.jpg", self.width(), self.height(), Qt.KeepAspectRatioByExpanding)
 
         palette = QPalette()
         palette.setBrush(self.backgroundRole(), QBrush(scaled_pixmap))
@@ -94,15 +2426,19 @@ class DashboardWidget(QWidget):
         self.dashboard_title.setStyleSheet("color: white; background-color: rgba(0, 0, 0, 80); padding: 10px; border-radius: 5px;")
         self.layout.addWidget(self.dashboard_title)
 
+        self.loading = LoadingIndicator()
+        self.layout.addWidget(self.loading)
+
         self.card_grid_layout = QGridLayout()
         self.layout.addLayout(self.card_grid_layout)
 
-        self.total_books_card = self.create_card(resource_path("images/books.png"), "Total Books", 0, "#3498DB")
-        self.issued_books_card = self.create_card(resource_path("images/issued.png"), "Issued Books", 0, "#E74C3C")
-        self.student_borrowers_card = self.create_card(resource_path("images/students.png"), "Students", 0, "#2ECC71")
-        self.faculty_borrowers_card = self.create_card(resource_path("images/faculty.png"), "Faculty", 0, "#F1C40F")
-        self.researcher_borrowers_card = self.create_card(resource_path("images/researcher.png"), "REPS", 0, "#9B59B6")
-        self.other_borrowers_card = self.create_card(resource_path("images/other.png"), "Other Borrowers", 0, "#E67E22")
+        self.total_books_card = self.create_card("images/books.png", "Total Books", 0, "#3498DB")
+        self.issued_books_card = self.create_card("images/issued.png", "Issued Books", 0, "#E74C3C")
+        self.student_borrowers_card = self.create_card("images/students.png", "Students", 0, "#2ECC71")
+        self.faculty_borrowers_card = self.create_card("images/faculty.png", "Faculty", 0, "#F1C40F")
+        self.researcher_borrowers_card = self.create_card("images/researcher.png", "REPS", 0, "#9B59B6")
+        self.other_borrowers_card = self.create_card("images/other.png", "Other Borrowers", 0, "#E67E22")
+        self.overdue_books_card = self.create_card("images/issued.png", "Overdue", 0, "#C0392B")
 
 
         self.card_grid_layout.addWidget(self.total_books_card, 0, 0)
@@ -111,6 +2447,7 @@ class DashboardWidget(QWidget):
         self.card_grid_layout.addWidget(self.faculty_borrowers_card, 1, 0)
         self.card_grid_layout.addWidget(self.researcher_borrowers_card, 1, 1)
         self.card_grid_layout.addWidget(self.other_borrowers_card, 1, 2)
+        self.card_grid_layout.addWidget(self.overdue_books_card, 0, 3)
 
 
         self.graph_chart_layout = QHBoxLayout()
@@ -121,20 +2458,71 @@ class DashboardWidget(QWidget):
 
         self.layout.addLayout(self.graph_chart_layout)
 
-        self.refresh_data()
+        self.trend_chart_layout = QHBoxLayout()
+        self.monthly_trends_tab = QWidget()
+        self.yearly_trends_tab = QWidget()
+        self.trend_chart_layout.addWidget(self.monthly_trends_tab)
+        self.trend_chart_layout.addWidget(self.yearly_trends_tab)
 
+        self.layout.addLayout(self.trend_chart_layout)
 
-    def refresh_data(self):
-        self.total_books_card.findChild(QLabel, "value").setText(str(self.get_total_books()))
-        self.issued_books_card.findChild(QLabel, "value").setText(str(self.get_issued_books()))
-        self.student_borrowers_card.findChild(QLabel, "value").setText(str(self.get_borrowers_by_classification("Student")))
-        self.faculty_borrowers_card.findChild(QLabel, "value").setText(str(self.get_borrowers_by_classification("Faculty")))
-        self.researcher_borrowers_card.findChild(QLabel, "value").setText(str(self.get_borrowers_by_classification("REPS")))
-        self.other_borrowers_card.findChild(QLabel, "value").setText(str(self.get_borrowers_by_classification("Other")))
+        self.loan_analytics = LoanAnalytics(self.cursor)
+
+        self.refresh_data()
 
 
-        self.update_borrowing_trends_chart()
-        self.update_classification_chart()
+    def refresh_data(self):
+        # One refresh at a time: LoanAnalytics is updated in place by the query thread
+        if self.refreshing:
+            self.refresh_again = True
+            return
+        self.refreshing = True
+        self.loading.start()
+        if self.main_window:
+            self.main_window.submit_report_query("dashboard", self.cursor, self.load_data, (), self.show_data, self.show_load_error)
+        else:
+            submit_query(self.query_executor, "dashboard", self.cursor, self.load_data, (), self.show_data, self.show_load_error)
+
+    def load_data(self, cursor):
+        data = {
+            "total_books": self.get_total_books(cursor),
+            "issued_books": self.get_issued_books(cursor),
+            "overdue_books": count_overdue_loans(cursor),
+            "categories": self.get_borrowing_trends_by_category(cursor),
+            "classifications": self.get_borrowing_trends_by_classification(cursor),
+        }
+        for classification in ("Student", "Faculty", "REPS", "Other"):
+            data[classification] = self.get_borrowers_by_classification(cursor, classification)
+        self.loan_analytics.refresh(cursor)
+        return data
+
+    def show_data(self, data):
+        self.finish_refresh()
+        self.total_books_card.findChild(QLabel, "value").setText(str(data["total_books"]))
+        self.issued_books_card.findChild(QLabel, "value").setText(str(data["issued_books"]))
+        self.student_borrowers_card.findChild(QLabel, "value").setText(str(data["Student"]))
+        self.faculty_borrowers_card.findChild(QLabel, "value").setText(str(data["Faculty"]))
+        self.researcher_borrowers_card.findChild(QLabel, "value").setText(str(data["REPS"]))
+        self.other_borrowers_card.findChild(QLabel, "value").setText(str(data["Other"]))
+        self.overdue_books_card.findChild(QLabel, "value").setText(str(data["overdue_books"]))
+
+
+        self.update_borrowing_trends_chart(data["categories"])
+        self.update_classification_chart(data["classifications"])
+
+        self.update_monthly_trends_chart()
+        self.update_yearly_trends_chart()
+
+    def show_load_error(self, message):
+        self.finish_refresh()
+        print(f"Error refreshing dashboard: {message}")
+
+    def finish_refresh(self):
+        self.loading.stop()
+        self.refreshing = False
+        if self.refresh_again:
+            self.refresh_again = False
+            QTimer.singleShot(0, self.refresh_data)
 
     def create_card(self, icon_path, title, value, color):
         card = QFrame()
@@ -152,8 +2540,7 @@ class DashboardWidget(QWidget):
         self.card_grid_layout.setContentsMargins(10, 10, 10, 10)
 
         icon_label = QLabel()
-        pixmap = QPixmap(icon_path).scaled(70, 70, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        icon_label.setPixmap(pixmap)
+        icon_label.setPixmap(cached_pixmap(icon_path, 70, 70))
         icon_label.setAlignment(Qt.AlignVCenter)
 
         text_layout = QVBoxLayout()
@@ -178,7 +2565,7 @@ class DashboardWidget(QWidget):
         return card
 
 
-    def update_borrowing_trends_chart(self):
+    def update_borrowing_trends_chart(self, categories):
         if hasattr(self, 'borrowing_trends_chart'):
             self.borrowing_trends_chart.removeAllSeries()
         else:
@@ -188,8 +2575,6 @@ class DashboardWidget(QWidget):
             self.borrowing_trends_chart.setBackgroundBrush(QColor("#F5F5F5"))
 
         series = QPieSeries()
-        
-        categories = self.get_borrowing_trends_by_category()
 
         for category, count in categories:
             slice_ = series.append(category, count)
@@ -223,7 +2608,7 @@ class DashboardWidget(QWidget):
             self.borrowing_chart_view.setChart(self.borrowing_trends_chart)
 
 
-    def update_classification_chart(self):
+    def update_classification_chart(self, classifications):
 
         if hasattr(self, 'classification_chart'):
             self.classification_chart.removeAllSeries()
@@ -238,7 +2623,7 @@ class DashboardWidget(QWidget):
         categories = []
         max_value = 0
 
-        for classification, count in self.get_borrowing_trends_by_classification():
+        for classification, count in classifications:
             bar_set.append(count)
             categories.append(classification)
             max_value = max(max_value, count)
@@ -287,49 +2672,483 @@ class DashboardWidget(QWidget):
         else:
             self.classification_chart_view.setChart(self.classification_chart)
 
-    def get_total_books(self):
-        self.cursor.execute("SELECT SUM(TOTAL_COPIES) FROM Library")
-        return self.cursor.fetchone()[0]
+    def update_monthly_trends_chart(self, top_categories=5):
+        if hasattr(self, 'monthly_trends_chart'):
+            self.monthly_trends_chart.removeAllSeries()
+        else:
+            self.monthly_trends_chart = QChart()
+            self.monthly_trends_chart.setTitle("Monthly Loans by Category (last 12 months)")
+            self.monthly_trends_chart.setBackgroundBrush(QColor("#F5F5F5"))
+            self.monthly_trends_chart.setTitleFont(QFont("Helvetica", 12, QFont.Bold))
+            self.monthly_trends_chart.setTitleBrush(QColor("#222222"))
+            self.monthly_trends_chart.legend().setFont(QFont("Helvetica", 7))
+            self.monthly_trends_chart.legend().setAlignment(Qt.AlignBottom)
+
+        months, categories, counts = self.loan_analytics.monthly_counts_by_category(12)
+        top_rows = np.argsort(counts.sum(axis=1))[::-1][:top_categories]
+
+        max_value = 0
+        for row in top_rows:
+            if counts[row].sum() == 0:
+                continue
+            series = QLineSeries()
+            series.setName(str(categories[row]))
+            for month_num, count in enumerate(counts[row]):
+                series.append(month_num, int(count))
+            max_value = max(max_value, int(counts[row].max()))
+            self.monthly_trends_chart.addSeries(series)
+
+        for axis in self.monthly_trends_chart.axes():
+            self.monthly_trends_chart.removeAxis(axis)
+
+        axis_x = QBarCategoryAxis()
+        axis_x.append(months)
+        axis_x.setLabelsAngle(-90)
+        axis_x.setLabelsFont(QFont("Helvetica", 7))
+        self.monthly_trends_chart.addAxis(axis_x, Qt.AlignBottom)
+
+        axis_y = QValueAxis()
+        axis_y.setRange(0, max(max_value, 1))
+        axis_y.setLabelFormat("%d")
+        self.monthly_trends_chart.addAxis(axis_y, Qt.AlignLeft)
+
+        for series in self.monthly_trends_chart.series():
+            series.attachAxis(axis_x)
+            series.attachAxis(axis_y)
+
+        if not hasattr(self, 'monthly_trends_chart_view'):
+            self.monthly_trends_chart_view = QChartView(self.monthly_trends_chart)
+            self.monthly_trends_chart_view.setFixedSize(500, 300)
+            self.monthly_trends_chart_view.setRenderHint(QPainter.Antialiasing)
+
+            layout = QHBoxLayout()
+            self.monthly_trends_tab.setLayout(layout)
+            layout.addWidget(self.monthly_trends_chart_view)
+
+    def update_yearly_trends_chart(self):
+        if hasattr(self, 'yearly_trends_chart'):
+            self.yearly_trends_chart.removeAllSeries()
+        else:
+            self.yearly_trends_chart = QChart()
+            self.yearly_trends_chart.setTitle("Yearly Loans by Classification")
+            self.yearly_trends_chart.setBackgroundBrush(QColor("#F5F5F5"))
+            self.yearly_trends_chart.setTitleFont(QFont("Helvetica", 12, QFont.Bold))
+            self.yearly_trends_chart.setTitleBrush(QColor("#222222"))
+
+        years, classifications, counts = self.loan_analytics.yearly_counts_by_classification(10)
+
+        series = QStackedBarSeries()
+        colors = ["#2ECC71", "#F1C40F", "#9B59B6", "#E67E22"]
+        for row, classification in enumerate(classifications):
+            bar_set = QBarSet(classification)
+            bar_set.append([int(count) for count in counts[row]])
+            bar_set.setColor(QColor(colors[row % len(colors)]))
+            series.append(bar_set)
+
+        self.yearly_trends_chart.addSeries(series)
+
+        for axis in self.yearly_trends_chart.axes():
+            self.yearly_trends_chart.removeAxis(axis)
+
+        axis_x = QBarCategoryAxis()
+        axis_x.append(years)
+        axis_x.setLabelsFont(QFont("Helvetica", 7))
+        self.yearly_trends_chart.addAxis(axis_x, Qt.AlignBottom)
+        series.attachAxis(axis_x)
+
+        axis_y = QValueAxis()
+        axis_y.setRange(0, max(int(counts.sum(axis=0).max()) if counts.size else 0, 1))
+        axis_y.setLabelFormat("%d")
+        self.yearly_trends_chart.addAxis(axis_y, Qt.AlignLeft)
+        series.attachAxis(axis_y)
+
+        if not hasattr(self, 'yearly_trends_chart_view'):
+            self.yearly_trends_chart_view = QChartView(self.yearly_trends_chart)
+            self.yearly_trends_chart_view.setFixedSize(500, 300)
+            self.yearly_trends_chart_view.setRenderHint(QPainter.Antialiasing)
+
+            layout = QHBoxLayout()
+            self.yearly_trends_tab.setLayout(layout)
+            layout.addWidget(self.yearly_trends_chart_view)
+
+    def get_total_books(self, cursor):
+        cursor.execute("SELECT SUM(TOTAL_COPIES) FROM Library WHERE IS_DELETED = 0")
+        return cursor.fetchone()[0]
 
-    def get_issued_books(self):
-        self.cursor.execute("SELECT COUNT(*) FROM Borrowers WHERE DATE_RETURNED IS NULL")
-        return self.cursor.fetchone()[0]
+    def get_issued_books(self, cursor):
+        cursor.execute("SELECT COUNT(*) FROM Borrowers WHERE DATE_RETURNED IS NULL AND IS_DELETED = 0")
+        return cursor.fetchone()[0]
 
-    def get_borrowers_by_classification(self, classification):
-        self.cursor.execute("""
+    def get_borrowers_by_classification(self, cursor, classification):
+        cursor.execute("""
             SELECT COUNT(*) FROM Borrowers 
-            WHERE CLASSIFICATION = ? AND DATE_RETURNED IS NULL
+            WHERE CLASSIFICATION = ? AND DATE_RETURNED IS NULL AND IS_DELETED = 0
         """, (classification,))
-        return self.cursor.fetchone()[0]
+        return cursor.fetchone()[0]
 
-    def get_other_borrowers_count(self):
-        self.cursor.execute("""
+    def get_other_borrowers_count(self, cursor):
+        cursor.execute("""
             SELECT COUNT(*) FROM Borrowers 
-            WHERE CLASSIFICATION NOT IN ('Student', 'Faculty', 'REPS')
+            WHERE CLASSIFICATION NOT IN ('Student', 'Faculty', 'REPS') AND IS_DELETED = 0
         """)
-        result = self.cursor.fetchone()
+        result = cursor.fetchone()
         return result[0] if result else 0
 
     
-    def get_borrowing_trends_by_category(self):
-        self.cursor.execute("""
+    def get_borrowing_trends_by_category(self, cursor):
+        cursor.execute("""
             SELECT Library.CATEGORY, COUNT(*) as count 
             FROM Borrowers 
             JOIN Library ON Borrowers.BK_ID = Library.BK_ID 
-            WHERE Borrowers.DATE_RETURNED IS NULL 
+            WHERE Borrowers.DATE_RETURNED IS NULL AND Borrowers.IS_DELETED = 0
             GROUP BY Library.CATEGORY
         """)
-        return self.cursor.fetchall()
+        return cursor.fetchall()
 
 
-    def get_borrowing_trends_by_classification(self):
-        self.cursor.execute("""
+    def get_borrowing_trends_by_classification(self, cursor):
+        cursor.execute("""
             SELECT CLASSIFICATION, COUNT(*) 
             FROM Borrowers 
-            WHERE DATE_RETURNED IS NULL 
+            WHERE DATE_RETURNED IS NULL AND IS_DELETED = 0
             GROUP BY CLASSIFICATION
         """)
-        return self.cursor.fetchall()
+        return cursor.fetchall()
+
+
+INVENTORY_COLUMNS = "BK_NAME, BK_ID, AUTHOR_NAME, YEAR_PUBLISHED, CATEGORY, TOTAL_COPIES, AVAILABLE_COPIES, BK_STATUS, HOLDS_QUEUED"
+
+
+def text_trigrams(text):
+    # Letter trigrams of each word, padded so word starts weigh more; the numbered
+    # prefixes of imported titles ("12.Agrarian") are left out
+    grams = set()
+    for word in re.findall(r"[a-z0-9]+", (text or "").lower()):
+        if word.isdigit():
+            continue
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    # In-memory trigram posting lists over book titles and authors, for typo-tolerant search.
+    # Built once from Library, then kept current by replaying the book events logged since.
+    # Postings are arrays of slot numbers, counted with numpy at search time; an edited or
+    # deleted book just gives up its slot, and the index is rebuilt once dead slots outnumber live ones.
+    def __init__(self, min_score=0.5):
+        self.min_score = min_score
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.postings = {}
+        self.slots = {}
+        self.books = []
+        self.sizes = array("q")
+        self.live = 0
+        self.last_event_id = None
+
+    def add(self, book_id, title, author):
+        self.remove(book_id)
+        slot = len(self.books)
+        grams = text_trigrams(f"{title or ''} {author or ''}")
+        self.books.append(book_id)
+        self.sizes.append(len(grams))
+        self.slots[book_id] = slot
+        self.live += 1
+        for gram in grams:
+            self.postings.setdefault(gram, array("q")).append(slot)
+
+    def remove(self, book_id):
+        slot = self.slots.pop(book_id, None)
+        if slot is not None:
+            self.sizes[slot] = 0
+            self.live -= 1
+
+    def rebuild(self, cursor):
+        self.clear()
+        cursor.execute("SELECT IFNULL(MAX(EVENT_ID), 0) FROM CirculationEvents")
+        self.last_event_id = cursor.fetchone()[0]
+        cursor.execute("SELECT BK_ID, BK_NAME, AUTHOR_NAME FROM Library WHERE IS_DELETED = 0")
+        for book_id, title, author in cursor.fetchall():
+            self.add(book_id, title, author)
+
+    def refresh(self, cursor):
+        if self.last_event_id is None or len(self.books) > 2 * self.live + 1000:
+            self.rebuild(cursor)
+            return
+        cursor.execute("SELECT IFNULL(MAX(EVENT_ID), 0) FROM CirculationEvents")
+        latest = cursor.fetchone()[0]
+        if latest <= self.last_event_id:
+            return
+        cursor.execute("""
+            SELECT EVENT_TYPE, BK_ID, json_extract(ROW_DATA, '$.BK_NAME'), json_extract(ROW_DATA, '$.AUTHOR_NAME'),
+                json_extract(ROW_DATA, '$.IS_DELETED')
+            FROM CirculationEvents WHERE ENTITY = 'book' AND EVENT_ID > ? AND EVENT_ID <= ? ORDER BY EVENT_ID
+        """, (self.last_event_id, latest))
+        for event_type, book_id, title, author, is_deleted in cursor.fetchall():
+            if event_type == "purge" or is_deleted:
+                self.remove(book_id)
+            else:
+                self.add(book_id, title, author)
+        self.last_event_id = latest
+
+    def search(self, cursor, text, limit=50):
+        # Book IDs sharing at least min_score of the query's trigrams, best match first
+        query = text_trigrams(text)
+        if not query:
+            return []
+        with self.lock:
+            self.refresh(cursor)
+            postings = [np.frombuffer(self.postings[gram], dtype=np.int64) for gram in query if gram in self.postings]
+            if not postings:
+                return []
+            shared = np.bincount(np.concatenate(postings), minlength=len(self.books))
+            sizes = np.frombuffer(self.sizes, dtype=np.int64)
+            slots = np.nonzero((shared >= math.ceil(len(query) * self.min_score)) & (sizes > 0))[0]
+            # Most of the query found first, then the closest overall (shorter titles win ties)
+            coverage = shared[slots] / len(query)
+            similarity = 2 * shared[slots] / (len(query) + sizes[slots])
+            best = slots[np.lexsort((-similarity, -coverage))[:limit]]
+            return [self.books[slot] for slot in best]
+
+
+catalogue_trigrams = TrigramIndex()
+
+
+BookRecord = namedtuple("BookRecord", [
+    "title", "book_id", "author", "year", "category", "total_copies", "available_copies", "status", "holds_queued", "is_deleted",
+])
+
+
+class CatalogueCache:
+    # Recently used Library rows by BK_ID, so the desk can look a book up again without reading it.
+    # A lookup only asks SQLite whether anything was committed since the last one (PRAGMA data_version
+    # for other connections, total_changes for our own); when something was, the books named by the
+    # new CirculationEvents and BookVersions rows are evicted. Past capacity the least recently used book goes.
+    def __init__(self, capacity=5000):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.clear()
+
+    def clear(self):
+        self.records = OrderedDict()
+        self.versions = {}
+        self.size = 0
+        self.last_event_id = None
+        self.last_book_version = None
+
+    @staticmethod
+    def record_size(record):
+        return sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record)
+
+    def discard(self, book_id):
+        record = self.records.pop(book_id, None)
+        if record is not None:
+            self.size -= self.record_size(record)
+
+    def store(self, book_id, record):
+        self.records[book_id] = record
+        self.size += self.record_size(record)
+        while len(self.records) > self.capacity:
+            old_id, old = self.records.popitem(last=False)
+            self.size -= self.record_size(old)
+            self.evictions += 1
+
+    def sync(self, cursor):
+        # Taken before the events are read, so a commit in between is caught by the next lookup
+        connection = cursor.connection
+        version = (cursor.execute("PRAGMA data_version").fetchone()[0], connection.total_changes)
+        if self.versions.get(connection) == version:
+            return
+        cursor.execute("SELECT (SELECT IFNULL(MAX(EVENT_ID), 0) FROM CirculationEvents), (SELECT IFNULL(MAX(VERSION), 0) FROM BookVersions)")
+        latest_event_id, latest_book_version = cursor.fetchone()
+        if self.last_event_id is not None and (latest_event_id, latest_book_version) != (self.last_event_id, self.last_book_version):
+            # Events name the books whose details changed, BookVersions the ones whose counts changed
+            cursor.execute("""
+                SELECT BK_ID FROM CirculationEvents WHERE EVENT_ID > ?
+                UNION
+                SELECT BK_ID FROM BookVersions WHERE VERSION > ?
+            """, (self.last_event_id, self.last_book_version))
+            for (book_id,) in cursor.fetchall():
+                self.discard(book_id)
+        self.last_event_id, self.last_book_version = latest_event_id, latest_book_version
+        self.versions[connection] = version
+
+    def load(self, cursor, book_id):
+        cursor.execute(f"SELECT {INVENTORY_COLUMNS}, IS_DELETED FROM Library WHERE BK_ID = ?", (book_id,))
+        row = cursor.fetchone()
+        return BookRecord(*row) if row else None
+
+    def get(self, cursor, book_id):
+        # The book's row, or None if there is no such book (deleted books included, as in Library)
+        connection = getattr(cursor, "connection", None)
+        if not isinstance(connection, sqlite3.Connection) or connection.in_transaction:
+            # A library server, or uncommitted changes that may still be rolled back: read straight through
+            with self.lock:
+                self.misses += 1
+            return self.load(cursor, book_id)
+        with self.lock:
+            self.sync(cursor)
+            record = self.records.get(book_id)
+            if record is not None:
+                self.records.move_to_end(book_id)
+                self.hits += 1
+                return record
+            self.misses += 1
+            record = self.load(cursor, book_id)
+            if record is not None:
+                self.store(book_id, record)
+            return record
+
+    def invalidate(self):
+        # For bulk changes that log no events, such as a repair recount
+        with self.lock:
+            self.clear()
+
+    def reset_statistics(self):
+        with self.lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "records": len(self.records), "capacity": self.capacity, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0, "evictions": self.evictions, "bytes": self.size,
+            }
+
+
+catalogue_cache = CatalogueCache(int(os.environ.get("LIBRARY_CATALOGUE_CACHE", 5000) or 0))
+
+
+def year_in_range(year, year_from, year_to):
+    # Unknown years are stored as 0 and never fall inside a range
+    return (year_from or 1) <= (year or 0) <= (year_to or 9999)
+
+
+def inventory_filter_clause(filters):
+    # Extra WHERE terms for the inventory facets, on the columns of idx_library_facets
+    terms, params = [], []
+    filters = filters or {}
+    if filters.get("category"):
+        terms.append("CATEGORY = ?")
+        params.append(filters["category"])
+    if filters.get("year_from") or filters.get("year_to"):
+        terms.append("YEAR_PUBLISHED BETWEEN ? AND ?")
+        params += [filters.get("year_from") or 1, filters.get("year_to") or 9999]
+    if filters.get("status"):
+        terms.append("BK_STATUS = ?")
+        params.append(filters["status"])
+    if filters.get("available"):
+        terms.append("AVAILABLE_COPIES > 0")
+    return "".join(f" AND {term}" for term in terms), params
+
+
+class InventoryFacets:
+    # Book counts per category, status and availability from one grouped query, cached until
+    # CirculationEvents moves on (every book edit and every loan is logged there). Each facet's
+    # counts apply the other facets' filters, so an option shows how many books picking it lists.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.groups = []
+
+    def refresh(self, cursor):
+        cursor.execute("SELECT IFNULL(MAX(EVENT_ID), 0) FROM CirculationEvents")
+        version = cursor.fetchone()[0]
+        if version == self.version:
+            return
+        cursor.execute("""
+            SELECT CATEGORY, YEAR_PUBLISHED, BK_STATUS, AVAILABLE_COPIES > 0, COUNT(*)
+            FROM Library WHERE IS_DELETED = 0
+            GROUP BY CATEGORY, YEAR_PUBLISHED, BK_STATUS, AVAILABLE_COPIES > 0
+        """)
+        self.groups = cursor.fetchall()
+        self.version = version
+
+    def counts(self, cursor, filters):
+        with self.lock:
+            self.refresh(cursor)
+            groups = self.groups
+        filters = filters or {}
+        facets = {"category": Counter(), "status": Counter(), "available": 0, "total": 0, "years": []}
+        for category, year, status, available, count in groups:
+            matches = {
+                "category": not filters.get("category") or category == filters["category"],
+                "year": not (filters.get("year_from") or filters.get("year_to"))
+                    or year_in_range(year, filters.get("year_from"), filters.get("year_to")),
+                "status": not filters.get("status") or status == filters["status"],
+                "available": not filters.get("available") or available,
+            }
+            if all(match for facet, match in matches.items() if facet != "category"):
+                facets["category"][category] += count
+            if all(match for facet, match in matches.items() if facet != "status"):
+                facets["status"][status] += count
+            if available and all(match for facet, match in matches.items() if facet != "available"):
+                facets["available"] += count
+            if all(matches.values()):
+                facets["total"] += count
+            if year:
+                facets["years"].append(year)
+        facets["years"] = (min(facets["years"]), max(facets["years"])) if facets["years"] else (0, 0)
+        return facets
+
+
+inventory_facets = InventoryFacets()
+
+
+def inventory_source(text, filters=None):
+    # Title, author or ID substring, or an exact copy barcode, within the facet filters
+    filter_sql, filter_params = inventory_filter_clause(filters)
+    if not text:
+        return f"Library WHERE IS_DELETED = 0{filter_sql}", filter_params
+    return f"""Library 
+        WHERE IS_DELETED = 0 AND (BK_NAME LIKE ? OR AUTHOR_NAME LIKE ? OR BK_ID LIKE ?
+            OR BK_ID = (SELECT BK_ID FROM Copies WHERE BARCODE = ?)){filter_sql}
+    """, [f'%{text}%', f'%{text}%', f'%{text}%', text] + filter_params
+
+
+def search_books(cursor, text, filters=None):
+    source, params = inventory_source(text, filters)
+    cursor.execute(f"SELECT {INVENTORY_COLUMNS} FROM {source}", params)
+    records = cursor.fetchall()
+    if records or not text:
+        return records
+    return similar_books(cursor, text, filters)
+
+
+def similar_books(cursor, text, filters=None):
+    # Nothing matched as typed: fall back to the closest titles and authors, best first
+    filter_sql, filter_params = inventory_filter_clause(filters)
+    book_ids = catalogue_trigrams.search(cursor, text)
+    if not book_ids:
+        return []
+    cursor.execute(f"""
+        SELECT {INVENTORY_COLUMNS} FROM Library
+        WHERE IS_DELETED = 0 AND BK_ID IN ({', '.join('?' * len(book_ids))}){filter_sql}
+    """, book_ids + filter_params)
+    rank = {book_id: position for position, book_id in enumerate(book_ids)}
+    return sorted(cursor.fetchall(), key=lambda record: rank[record[1]])
+
+
+# Sortable Inventory columns, by table column; pages are keyed on rowid, the order books were added in
+INVENTORY_SORT_COLUMNS = [column.strip() for column in INVENTORY_COLUMNS.split(",")]
+
+
+def inventory_page(cursor, text, filters, sort=None, descending=False, after=None):
+    # One page of the inventory, plus the facet counts with the first page
+    source, params = inventory_source(text, filters)
+    records, next_after = keyset_page(cursor, INVENTORY_COLUMNS, source, params, "rowid", sort, descending, after)
+    if after is not None:
+        return records, None, next_after
+    if not records and text:
+        records = similar_books(cursor, text, filters)
+    return records, inventory_facets.counts(cursor, filters), next_after
 
 
 class InventoryWidget(QWidget):
@@ -339,13 +3158,13 @@ class InventoryWidget(QWidget):
         self.cursor = cursor
         self.connector = connector
         self.setMaximumSize(1920, 1080)
+        self.update_window = None
+        self.borrow_window = None
         self.initUI()
 
     def initUI(self):
 
-        image_path = resource_path("images/librarybg.jpg")
-        pixmap = QPixmap(image_path)
-        scaled_pixmap = pixmap.scaled(self.size(), Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+        scaled_pixmap = cached_pixmap("images/librarybg.jpg", self.width(), self.height(), Qt.KeepAspectRatioByExpanding)
 
         palette = QPalette()
         palette.setBrush(QPalette.Background, QBrush(scaled_pixmap))
@@ -414,14 +3233,68 @@ class InventoryWidget(QWidget):
 
         
         layout.addLayout(self.top_layout)
+
+        filter_style = """
+            QComboBox, QSpinBox {
+                border: 2px solid #3498DB;
+                border-radius: 5px;
+                padding: 6px;
+                font-size: 13px;
+                background-color: white;
+            }
+            QCheckBox {
+                color: white;
+                font-size: 13px;
+                background-color: rgba(0, 0, 0, 80);
+                padding: 8px;
+                border-radius: 5px;
+            }
+        """
+        self.filter_layout = QHBoxLayout()
+
+        self.category_filter = QComboBox(self)
+        self.category_filter.addItem("All categories", "")
+        self.category_filter.currentIndexChanged.connect(self.search_record)
+        self.filter_layout.addWidget(self.category_filter, 2)
+
+        # The lowest value of each year box means "any year"
+        self.year_from_filter = QSpinBox(self)
+        self.year_to_filter = QSpinBox(self)
+        for year_filter, prefix in ((self.year_from_filter, "From "), (self.year_to_filter, "To ")):
+            year_filter.setRange(0, 9999)
+            year_filter.setPrefix(prefix)
+            year_filter.setSpecialValueText(f"{prefix}any year")
+            year_filter.valueChanged.connect(self.search_record)
+            self.filter_layout.addWidget(year_filter, 1)
+
+        self.status_filter = QComboBox(self)
+        self.status_filter.addItem("Any status", "")
+        self.status_filter.currentIndexChanged.connect(self.search_record)
+        self.filter_layout.addWidget(self.status_filter, 1)
+
+        self.available_filter = QCheckBox("On shelf only", self)
+        self.available_filter.stateChanged.connect(self.search_record)
+        self.filter_layout.addWidget(self.available_filter)
+
+        self.filter_widgets = (self.category_filter, self.year_from_filter, self.year_to_filter, self.status_filter, self.available_filter)
+        for widget in self.filter_widgets:
+            widget.setStyleSheet(filter_style)
+
+        layout.addLayout(self.filter_layout)
+
+        self.loading = LoadingIndicator()
+        layout.addWidget(self.loading)
         
         self.table = QTableWidget()
-        self.table.setColumnCount(8)
-        self.table.setHorizontalHeaderLabels(["Book Title", "Book ID", "Author", "Year", "Category", "Total\nCopies", "Available\nCopies", "Status"])
+        self.table.setColumnCount(9)
+        self.table.setHorizontalHeaderLabels(["Book Title", "Book ID", "Author", "Year", "Category", "Total\nCopies", "Available\nCopies", "Status", "Holds"])
 
         self.table.setContextMenuPolicy(Qt.CustomContextMenu)
         self.table.customContextMenuRequested.connect(self.show_book_context_menu)
 
+        self.pager = TablePager(self.table, INVENTORY_SORT_COLUMNS, self.fetch_page)
+        self.shown_text = ""
+
         self.table.setAlternatingRowColors(True)
         self.table.setStyleSheet("""
             QTableWidget {
@@ -474,6 +3347,7 @@ class InventoryWidget(QWidget):
         self.table.horizontalHeader().setSectionResizeMode(5, QHeaderView.ResizeToContents) 
         self.table.horizontalHeader().setSectionResizeMode(6, QHeaderView.ResizeToContents) 
         self.table.horizontalHeader().setSectionResizeMode(7, QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setSectionResizeMode(8, QHeaderView.ResizeToContents)
 
         self.button_layout = QHBoxLayout()
 
@@ -523,19 +3397,74 @@ class InventoryWidget(QWidget):
 
 
     def load_records(self):
-        self.table.setRowCount(0)
-        cursor.execute("SELECT * FROM Library")
-        records = cursor.fetchall() or []
-
-        for row_num, row_data in enumerate(records):
-            self.table.insertRow(row_num)
-            for col_num, data in enumerate(row_data):
-                item = QTableWidgetItem(str(data))
-                item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-
-                item.setToolTip(str(data))  
-
-                self.table.setItem(row_num, col_num, item)
+        self.fetch_records("")
+
+    def fetch_records(self, text, after=None):
+        self.loading.start()
+        self.pager.next_page = None
+        sort, descending = self.pager.sort()
+        submit_query(self.main_window.query_executor, "inventory", cursor, inventory_page,
+                     (text, self.current_filters(), sort, descending, after),
+                     lambda page: self.show_records(page[0], text, page[1], page[2], append=after is not None),
+                     self.show_load_error)
+
+    def fetch_page(self, after):
+        # A new sort searches for what is typed now; later pages continue the search on screen
+        if after is None:
+            self.fetch_records(self.search_input.text().strip())
+        else:
+            self.fetch_records(self.shown_text, after)
+
+    def current_filters(self):
+        return {
+            "category": self.category_filter.currentData(),
+            "year_from": self.year_from_filter.value() if self.year_from_filter.value() > self.year_from_filter.minimum() else None,
+            "year_to": self.year_to_filter.value() if self.year_to_filter.value() > self.year_to_filter.minimum() else None,
+            "status": self.status_filter.currentData(),
+            "available": self.available_filter.isChecked(),
+        }
+
+    def update_facets(self, facets):
+        for widget in self.filter_widgets:
+            widget.blockSignals(True)
+
+        for combo, label, counts in ((self.category_filter, "All categories", facets["category"]),
+                                     (self.status_filter, "Any status", facets["status"])):
+            selected = combo.currentData()
+            combo.clear()
+            combo.addItem(f"{label} ({sum(counts.values())})", "")
+            # Keep the current choice listed even when the other filters leave it empty
+            for value in sorted(set(counts) | ({selected} if selected else set()), key=str):
+                combo.addItem(f"{value} ({counts.get(value, 0)})", value)
+            combo.setCurrentIndex(max(combo.findData(selected), 0))
+
+        self.available_filter.setText(f"On shelf only ({facets['available']})")
+
+        first_year, last_year = facets["years"]
+        if first_year:
+            for year_filter in (self.year_from_filter, self.year_to_filter):
+                any_year = year_filter.value() == year_filter.minimum()
+                year_filter.setRange(first_year - 1, last_year)
+                if any_year:
+                    year_filter.setValue(year_filter.minimum())
+
+        for widget in self.filter_widgets:
+            widget.blockSignals(False)
+
+    def clear_filters(self):
+        for widget in self.filter_widgets:
+            widget.blockSignals(True)
+        self.category_filter.setCurrentIndex(0)
+        self.status_filter.setCurrentIndex(0)
+        self.year_from_filter.setValue(self.year_from_filter.minimum())
+        self.year_to_filter.setValue(self.year_to_filter.minimum())
+        self.available_filter.setChecked(False)
+        for widget in self.filter_widgets:
+            widget.blockSignals(False)
+
+    def show_load_error(self, message):
+        self.loading.stop()
+        QMessageBox.critical(self, "Error", f"Failed to load books: {message}")
 
     def show_book_context_menu(self, position):
         menu = QMenu()
@@ -554,17 +3483,21 @@ class InventoryWidget(QWidget):
             QMessageBox.warning(self, "Error", "Please select a book to view details!")
             return
 
-        book_id = self.table.item(selected_row, 0).text().strip()
-        book_title = self.table.item(selected_row, 1).text().strip()
-        author = self.table.item(selected_row, 2).text().strip()
-        year = self.table.item(selected_row, 3).text().strip()
-        category = self.table.item(selected_row, 4).text().strip()
-        total_copies = self.table.item(selected_row, 5).text().strip()
-        available_copies = self.table.item(selected_row, 6).text().strip()
-        status = self.table.item(selected_row, 7).text().strip()
+        book_id = self.table.item(selected_row, 1).text()
+        book = catalogue_cache.get(cursor, book_id)
+        if not book:
+            QMessageBox.warning(self, "Error", "Book not found in the database!")
+            return
+
+        holds = waiting_holds(cursor, book_id)
+        holds_text = "" if holds else "<p>No one is waiting for this book.</p>"
+        copies_text = "".join(
+            f"<p>{barcode}: " + (f"on loan to {borrower_name}, due {due_date}" if borrower_name else "on shelf") + "</p>"
+            for barcode, borrower_name, due_date in book_copies(cursor, book_id)
+        )
 
         import re
-        formatted_title = re.sub(r'(\d+\.)', r'\1 ', book_title).strip()
+        formatted_title = re.sub(r'(\d+\.)', r'\1 ', book.title or "").strip()
 
         details_text = f"""
         <html>
@@ -586,14 +3519,18 @@ class InventoryWidget(QWidget):
         </style>
         </head>
         <body>
-        <p><b>Book ID:</b> {book_id}</p>
+        <p><b>Book ID:</b> {book.book_id}</p>
         <p><b>Book Title:</b> {formatted_title}</p>
-        <p><b>Author:</b> {author}</p>
-        <p><b>Year:</b> {year}</p>
-        <p><b>Category:</b> {category}</p>
-        <p><b>Total Copies:</b> {total_copies}</p>
-        <p><b>Available Copies:</b> {available_copies}</p>
-        <p><b>Status:</b> {status}</p>
+        <p><b>Author:</b> {book.author}</p>
+        <p><b>Year:</b> {book.year}</p>
+        <p><b>Category:</b> {book.category}</p>
+        <p><b>Total Copies:</b> {book.total_copies}</p>
+        <p><b>Available Copies:</b> {book.available_copies}</p>
+        <p><b>Status:</b> {book.status}</p>
+        <p><b>Copies:</b></p>
+        {copies_text}
+        <p><b>Holds Queue:</b></p>
+        {holds_text}
         </body>
         </html>
         """
@@ -623,29 +3560,65 @@ class InventoryWidget(QWidget):
         ok_button.clicked.connect(self.book_details_window.close)
 
         layout.addWidget(details_label)
+        if holds:
+            # Right-click a hold to cancel it
+            self.holds_list = QListWidget()
+            for position, (hold_id, name, contact, email, queued_at) in enumerate(holds, start=1):
+                item = QListWidgetItem(f"{position}. {name} ({queued_at[:16]})")
+                item.setData(Qt.UserRole, hold_id)
+                self.holds_list.addItem(item)
+            self.holds_list.setContextMenuPolicy(Qt.CustomContextMenu)
+            self.holds_list.customContextMenuRequested.connect(self.show_hold_context_menu)
+            layout.addWidget(self.holds_list)
         layout.addWidget(ok_button, alignment=Qt.AlignCenter)
         self.book_details_window.setLayout(layout)
 
         self.book_details_window.exec_()
 
 
-    def search_record(self):
-        query = self.search_input.text().strip()
-        self.table.setRowCount(0)
+    def show_hold_context_menu(self, position):
+        item = self.holds_list.itemAt(position)
+        if item is None:
+            return
+        menu = QMenu()
+        cancel_action = QAction("❌ Cancel Hold", self)
+        cancel_action.triggered.connect(lambda: self.cancel_selected_hold(item))
+        menu.addAction(cancel_action)
+        menu.exec_(self.holds_list.viewport().mapToGlobal(position))
+
+    def cancel_selected_hold(self, item):
+        confirm = QMessageBox.question(self, "Cancel Hold", f"Cancel the hold for {item.text()}?",
+                                       QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if confirm != QMessageBox.Yes:
+            return
 
-        if not query:
-            cursor.execute("SELECT * FROM Library")
-        else:
-            cursor.execute("""
-                SELECT * FROM Library 
-                WHERE BK_NAME LIKE ? OR AUTHOR_NAME LIKE ? OR BK_ID LIKE ?
-            """, (f'%{query}%', f'%{query}%', f'%{query}%'))
+        try:
+            cancel_hold(cursor, item.data(Qt.UserRole))
+            connector.commit()
+        except sqlite3.Error as e:
+            connector.rollback()
+            QMessageBox.critical(self, "Error", f"Failed to cancel hold: {e}")
+            return
+        self.holds_list.takeItem(self.holds_list.row(item))
+        self.load_records()
 
-        results = cursor.fetchall()
+    def search_record(self):
+        self.fetch_records(self.search_input.text().strip())
+
+    def show_records(self, results, query, facets=None, next_page=None, append=False):
+        self.loading.stop()
+        self.shown_text = query
+        self.pager.next_page = next_page
+        if facets:
+            self.update_facets(facets)
+        self.table.setUpdatesEnabled(False)
+        first_row = self.table.rowCount() if append else 0
+        if not append:
+            self.table.setRowCount(0)
 
         if results:
-            for row_num, row_data in enumerate(results):
-                self.table.insertRow(row_num)
+            self.table.setRowCount(first_row + len(results))
+            for row_num, row_data in enumerate(results, start=first_row):
                 for col_num, data in enumerate(row_data):
                     item = QTableWidgetItem(str(data))
 
@@ -654,13 +3627,14 @@ class InventoryWidget(QWidget):
                     item.setToolTip(str(data))
 
                     self.table.setItem(row_num, col_num, item)
-        else:
-            if query:
+        elif not append:
+            if query or any(self.current_filters().values()):
                 self.table.setRowCount(1)
                 item = QTableWidgetItem("No matching records found")
                 item.setFlags(Qt.ItemIsEnabled)
                 self.table.setItem(0, 0, item)
                 self.table.setSpan(0, 0, 1, self.table.columnCount())
+        self.table.setUpdatesEnabled(True)
 
 
     def import_from_excel(self):
@@ -668,17 +3642,38 @@ class InventoryWidget(QWidget):
         if not file_path:
             return
 
+        confirm = QMessageBox.question(
+            self, "Import Mode",
+            "Merge this workbook into the existing records?\n\n"
+            "Yes: update books imported from this workbook before and skip unchanged sheets.\n"
+            "No: add every row as a new book.",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes
+        )
+
+        self.import_excel_file(file_path, merge=confirm == QMessageBox.Yes)
+
+    def import_excel_file(self, file_path, merge=False):
         try:
             xls = pd.ExcelFile(file_path)
+            workbook_name = os.path.basename(file_path)
             excluded_sheets = ["Categories_Key"]
-            imported_books = 0  
-            skipped_books = 0  
-            existing_book_ids = set() 
-            unknown_counter = 1 
-            
-            cursor.execute("SELECT BK_ID FROM Library")
-            for row in cursor.fetchall():
-                existing_book_ids.add(row[0])
+            imported_books = 0
+            skipped_books = 0
+            unchanged_books = 0
+            unchanged_sheets = 0
+
+            # A merge updates the book each row was imported as before (ImportRows) and
+            # gives every other row a new ID, so it never lands on an unrelated book.
+            id_allocator = BookIdAllocator.from_database(cursor)
+
+            row_hashes = {}
+            sheet_hashes = {}
+            if merge:
+                cursor.execute("SELECT BK_ID, ROW_HASH FROM ImportRows WHERE WORKBOOK = ?", (workbook_name,))
+                row_hashes = dict(cursor.fetchall())
+                id_allocator.add(row_hashes)
+                cursor.execute("SELECT SHEET_NAME, CONTENT_HASH FROM ImportSheets WHERE WORKBOOK = ?", (workbook_name,))
+                sheet_hashes = dict(cursor.fetchall())
 
             category_mappings = {}
             
@@ -691,7 +3686,7 @@ class InventoryWidget(QWidget):
             if metadata_sheet:
                 for header_row in range(0, 10):
                     try:
-                        metadata_df = pd.read_excel(file_path, sheet_name=metadata_sheet, header=header_row)
+                        metadata_df = pd.read_excel(xls, sheet_name=metadata_sheet, header=header_row)
                         
                         code_col = None
                         title_col = None
@@ -751,7 +3746,17 @@ class InventoryWidget(QWidget):
                     continue
 
                 print(f"Processing sheet: {sheet_name}")
-                
+
+                raw_sheet = pd.read_excel(xls, sheet_name=sheet_name, header=None, dtype=str)
+                sheet_hash = hashlib.sha1(
+                    str(raw_sheet.shape).encode() + pd.util.hash_pandas_object(raw_sheet, index=False).values.tobytes()
+                ).hexdigest()
+
+                if merge and sheet_hashes.get(sheet_name) == sheet_hash:
+                    unchanged_sheets += 1
+                    print(f"Sheet {sheet_name} is unchanged since the last import. Skipping...")
+                    continue
+
                 max_header_row = 15  
                 df = None
                 header_row = None
@@ -760,7 +3765,7 @@ class InventoryWidget(QWidget):
                 
                 for i in range(max_header_row):
                     try:
-                        temp_df = pd.read_excel(file_path, sheet_name=sheet_name, header=i)
+                        temp_df = pd.read_excel(xls, sheet_name=sheet_name, header=i)
                         
                         header_matches = 0
                         for col in temp_df.columns:
@@ -777,7 +3782,7 @@ class InventoryWidget(QWidget):
                         print(f"Error checking row {i}: {e}")
 
                 if df is None:
-                    df = pd.read_excel(file_path, sheet_name=sheet_name, header=0)
+                    df = pd.read_excel(xls, sheet_name=sheet_name, header=0)
                     header_row = 0
                     print("Using first row as header by default")
 
@@ -807,7 +3812,7 @@ class InventoryWidget(QWidget):
                 else:
                     try:
                         for i in range(max(0, header_row-5), header_row):
-                            row_df = pd.read_excel(file_path, sheet_name=sheet_name, header=None, nrows=1, skiprows=i)
+                            row_df = pd.read_excel(xls, sheet_name=sheet_name, header=None, nrows=1, skiprows=i)
                             for j in range(len(row_df.columns)):
                                 cell_value = str(row_df.iloc[0, j]).strip().upper()
                                 for code in category_mappings.keys():
@@ -895,38 +3900,46 @@ class InventoryWidget(QWidget):
 
                 df["BK_ID"] = df["BK_ID"].astype(str).str.replace(r"\.0$", "", regex=True)
 
-                def generate_book_id(row):
-                    nonlocal unknown_counter
-                    
-                    original_id = str(row["BK_ID"]).strip()
-
-                    original_id = re.sub(r"[^a-zA-Z0-9_-]", "", original_id)
-
-                    if original_id in ["-", "", "nan"] or original_id.isspace():
-                        while True:
-                            new_id = f"UNKNOWN_{unknown_counter}"
-                            unknown_counter += 1
-                            
-                            if new_id not in existing_book_ids:
-                                break
-                    else:
-                        numeric_part = re.search(r'\d+', original_id)
-                        if numeric_part:
-                            numeric_id = numeric_part.group()
-                            new_id = f"{category_code}{numeric_id}"
-                        else:
-                            new_id = f"{category_code}{original_id}"
-
-                    counter = 1
-                    unique_id = new_id
-                    while unique_id in existing_book_ids:
-                        unique_id = f"{new_id}_{counter}"
-                        counter += 1
-                    
-                    existing_book_ids.add(unique_id)
-                    return unique_id
-
-                df["BK_ID"] = df.apply(generate_book_id, axis=1)
+                sheet_ids = df["BK_ID"].str.strip()
+                df["ROW_KEY"] = sheet_ids + "#" + df.groupby(sheet_ids).cumcount().astype(str)
+
+                known_ids = pd.Series(None, index=df.index, dtype=object)
+                legacy_books = set()
+                if merge:
+                    cursor.execute(
+                        "SELECT ROW_KEY, BK_ID FROM ImportRows WHERE WORKBOOK = ? AND SHEET_NAME = ?", (workbook_name, sheet_name)
+                    )
+                    provenance = cursor.fetchall()
+                    known_ids = df["ROW_KEY"].map({row_key: book_id for row_key, book_id in provenance if row_key is not None}).astype(object)
+                    # Rows recorded before row keys existed are matched on their base ID, in the order
+                    # the first import handed out that base and its "_n" suffixes
+                    legacy_ids = {}
+                    for row_key, book_id in provenance:
+                        if row_key is None:
+                            base_id, _, suffix = book_id.rpartition("_") if re.search(r"_\d+$", book_id) else (book_id, "", "0")
+                            legacy_ids.setdefault(base_id, []).append((int(suffix), book_id))
+                    if legacy_ids:
+                        for candidates in legacy_ids.values():
+                            candidates.sort(reverse=True)
+                        derived_ids = BookIdAllocator().allocate_series(df["BK_ID"], category_code)
+                        base_ids = derived_ids.str.replace(r"_\d+$", "", regex=True)
+                        for index in known_ids.index[known_ids.isna()]:
+                            candidates = legacy_ids.get(base_ids[index])
+                            if candidates:
+                                known_ids[index] = candidates.pop()[1]
+                                legacy_books.add(known_ids[index])
+                else:
+                    # A plain import only brings a deleted book back for the same workbook row it came from
+                    cursor.execute("""
+                        SELECT r.ROW_KEY, r.BK_ID FROM ImportRows r JOIN Library l ON l.BK_ID = r.BK_ID AND l.IS_DELETED = 1
+                        WHERE r.WORKBOOK = ? AND r.SHEET_NAME = ? AND r.ROW_KEY IS NOT NULL
+                    """, (workbook_name, sheet_name))
+                    known_ids = df["ROW_KEY"].map(dict(cursor.fetchall())).astype(object)
+                retire_deleted_copies(cursor, known_ids.dropna())
+
+                new_rows = known_ids.isna()
+                df.loc[~new_rows, "BK_ID"] = known_ids[~new_rows]
+                df.loc[new_rows, "BK_ID"] = id_allocator.allocate_series(df.loc[new_rows, "BK_ID"], category_code)
                 
 
                 df["AVAILABLE_COPIES"] = df["TOTAL_COPIES"]
@@ -936,32 +3949,113 @@ class InventoryWidget(QWidget):
 
                 df = df[df["BK_NAME"].str.lower() != "title"]
 
+                if merge:
+                    upserts = []
+                    import_rows = []
+                    for _, row in df.iterrows():
+                        book_name = str(row["BK_NAME"]).strip()
+
+                        untitled = book_name in ["-", "", "nan"] or not book_name
+                        if untitled:
+                            book_name = f"[Untitled Book {row['BK_ID']}]"
+
+                        values = (book_name, row["BK_ID"], str(row["AUTHOR_NAME"]), int(row["YEAR_PUBLISHED"]),
+                                  row["CATEGORY"], int(row["TOTAL_COPIES"]), int(row["AVAILABLE_COPIES"]), row["BK_STATUS"])
+                        row_hash = hashlib.sha1(repr(values).encode()).hexdigest()
+
+                        if row_hashes.get(row["BK_ID"]) == row_hash:
+                            if row["BK_ID"] in legacy_books:
+                                import_rows.append((row["BK_ID"], workbook_name, sheet_name, row["ROW_KEY"], row_hash))
+                            unchanged_books += 1
+                            continue
+
+                        if untitled:
+                            skipped_books += 1
+                        upserts.append(values)
+                        import_rows.append((row["BK_ID"], workbook_name, sheet_name, row["ROW_KEY"], row_hash))
+
+                    # Existing books keep their outstanding loans: the borrowed count
+                    # (TOTAL_COPIES - AVAILABLE_COPIES) is carried over to the new total.
+                    cursor.executemany(
+                        """INSERT INTO Library (BK_NAME, BK_ID, AUTHOR_NAME, YEAR_PUBLISHED, CATEGORY,
+                        TOTAL_COPIES, AVAILABLE_COPIES, BK_STATUS)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(BK_ID) DO UPDATE SET
+                            BK_NAME = excluded.BK_NAME,
+                            AUTHOR_NAME = excluded.AUTHOR_NAME,
+                            YEAR_PUBLISHED = excluded.YEAR_PUBLISHED,
+                            CATEGORY = excluded.CATEGORY,
+                            IS_DELETED = 0,
+                            DELETED_AT = NULL,
+                            TOTAL_COPIES = MAX(excluded.TOTAL_COPIES, Library.TOTAL_COPIES - Library.AVAILABLE_COPIES),
+                            AVAILABLE_COPIES = MAX(excluded.TOTAL_COPIES - (Library.TOTAL_COPIES - Library.AVAILABLE_COPIES), 0),
+                            BK_STATUS = CASE
+                                WHEN excluded.TOTAL_COPIES - (Library.TOTAL_COPIES - Library.AVAILABLE_COPIES) > 0 THEN 'Available'
+                                ELSE 'Fully Issued'
+                            END""",
+                        upserts
+                    )
+                    cursor.executemany(IMPORT_ROWS_UPSERT, import_rows)
+                    cursor.execute(
+                        """INSERT INTO ImportSheets (WORKBOOK, SHEET_NAME, CONTENT_HASH, IMPORTED_AT) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(WORKBOOK, SHEET_NAME) DO UPDATE SET
+                            CONTENT_HASH = excluded.CONTENT_HASH, IMPORTED_AT = excluded.IMPORTED_AT""",
+                        (workbook_name, sheet_name, sheet_hash, datetime.now().strftime("%Y-%m-%d %H:%M"))
+                    )
+                    imported_books += len(upserts)
+                    continue
+
                 for _, row in df.iterrows():
                     book_name = str(row["BK_NAME"]).strip()
 
                     if book_name in ["-", "", "nan"] or not book_name:
                         book_name = f"[Untitled Book {row['BK_ID']}]"
-                        skipped_books += 1 
-                        
+                        skipped_books += 1
+
                     try:
                         cursor.execute(
                             """INSERT INTO Library (BK_NAME, BK_ID, AUTHOR_NAME, YEAR_PUBLISHED, CATEGORY,
                             TOTAL_COPIES, AVAILABLE_COPIES, BK_STATUS) 
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT(BK_ID) DO UPDATE SET
+                                BK_NAME = excluded.BK_NAME,
+                                AUTHOR_NAME = excluded.AUTHOR_NAME,
+                                YEAR_PUBLISHED = excluded.YEAR_PUBLISHED,
+                                CATEGORY = excluded.CATEGORY,
+                                TOTAL_COPIES = excluded.TOTAL_COPIES,
+                                AVAILABLE_COPIES = excluded.AVAILABLE_COPIES,
+                                BK_STATUS = excluded.BK_STATUS,
+                                IS_DELETED = 0,
+                                DELETED_AT = NULL
+                            WHERE Library.IS_DELETED = 1""",
                             (book_name, row["BK_ID"], row["AUTHOR_NAME"], row["YEAR_PUBLISHED"], 
                             row["CATEGORY"], row["TOTAL_COPIES"], row["AVAILABLE_COPIES"], row["BK_STATUS"])
                         )
+                        if cursor.rowcount == 0:
+                            raise sqlite3.IntegrityError(f"Book ID {row['BK_ID']} already exists")
+                        # Recorded so a later merge of this workbook updates the book instead of adding it again
+                        values = (book_name, row["BK_ID"], str(row["AUTHOR_NAME"]), int(row["YEAR_PUBLISHED"]),
+                                  row["CATEGORY"], int(row["TOTAL_COPIES"]), int(row["AVAILABLE_COPIES"]), row["BK_STATUS"])
+                        cursor.execute(IMPORT_ROWS_UPSERT, (row["BK_ID"], workbook_name, sheet_name, row["ROW_KEY"],
+                                                            hashlib.sha1(repr(values).encode()).hexdigest()))
                         imported_books += 1
                     except sqlite3.IntegrityError:
                         QMessageBox.warning(self, "Duplicate Book ID", f"Skipping duplicate Book ID: {row['BK_ID']}")
                     except Exception as e:
                         print(f"Error inserting row: {e}")
             
+            sync_copies(cursor)
             connector.commit()
 
-            QMessageBox.information(self, "Import Results", 
-                f"{imported_books} books imported successfully!\n"
-                f"{skipped_books} books had no titles and were imported with placeholder names.")
+            if merge:
+                QMessageBox.information(self, "Import Results",
+                    f"{imported_books} books added or updated successfully!\n"
+                    f"{unchanged_books} unchanged books and {unchanged_sheets} unchanged sheets were skipped.\n"
+                    f"{skipped_books} books had no titles and were imported with placeholder names.")
+            else:
+                QMessageBox.information(self, "Import Results",
+                    f"{imported_books} books imported successfully!\n"
+                    f"{skipped_books} books had no titles and were imported with placeholder names.")
 
             connector.commit()
 
@@ -984,28 +4078,7 @@ class InventoryWidget(QWidget):
         self.add_window.setWindowTitle("Add New Book")
         self.add_window.setGeometry(200, 200, 400, 300)
         layout = QVBoxLayout()
-        self.add_window.setStyleSheet("""
-            QWidget {
-                background-color: white;
-                font-family: Helvetica;
-            }
-            QLineEdit {
-                border: 2px solid #3498DB;
-                border-radius: 5px;
-                padding: 8px;
-                font-size: 14px;
-            }
-            QPushButton {
-                border-radius: 5px;
-                padding: 10px;
-                font-size: 14px;
-                color: white;
-            }
-            QLabel {
-                font-size: 14px;
-                color: #2C3E50;
-            }
-        """)
+        self.add_window.setObjectName("addBookWindow")
 
         form_layout = QFormLayout()
         self.book_name_input = QLineEdit()
@@ -1091,10 +4164,12 @@ class InventoryWidget(QWidget):
         status = "Available" if available_copies > 0 else "Fully Issued"
 
         try:
+            # A deleted book keeps its row (and history), so its ID stays taken
             cursor.execute(
                 "INSERT INTO Library (BK_NAME, BK_ID, AUTHOR_NAME, YEAR_PUBLISHED, CATEGORY, TOTAL_COPIES, AVAILABLE_COPIES, BK_STATUS) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
                 (book_name, book_id, author, int(year_published), category, total_copies, available_copies, status)
             )
+            sync_copies(cursor, [book_id])
             connector.commit()
             QMessageBox.information(self, "Success", "Book added successfully!\n\nNote: If no available year, enter 0.")
             self.add_window.close()
@@ -1104,7 +4179,8 @@ class InventoryWidget(QWidget):
                 self.main_window.dashboard_widget.refresh_data()
 
         except sqlite3.IntegrityError:
-            QMessageBox.warning(self, "Error", "Book ID already exists!")
+            connector.rollback()
+            QMessageBox.warning(self, "Error", "Book ID already exists (deleted books keep their IDs)!")
             self.add_window.raise_()
             self.add_window.activateWindow()
 
@@ -1124,83 +4200,62 @@ class InventoryWidget(QWidget):
             total_copies = self.table.item(selected_row, 5).text()
             available_copies = self.table.item(selected_row, 6).text()
 
-            self.update_window = QWidget()
-            self.update_window.setWindowTitle("Update Book Record")
-            self.update_window.setGeometry(300, 200, 400, 400)
-            
-            self.update_window.setStyleSheet("""
-                QWidget {
-                    background-color: white;
-                    font-family: Helvetica;
-                }
-                QLineEdit {
-                    border: 2px solid #3498DB;  /* Blue border for input fields */
-                    border-radius: 5px;
-                    padding: 8px;
-                    font-size: 14px;
-                    color: black;  /* Text color for inputs */
-                }
-                QPushButton {
-                    border-radius: 5px;
-                    padding: 10px;
-                    font-size: 14px;
-                    color: white;
-                }
-                QPushButton#updateButton {
-                    background-color: #3498DB;  /* Blue for Update button */
-                }
-                QPushButton#updateButton:hover {
-                    background-color: #2980B9;  /* Darker blue on hover */
-                }
-                QPushButton#cancelButton {
-                    background-color: #E74C3C;  /* Red for Cancel button */
-                }
-                QPushButton#cancelButton:hover {
-                    background-color: #C0392B;  /* Darker red on hover */
-                }
-                QLabel {
-                    font-size: 14px;
-                    color: black;  /* Set text color of labels to black */
-                }
-            """)
-
-            layout = QVBoxLayout()
+            # The form is built once and refilled for each book
+            if self.update_window is None:
+                self.build_update_window()
+            self.updating_book = (book_id, int(available_copies))
+            self.update_book_name.setText(book_name)
+            self.update_book_id.setText(book_id)
+            self.update_author.setText(author)
+            self.update_year.setText(year_published)
+            self.update_category.setText(category)
+            self.update_total_copies.setText(total_copies)
+            self.update_window.show()
+            self.update_window.raise_()
 
-            form_layout = QFormLayout()
-            self.update_book_name = QLineEdit(book_name)
-            self.update_author = QLineEdit(author)
-            self.update_year = QLineEdit(year_published)
-            self.update_category = QLineEdit(category)
-            self.update_total_copies = QLineEdit(total_copies)
+    def build_update_window(self):
+        self.update_window = QWidget()
+        self.update_window.setWindowTitle("Update Book Record")
+        self.update_window.setGeometry(300, 200, 400, 400)
+        
+        self.update_window.setObjectName("updateBookWindow")
 
-            self.update_book_id = QLineEdit(book_id)
-            self.update_book_id.setReadOnly(True)
-            self.update_book_id.setStyleSheet("background-color: #f0f0f0;")
+        layout = QVBoxLayout()
 
-            form_layout.addRow("Book Title:", self.update_book_name)
-            form_layout.addRow("Book ID (Read-only):", self.update_book_id)
-            form_layout.addRow("Authors:", self.update_author)
-            form_layout.addRow("Year Published:", self.update_year)
-            form_layout.addRow("Category:", self.update_category)
-            form_layout.addRow("Total Copies:", self.update_total_copies)
+        form_layout = QFormLayout()
+        self.update_book_name = QLineEdit()
+        self.update_author = QLineEdit()
+        self.update_year = QLineEdit()
+        self.update_category = QLineEdit()
+        self.update_total_copies = QLineEdit()
+
+        self.update_book_id = QLineEdit()
+        self.update_book_id.setReadOnly(True)
+        self.update_book_id.setStyleSheet("background-color: #f0f0f0;")
+
+        form_layout.addRow("Book Title:", self.update_book_name)
+        form_layout.addRow("Book ID (Read-only):", self.update_book_id)
+        form_layout.addRow("Authors:", self.update_author)
+        form_layout.addRow("Year Published:", self.update_year)
+        form_layout.addRow("Category:", self.update_category)
+        form_layout.addRow("Total Copies:", self.update_total_copies)
 
-            layout.addLayout(form_layout)
+        layout.addLayout(form_layout)
 
-            button_layout = QHBoxLayout()
+        button_layout = QHBoxLayout()
 
-            update_button = QPushButton("Update")
-            update_button.setObjectName("updateButton")
-            update_button.clicked.connect(lambda: self.save_updated_record(book_id, int(available_copies)))
-            button_layout.addWidget(update_button)
+        update_button = QPushButton("Update")
+        update_button.setObjectName("updateButton")
+        update_button.clicked.connect(lambda: self.save_updated_record(*self.updating_book))
+        button_layout.addWidget(update_button)
 
-            cancel_button = QPushButton("Cancel")
-            cancel_button.setObjectName("cancelButton")
-            cancel_button.clicked.connect(self.update_window.close)
-            button_layout.addWidget(cancel_button)
+        cancel_button = QPushButton("Cancel")
+        cancel_button.setObjectName("cancelButton")
+        cancel_button.clicked.connect(self.update_window.close)
+        button_layout.addWidget(cancel_button)
 
-            layout.addLayout(button_layout)
-            self.update_window.setLayout(layout)
-            self.update_window.show()
+        layout.addLayout(button_layout)
+        self.update_window.setLayout(layout)
 
     def save_updated_record(self, book_id, old_available_copies):
         book_name = self.update_book_name.text().strip()
@@ -1238,28 +4293,24 @@ class InventoryWidget(QWidget):
 
         new_total_copies = int(total_copies_input)
 
-        cursor.execute("SELECT TOTAL_COPIES, AVAILABLE_COPIES FROM Library WHERE BK_ID = ?", (book_id,))
-        book_data = cursor.fetchone()
+        book = catalogue_cache.get(cursor, book_id)
 
-        if not book_data:
+        if not book:
             QMessageBox.warning(self, "Error", "Book not found in the database!")
             return
 
-        old_total_copies, available_copies = book_data
-        borrowed_count = old_total_copies - available_copies
+        borrowed_count = book.total_copies - book.available_copies
 
         if new_total_copies < borrowed_count:
             QMessageBox.warning(self, "Error", f"Cannot set total copies lower than borrowed copies ({borrowed_count})!")
             return
 
-        new_available_copies = new_total_copies - borrowed_count
-        new_status = "Available" if new_available_copies > 0 else "Fully Issued"
-
         try:
             cursor.execute(
-                "UPDATE Library SET BK_NAME=?, AUTHOR_NAME=?, YEAR_PUBLISHED=?, CATEGORY=?, TOTAL_COPIES=?, AVAILABLE_COPIES=?, BK_STATUS=? WHERE BK_ID=?",  
-                (book_name, author, int(year_published), category, new_total_copies, new_available_copies, new_status, book_id)
+                "UPDATE Library SET BK_NAME=?, AUTHOR_NAME=?, YEAR_PUBLISHED=?, CATEGORY=?, TOTAL_COPIES=? WHERE BK_ID=?",  
+                (book_name, author, int(year_published), category, new_total_copies, book_id)
             )
+            sync_copies(cursor, [book_id])
             connector.commit()
             QMessageBox.information(self, "Success", "Book record updated successfully!")
             self.update_window.close()
@@ -1281,71 +4332,68 @@ class InventoryWidget(QWidget):
         book_name = self.table.item(selected_row, 0).text()
         book_id = self.table.item(selected_row, 1).text()
 
-        cursor.execute("SELECT AVAILABLE_COPIES, BK_STATUS FROM Library WHERE BK_ID = ?", (book_id,))
-        book_data = cursor.fetchone()
+        book = catalogue_cache.get(cursor, book_id)
 
-        if not book_data:
+        if not book:
             QMessageBox.warning(self, "Error", "Book not found in the database!")
             return
 
-        available_copies, status = book_data
+        is_hold = book.available_copies <= 0 or book.status == "Fully Issued"
 
-        if available_copies <= 0 or status == "Fully Issued":
-            QMessageBox.warning(self, "Error", "This book is currently fully issued! No available copies.")
-            return
+        if is_hold:
+            confirm = QMessageBox.question(
+                self, "Fully Issued",
+                f"This book is currently fully issued! No available copies.\n\n"
+                f"{book.holds_queued} borrower(s) already waiting. Place a hold?",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+            )
+            if confirm != QMessageBox.Yes:
+                return
+
+        # The form is built once; each opening clears it and fills in the book
+        if self.borrow_window is None:
+            self.build_borrow_window()
+        self.borrowing = (book_id, is_hold)
+        title = "Place Hold" if is_hold else "Borrow Book"
+        self.borrow_window.setWindowTitle(title)
+        self.borrow_header_label.setText(title)
+        self.borrow_book_name_label.setText(book_name)
+        self.borrow_book_id_label.setText(book_id)
+        self.borrow_save_button.setText("📌 Place Hold" if is_hold else "📚 Borrow Book")
+        for field in (self.borrower_name_input, self.contact_input, self.email_input, self.other_classification_input):
+            field.clear()
+        self.gender_input.setCurrentIndex(0)
+        self.classification_input.setCurrentIndex(0)
+        self.borrower_name_input.setFocus()
+        self.borrow_window.show()
+        self.borrow_window.raise_()
 
+    def build_borrow_window(self):
         self.borrow_window = QWidget()
-        self.borrow_window.setWindowTitle("Borrow Book")
         self.borrow_window.setFixedSize(820, 490) 
-        self.borrow_window.setStyleSheet("""
-            QWidget {
-                background-color: #F5F5F5;
-                font-family: Helvetica;
-            }
-            QLabel {
-                font-size: 14px;
-                color: #2C3E50;
-            }
-            QLineEdit, QComboBox {
-                border: 2px solid #3498DB;
-                border-radius: 5px;
-                padding: 8px;
-                font-size: 14px;
-                background-color: white;
-            }
-            QPushButton {
-                border-radius: 5px;
-                padding: 10px;
-                font-size: 14px;
-                color: white;
-                background-color: #3498DB;
-            }
-            QPushButton:hover {
-                background-color: #2980B9;
-            }
-        """)
+        self.borrow_window.setObjectName("borrowWindow")
 
         layout = QVBoxLayout()
         layout.setSpacing(15)
         layout.setContentsMargins(20, 20, 20, 20)
 
-        header_label = QLabel("Borrow Book")
-        header_label.setFont(QFont("Helvetica", 18, QFont.Bold))
-        header_label.setStyleSheet("color: #3498DB; margin-bottom: 15px;")
-        layout.addWidget(header_label)
+        self.borrow_header_label = QLabel()
+        self.borrow_header_label.setFont(QFont("Helvetica", 18, QFont.Bold))
+        self.borrow_header_label.setStyleSheet("color: #3498DB; margin-bottom: 15px;")
+        layout.addWidget(self.borrow_header_label)
 
         book_info_layout = QFormLayout()
         book_info_layout.setSpacing(10)
 
-        book_name_label = QLabel(book_name)
-        book_name_label.setWordWrap(True) 
-        book_name_label.setFixedWidth(650) 
-        book_name_label.setStyleSheet("font-size: 16px; color: #2C3E50; font-weight: bold;")
-        book_info_layout.addRow("Book Title:", book_name_label)
+        self.borrow_book_name_label = QLabel()
+        self.borrow_book_name_label.setWordWrap(True) 
+        self.borrow_book_name_label.setFixedWidth(650) 
+        self.borrow_book_name_label.setStyleSheet("font-size: 16px; color: #2C3E50; font-weight: bold;")
+        book_info_layout.addRow("Book Title:", self.borrow_book_name_label)
 
-        book_id_label = QLabel(book_id)
-        book_id_label.setStyleSheet("font-size: 14px; color: #2C3E50;")
-        book_info_layout.addRow("Book ID:", book_id_label)
+        self.borrow_book_id_label = QLabel()
+        self.borrow_book_id_label.setStyleSheet("font-size: 14px; color: #2C3E50;")
+        book_info_layout.addRow("Book ID:", self.borrow_book_id_label)
 
         layout.addLayout(book_info_layout)
 
@@ -1388,10 +4436,10 @@ class InventoryWidget(QWidget):
         button_layout = QHBoxLayout()
         button_layout.setSpacing(10)
 
-        save_button = QPushButton("📚 Borrow Book")
-        save_button.setStyleSheet("background-color: #27AE60;")
-        save_button.clicked.connect(lambda: self.confirm_borrow(book_id))
-        button_layout.addWidget(save_button)
+        self.borrow_save_button = QPushButton()
+        self.borrow_save_button.clicked.connect(self.save_borrow_form)
+        self.borrow_save_button.setStyleSheet("background-color: #27AE60;")
+        button_layout.addWidget(self.borrow_save_button)
 
         cancel_button = QPushButton("🚫 Cancel")
         cancel_button.setStyleSheet("background-color: #E74C3C;")
@@ -1401,7 +4449,13 @@ class InventoryWidget(QWidget):
         layout.addLayout(button_layout)
 
         self.borrow_window.setLayout(layout)
-        self.borrow_window.show()
+
+    def save_borrow_form(self):
+        book_id, is_hold = self.borrowing
+        if is_hold:
+            self.confirm_hold(book_id)
+        else:
+            self.confirm_borrow(book_id)
 
     def toggle_other_input(self):
         selected = self.classification_input.currentText()
@@ -1413,15 +4467,7 @@ class InventoryWidget(QWidget):
             self.other_classification_input.setFixedHeight(0)
 
 
-    def is_valid_email(self, email):
-        pattern = r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$'
-        return re.match(pattern, email) is not None
-
-    def is_valid_phone(self, phone):
-        pattern = r'^\+?\d{11,15}$' 
-        return re.match(pattern, phone) is not None
-
-    def confirm_borrow(self, book_id):
+    def borrower_form_values(self):
         borrower_name = self.borrower_name_input.text().strip()
         contact_number = self.contact_input.text().strip()
         email = self.email_input.text().strip()
@@ -1432,26 +4478,51 @@ class InventoryWidget(QWidget):
             else self.classification_input.currentText()
         )
 
-        date_borrowed = datetime.now().strftime("%Y-%m-%d %H:%M")
-
         if not borrower_name or not contact_number or not email:
             QMessageBox.warning(self, "Error", "All borrower details are required!")
             self.borrow_window.raise_()
             self.borrow_window.activateWindow()
-            return
+            return None
 
-        if not self.is_valid_email(email):
+        if not is_valid_email(email):
             QMessageBox.warning(self, "Invalid Email", "Please enter a valid email address!")
             self.borrow_window.raise_()
             self.borrow_window.activateWindow()
-            return
+            return None
 
-        if not self.is_valid_phone(contact_number):
-            QMessageBox.warning(self, "Invalid Phone Number", "Please enter a valid phone number (digits only)!")
+        if not is_valid_phone(contact_number):
+            QMessageBox.warning(self, "Invalid Phone Number", "Please enter a valid phone number (10-15 digits)!")
             self.borrow_window.raise_()
             self.borrow_window.activateWindow()
+            return None
+
+        return borrower_name, contact_number, email, gender, classification
+
+    def confirm_hold(self, book_id):
+        borrower = self.borrower_form_values()
+        if borrower is None:
+            return
+
+        try:
+            hold_id = place_hold(cursor, book_id, *borrower)
+            connector.commit()
+            position = hold_queue_position(cursor, hold_id)
+            QMessageBox.information(self, "Hold Placed", f"Hold placed for {borrower[0]}. Position in queue: {position}")
+            self.borrow_window.close()
+            self.load_records()
+
+        except sqlite3.Error as e:
+            connector.rollback()
+            QMessageBox.critical(self, "Error", f"Failed to place hold: {e}")
+
+    def confirm_borrow(self, book_id):
+        borrower = self.borrower_form_values()
+        if borrower is None:
             return
 
+        borrower_name, contact_number, email, gender, classification = borrower
+        date_borrowed = datetime.now().strftime("%Y-%m-%d %H:%M")
+
         cursor.execute("SELECT AVAILABLE_COPIES FROM Library WHERE BK_ID = ?", (book_id,))
         book_data = cursor.fetchone()
 
@@ -1466,18 +4537,8 @@ class InventoryWidget(QWidget):
             return
 
         try:
-            cursor.execute(
-                """INSERT INTO Borrowers (BK_ID, BORROWER_NAME, CONTACT_NUMBER, EMAIL, GENDER, CLASSIFICATION, DATE_BORROWED) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (book_id, borrower_name, contact_number, email, gender, classification, date_borrowed)
-            )
-
-            available_copies -= 1
-            new_status = "Available" if available_copies > 0 else "Fully Issued"
-
-            cursor.execute("UPDATE Library SET AVAILABLE_COPIES = ?, BK_STATUS = ? WHERE BK_ID = ?", 
-                (available_copies, new_status, book_id))
-
+            insert_loan(cursor, book_id, free_copy_id(cursor, book_id), borrower_name, contact_number, email,
+                        gender, classification, date_borrowed)
             connector.commit()
             QMessageBox.information(self, "Success", "Book borrowed successfully!")
             self.borrow_window.close()
@@ -1507,9 +4568,12 @@ class InventoryWidget(QWidget):
 
         if confirm == QMessageBox.Yes:
             try:
-                cursor.execute("DELETE FROM Borrowers WHERE BK_ID = ?", (book_id,))  
+                deleted_at = datetime.now().strftime("%Y-%m-%d %H:%M")
+                cursor.execute("UPDATE Borrowers SET IS_DELETED = 1, DELETED_AT = ? WHERE BK_ID = ? AND IS_DELETED = 0", (deleted_at, book_id))
+
+                cursor.execute("DELETE FROM Holds WHERE BK_ID = ? AND LOAN_ID IS NULL", (book_id,))
 
-                cursor.execute("DELETE FROM Library WHERE BK_ID = ?", (book_id,))  
+                cursor.execute("UPDATE Library SET IS_DELETED = 1, DELETED_AT = ?, HOLDS_QUEUED = 0 WHERE BK_ID = ?", (deleted_at, book_id))
 
                 connector.commit()
                 self.table.removeRow(selected_row)
@@ -1532,9 +4596,12 @@ class InventoryWidget(QWidget):
 
         if confirm == QMessageBox.Yes:
             try:
-                cursor.execute("DELETE FROM Library")
+                deleted_at = datetime.now().strftime("%Y-%m-%d %H:%M")
+                cursor.execute("UPDATE Library SET IS_DELETED = 1, DELETED_AT = ?, HOLDS_QUEUED = 0 WHERE IS_DELETED = 0", (deleted_at,))
 
-                cursor.execute("DELETE FROM Borrowers")
+                cursor.execute("UPDATE Borrowers SET IS_DELETED = 1, DELETED_AT = ? WHERE IS_DELETED = 0", (deleted_at,))
+
+                cursor.execute("DELETE FROM Holds WHERE LOAN_ID IS NULL")
 
                 connector.commit()
                 self.table.setRowCount(0)
@@ -1551,6 +4618,7 @@ class InventoryWidget(QWidget):
 
 
     def clear_fields(self):
+        self.clear_filters()
         self.search_input.clear()
         self.load_records()
 
@@ -1560,15 +4628,16 @@ class BorrowerReportsWidget(QWidget):
         self.main_window = main_window
         self.cursor = cursor
         self.connector = connector
+        self.return_window = None
+        self.edit_window = None
         self.initUI()
         self.load_borrower_reports()
         
-        self.background_pixmap = QPixmap(resource_path("images/librarybg.jpg"))
-
     def paintEvent(self, event):
         painter = QPainter(self)
-        if not self.background_pixmap.isNull():
-            scaled_pixmap = self.background_pixmap.scaled(self.size(), aspectRatioMode=1)  
+        # Scaled once per window size rather than on every repaint
+        scaled_pixmap = cached_pixmap("images/librarybg.jpg", self.width(), self.height())
+        if not scaled_pixmap.isNull():
             painter.drawPixmap(self.rect(), scaled_pixmap)
         super().paintEvent(event)
 
@@ -1664,12 +4733,12 @@ class BorrowerReportsWidget(QWidget):
         filter_layout = QHBoxLayout()
 
         self.sort_combo = QComboBox()
-        self.sort_combo.addItems(["All", "This Day", "This Week", "This Month"])
+        self.sort_combo.addItems(REPORT_PERIODS)
         self.sort_combo.setFixedWidth(170)
         self.sort_combo.currentIndexChanged.connect(self.load_borrower_reports)
 
         self.status_combo = QComboBox()
-        self.status_combo.addItems(["All", "Returned", "Not Returned"])
+        self.status_combo.addItems(REPORT_STATUSES)
         self.status_combo.setFixedWidth(170)
         self.status_combo.currentIndexChanged.connect(self.load_borrower_reports)
 
@@ -1707,10 +4776,10 @@ class BorrowerReportsWidget(QWidget):
         main_layout.addLayout(self.selection_layout)
 
         self.reports_table = QTableWidget()
-        self.reports_table.setColumnCount(11)
+        self.reports_table.setColumnCount(12)
         self.reports_table.setHorizontalHeaderLabels([
             "", "Borrower ID", "Book ID", "Book Title", "Borrower Name",
-            "Contact", "Email", "Gender", "Classification", "Date Borrowed", "Date Returned"
+            "Contact", "Email", "Gender", "Classification", "Date Borrowed", "Date Returned", "Due Date"
         ])
         self.reports_table.setAlternatingRowColors(True)
 
@@ -1722,16 +4791,25 @@ class BorrowerReportsWidget(QWidget):
         self.reports_table.horizontalHeader().setSectionResizeMode(7, QHeaderView.ResizeToContents)  
         self.reports_table.horizontalHeader().setSectionResizeMode(9, QHeaderView.ResizeToContents)  
         self.reports_table.horizontalHeader().setSectionResizeMode(10, QHeaderView.ResizeToContents)  
+        self.reports_table.horizontalHeader().setSectionResizeMode(11, QHeaderView.ResizeToContents)
 
-        self.item_changed_connections = []
         self.reports_table.itemChanged.connect(self.check_selection_status)
+        self.item_changed_connected = True
+
+        self.pager = TablePager(self.reports_table, REPORT_SORT_COLUMNS, self.fetch_page)
+        self.report_query = ("All", "All", None, False)
+        # Select All: ((period, status), count) of every loan matching the filters
+        self.all_selected = None
+
+        self.loading = LoadingIndicator()
+        main_layout.addWidget(self.loading)
 
         main_layout.addWidget(self.reports_table)
 
         self.return_book_button = QPushButton("↩️ Return Book")
         self.return_book_button.clicked.connect(self.return_book_from_report)
 
-        self.export_button = QPushButton("📤 Export to Excel")
+        self.export_button = QPushButton("📤 Export")
         self.export_button.clicked.connect(self.export_to_excel)
 
         self.edit_button = QPushButton("✏️ Edit Borrower Details")
@@ -1744,12 +4822,25 @@ class BorrowerReportsWidget(QWidget):
         self.clear_button = QPushButton("🔄 Clear Fields")
         self.clear_button.clicked.connect(self.clear_fields)
 
+        self.export_changes_button = QPushButton("🆕 Export Changes")
+        self.export_changes_button.setToolTip("Export only the loans added or changed since the last time this was run")
+        self.export_changes_button.clicked.connect(lambda: self.export_data("Changes"))
+
+        self.notices_button = QPushButton("📨 Overdue Notices")
+        self.notices_button.clicked.connect(self.generate_overdue_notices)
+
+        self.schedules_button = QPushButton("⏰ Scheduled Reports")
+        self.schedules_button.clicked.connect(self.show_report_schedules)
+
         button_layout = QHBoxLayout()
         button_layout.addStretch()
         button_layout.addWidget(self.return_book_button)
         button_layout.addWidget(self.export_button)
+        button_layout.addWidget(self.export_changes_button)
         button_layout.addWidget(self.edit_button)
         button_layout.addWidget(self.delete_button)
+        button_layout.addWidget(self.notices_button)
+        button_layout.addWidget(self.schedules_button)
         button_layout.addWidget(self.clear_button)
         button_layout.addStretch()
 
@@ -1758,51 +4849,53 @@ class BorrowerReportsWidget(QWidget):
         self.has_selected_items = False
         
     def load_borrower_reports(self):
-        if hasattr(self, 'item_changed_connected') and self.item_changed_connected:
-            self.reports_table.itemChanged.disconnect(self.check_selection_status)
-            self.item_changed_connected = False
-            
-        self.reports_table.setRowCount(0)
-
         sort_option = self.sort_combo.currentText().strip()
         status_option = self.status_combo.currentText().strip()
+        self.report_query = (sort_option, status_option) + self.pager.sort()
+        self.fetch_reports()
+
+    def fetch_reports(self, after=None):
+        self.loading.start()
+        self.pager.next_page = None
+        self.main_window.submit_report_query("reports", self.cursor, borrower_report_page,
+                     self.report_query + (after,), lambda page: self.show_borrower_reports(page, append=after is not None),
+                     self.show_load_error)
+
+    def fetch_page(self, after):
+        if after is None:
+            self.load_borrower_reports()
+        else:
+            self.fetch_reports(after)
 
-        query = """
-            SELECT b.BORROWER_ID, b.BK_ID, l.BK_NAME, b.BORROWER_NAME, b.CONTACT_NUMBER, 
-                b.EMAIL, b.GENDER, b.CLASSIFICATION, b.DATE_BORROWED, b.DATE_RETURNED
-            FROM Borrowers b
-            JOIN Library l ON b.BK_ID = l.BK_ID
-            WHERE 1=1
-        """ 
-
-        if sort_option == "This Day":
-            query += " AND substr(b.DATE_BORROWED, 1, 10) = DATE('now')"
-        elif sort_option == "This Week":
-            query += " AND substr(b.DATE_BORROWED, 1, 10) >= DATE('now', '-6 days')"
-        elif sort_option == "This Month":
-            query += " AND substr(b.DATE_BORROWED, 1, 7) = strftime('%Y-%m', 'now')"
-
-        if status_option == "Returned":
-            query += " AND b.DATE_RETURNED IS NOT NULL"
-        elif status_option == "Not Returned":
-            query += " AND b.DATE_RETURNED IS NULL"
+    def show_load_error(self, message):
+        self.loading.stop()
+        QMessageBox.critical(self.main_window, "Error", f"Failed to load borrower reports: {message}")
 
-        query += " ORDER BY b.BORROWER_ID ASC"
+    def show_borrower_reports(self, page, append=False):
+        borrowers, self.pager.next_page = page
+        self.loading.stop()
+        if hasattr(self, 'item_changed_connected') and self.item_changed_connected:
+            self.reports_table.itemChanged.disconnect(self.check_selection_status)
+            self.item_changed_connected = False
+            
+        if not append:
+            self.reports_table.setRowCount(0)
+            self.all_selected = None
+        first_row = self.reports_table.rowCount()
 
         try:
-            self.cursor.execute(query)
-            borrowers = self.cursor.fetchall()
-
-            for row_num, borrower in enumerate(borrowers):
-                self.reports_table.insertRow(row_num)
-
+            self.reports_table.setUpdatesEnabled(False)
+            self.reports_table.setRowCount(first_row + len(borrowers))
+            for row_num, borrower in enumerate(borrowers, start=first_row):
                 checkbox_item = QTableWidgetItem()
                 checkbox_item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-                checkbox_item.setCheckState(Qt.Unchecked)
+                checkbox_item.setCheckState(Qt.Checked if self.all_selected else Qt.Unchecked)
+                checkbox_item.setData(Qt.UserRole, borrower[0])
                 self.reports_table.setItem(row_num, 0, checkbox_item)
 
                 date_returned = borrower[9] 
                 is_returned = date_returned is not None and date_returned.strip() != ""
+                is_overdue = not is_returned and borrower[10] is not None and borrower[10] < date.today().isoformat()
 
                 for col_num, data in enumerate(borrower):
                     item = QTableWidgetItem(str(data))
@@ -1813,29 +4906,35 @@ class BorrowerReportsWidget(QWidget):
 
                     if is_returned:
                         item.setForeground(QColor(169, 169, 169)) 
+                    elif is_overdue:
+                        item.setForeground(QColor("#C0392B"))
 
                     self.reports_table.setItem(row_num, col_num + 1, item)
 
             self.reports_table.itemChanged.connect(self.check_selection_status)
             self.item_changed_connected = True
 
+            if append:
+                return
             self.select_all_button.hide()
             self.deselect_all_button.hide()
-            self.export_button.setText("📤 Export to Excel")
+            self.export_button.setText("📤 Export")
             self.has_selected_items = False
 
-        except sqlite3.Error as e:
-            QMessageBox.critical(self.main_window, "Error", f"Failed to load borrower reports: {str(e)}")
+        finally:
+            self.reports_table.setUpdatesEnabled(True)
 
             
     def check_selection_status(self, item):
         if item.column() != 0:
             return
-            
-        selected_count = 0
-        for row in range(self.reports_table.rowCount()):
-            if self.reports_table.item(row, 0).checkState() == Qt.Checked:
-                selected_count += 1
+        # Unticking a row narrows Select All down to the rows ticked on screen
+        if item.checkState() == Qt.Unchecked:
+            self.all_selected = None
+        self.update_selection_status()
+
+    def update_selection_status(self):
+        selected_count = self.all_selected[1] if self.all_selected else len(self.get_selected_rows())
                 
         if selected_count > 0:
             self.has_selected_items = True
@@ -1845,19 +4944,38 @@ class BorrowerReportsWidget(QWidget):
             self.deselect_all_button.show()
         else:
             self.has_selected_items = False
-            self.export_button.setText("📤 Export to Excel")
+            self.export_button.setText("📤 Export")
             self.delete_button.setText("🗑️ Delete")
             self.select_all_button.hide()
             self.deselect_all_button.hide()
             
             
     def select_all_rows(self):
-        for row in range(self.reports_table.rowCount()):
-            self.reports_table.item(row, 0).setCheckState(Qt.Checked)
+        # Select All covers every matching loan, not just the pages scrolled to so far. Only the
+        # filters and a count are kept; export and delete run through the filter query.
+        report_filter = self.report_query[:2]
+        self.main_window.submit_report_query("reports count", self.cursor, borrower_report_count, report_filter,
+                                             lambda count: self.select_all_matching(report_filter, count),
+                                             self.show_load_error)
+
+    def select_all_matching(self, report_filter, count):
+        if report_filter != self.report_query[:2]:
+            return
+        self.all_selected = (report_filter, count)
+        self.set_all_check_states(Qt.Checked)
             
     def deselect_all_rows(self):
+        self.all_selected = None
+        self.set_all_check_states(Qt.Unchecked)
+
+    def set_all_check_states(self, state):
+        # One status update for the whole table instead of one full rescan per row
+        self.reports_table.blockSignals(True)
         for row in range(self.reports_table.rowCount()):
-            self.reports_table.item(row, 0).setCheckState(Qt.Unchecked)
+            self.reports_table.item(row, 0).setCheckState(state)
+        self.reports_table.blockSignals(False)
+        self.reports_table.viewport().update()
+        self.update_selection_status()
             
     def get_selected_rows(self):
         selected_rows = []
@@ -1865,66 +4983,263 @@ class BorrowerReportsWidget(QWidget):
             if self.reports_table.item(row, 0).checkState() == Qt.Checked:
                 selected_rows.append(row)
         return selected_rows
+
+    def get_selected_borrower_ids(self):
+        return [self.reports_table.item(row, 0).data(Qt.UserRole) for row in self.get_selected_rows()]
     
     def export_to_excel(self):
-        selected_rows = self.get_selected_rows()
+        if self.all_selected:
+            self.export_all_matching()
+            return
+        selected_ids = self.get_selected_borrower_ids()
         
-        if not selected_rows and self.reports_table.rowCount() > 0:
+        if not selected_ids and self.reports_table.rowCount() > 0:
             self.export_data("All")
-        elif selected_rows:
-            self.export_selected_rows(selected_rows)
+        elif selected_ids:
+            self.export_selected_rows(selected_ids)
         else:
             QMessageBox.warning(self, "Export", "No data to export")
 
-    def export_selected_rows(self, selected_rows):
+    def export_file_path(self, title):
+        file_path, selected_filter = QFileDialog.getSaveFileName(self, title, "", export_file_filter())
+        if not file_path:
+            return None, None
+
         try:
-            data = []
-            
-            for row_index in selected_rows:
-                row_data = []
-                for col in range(1, self.reports_table.columnCount()):
-                    item = self.reports_table.item(row_index, col)
-                    row_data.append(item.text() if item else "")
-                data.append(row_data)
-            
-            columns = ["Borrower ID", "Book ID", "Book Title", "Borrower Name", 
-                    "Contact", "Email", "Gender", "Classification", "Date Borrowed", "Date Returned"]
-            df = pd.DataFrame(data, columns=columns)
-            
-            file_path, _ = QFileDialog.getSaveFileName(self, "Save Excel File", "", "Excel Files (*.xlsx)")
+            export_format = export_format_for(file_path, selected_filter)
+        except ValueError as e:
+            QMessageBox.warning(self.main_window, "Export", str(e))
+            return None, None
+        extension = EXPORT_FORMATS[export_format][0]
+        if not file_path.lower().endswith(extension):
+            file_path += extension
+        return file_path, export_format
+
+    def export_selected_rows(self, borrower_ids):
+        try:
+            file_path, export_format = self.export_file_path("Export Selected Records")
             
             if file_path:
-                df.to_excel(file_path, index=False)
-                QMessageBox.information(self.main_window, "Success", f"{len(selected_rows)} records exported successfully to {file_path}")
+                count = export_loans_by_id(self.cursor, file_path, borrower_ids, export_format)
+                QMessageBox.information(self.main_window, "Success", f"{count} records exported successfully to {file_path}")
         
         except Exception as e:
             QMessageBox.critical(self.main_window, "Error", f"Failed to export selected data: {e}")
 
-    def export_data(self, option):
+    def export_all_matching(self):
+        (period, status), _ = self.all_selected
         try:
-            if option == "All":
-                query = """
-                    SELECT b.BORROWER_ID, b.BK_ID, l.BK_NAME, b.BORROWER_NAME, b.CONTACT_NUMBER, 
-                        b.EMAIL, b.GENDER, b.CLASSIFICATION, b.DATE_BORROWED, b.DATE_RETURNED
-                    FROM Borrowers b
-                    JOIN Library l ON b.BK_ID = l.BK_ID
-                    ORDER BY b.BORROWER_ID ASC
-                """
+            file_path, export_format = self.export_file_path("Export Selected Records")
 
-            self.cursor.execute(query)
-            data = self.cursor.fetchall()
+            if file_path:
+                count = export_report_loans(self.cursor, file_path, period, status, export_format)
+                QMessageBox.information(self.main_window, "Success", f"{count} records exported successfully to {file_path}")
 
-            columns = ["Borrower ID", "Book ID", "Book Title", "Borrower Name", "Contact", "Email", "Gender", "Classification", "Date Borrowed", "Date Returned"]
-            df = pd.DataFrame(data, columns=columns)
+        except Exception as e:
+            QMessageBox.critical(self.main_window, "Error", f"Failed to export selected data: {e}")
+
+    def export_data(self, option):
+        if option == "Changes":
+            self.export_changes()
+            return
 
-            file_path, _ = QFileDialog.getSaveFileName(self, "Save Excel File", "", "Excel Files (*.xlsx)")
+        try:
+            file_path, export_format = self.export_file_path("Export Borrower Reports")
 
             if file_path:
-                df.to_excel(file_path, index=False)
-                QMessageBox.information(self.main_window, "Success", f"Data exported successfully to {file_path}")
+                count = export_loans(self.cursor, file_path, export_format)
+                QMessageBox.information(self.main_window, "Success", f"{count} records exported successfully to {file_path}")
         except Exception as e:
             QMessageBox.critical(self.main_window, "Error", f"Failed to export data: {e}")
 
+    def export_changes(self):
+        last_event_id, last_exported_at, last_file_path = last_export(self.cursor, "registrar")
+        file_path, selected_filter = QFileDialog.getSaveFileName(
+            self, "Export Changes", last_file_path or f"loan_changes_{date.today():%Y%m%d}.csv",
+            export_file_filter(), options=QFileDialog.DontConfirmOverwrite
+        )
+        if not file_path:
+            return
+
+        try:
+            export_format = export_format_for(file_path, selected_filter)
+        except ValueError as e:
+            QMessageBox.warning(self.main_window, "Export Changes", str(e))
+            return
+        extension = EXPORT_FORMATS[export_format][0]
+        if not file_path.lower().endswith(extension):
+            file_path += extension
+
+        append = False
+        if os.path.exists(file_path) and export_format in APPENDABLE_EXPORT_FORMATS:
+            choice = QMessageBox.question(
+                self.main_window, "Export Changes",
+                f"{file_path} already exists.\n\nYes: append the new changes to it (rolling export).\nNo: replace it.",
+                QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel, QMessageBox.Yes
+            )
+            if choice == QMessageBox.Cancel:
+                return
+            append = choice == QMessageBox.Yes
+        elif os.path.exists(file_path):
+            choice = QMessageBox.question(
+                self.main_window, "Export Changes",
+                f"{file_path} already exists and {export_format} files cannot be appended to.\n\nReplace it?",
+                QMessageBox.Yes | QMessageBox.Cancel, QMessageBox.Cancel
+            )
+            if choice == QMessageBox.Cancel:
+                return
+
+        try:
+            count = export_loan_changes(self.cursor, file_path, "registrar", append)
+            self.connector.commit()
+            since = f" since {last_exported_at}" if last_exported_at else ""
+            QMessageBox.information(self.main_window, "Success", f"{count} new or changed loans{since} exported to {file_path}")
+        except Exception as e:
+            self.connector.rollback()
+            QMessageBox.critical(self.main_window, "Error", f"Failed to export changes: {e}")
+
+    def generate_overdue_notices(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Overdue Notices", f"overdue_notices_{date.today():%Y%m%d}.csv", "CSV Files (*.csv)")
+        if not file_path:
+            return
+
+        try:
+            count = write_overdue_notices(self.cursor, file_path)
+            QMessageBox.information(self.main_window, "Overdue Notices", f"{count} overdue notices written to {file_path}")
+        except (sqlite3.Error, OSError) as e:
+            QMessageBox.critical(self.main_window, "Error", f"Failed to write overdue notices: {e}")
+
+    def show_report_schedules(self):
+        self.schedules_window = QWidget()
+        self.schedules_window.setWindowTitle("Scheduled Reports")
+        self.schedules_window.setGeometry(250, 150, 1000, 480)
+        self.schedules_window.setStyleSheet(self.styleSheet())
+
+        layout = QVBoxLayout(self.schedules_window)
+
+        self.schedules_table = QTableWidget()
+        self.schedules_table.setColumnCount(10)
+        self.schedules_table.setHorizontalHeaderLabels([
+            "Name", "Schedule", "Period", "Status", "Format", "Folder", "Enabled", "Next Run", "Last Run", "Last Result"
+        ])
+        self.schedules_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.schedules_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.schedules_table.horizontalHeader().setSectionResizeMode(9, QHeaderView.Stretch)
+        layout.addWidget(self.schedules_table)
+
+        form_layout = QHBoxLayout()
+        self.job_name_input = QLineEdit()
+        self.job_name_input.setPlaceholderText("Name, e.g. daily-loans")
+        self.job_schedule_input = QLineEdit("0 18 * * 1-5")
+        self.job_schedule_input.setToolTip("minute hour day-of-month month day-of-week, or @daily / @weekly / @monthly")
+        self.job_period_combo = QComboBox()
+        self.job_period_combo.addItems(REPORT_PERIODS)
+        self.job_status_combo = QComboBox()
+        self.job_status_combo.addItems(REPORT_STATUSES)
+        self.job_format_combo = QComboBox()
+        self.job_format_combo.addItems(list(EXPORT_FORMATS))
+        self.job_folder_input = QLineEdit("reports")
+        for widget in (self.job_name_input, self.job_schedule_input, self.job_period_combo,
+                       self.job_status_combo, self.job_format_combo, self.job_folder_input):
+            form_layout.addWidget(widget)
+        layout.addLayout(form_layout)
+
+        buttons_layout = QHBoxLayout()
+        add_button = QPushButton("➕ Add Job")
+        add_button.clicked.connect(self.add_report_schedule)
+        toggle_button = QPushButton("⏯️ Enable/Disable")
+        toggle_button.clicked.connect(self.toggle_report_schedule)
+        run_button = QPushButton("▶️ Run Now")
+        run_button.clicked.connect(self.run_report_schedule_now)
+        remove_button = QPushButton("🗑️ Remove Job")
+        remove_button.clicked.connect(self.remove_report_schedule)
+        buttons_layout.addStretch()
+        for button in (add_button, toggle_button, run_button, remove_button):
+            buttons_layout.addWidget(button)
+        buttons_layout.addStretch()
+        layout.addLayout(buttons_layout)
+
+        self.load_report_schedules()
+        self.schedules_window.show()
+
+    def load_report_schedules(self):
+        jobs = report_jobs(self.cursor)
+        self.schedules_table.setRowCount(len(jobs))
+        for row_num, job in enumerate(jobs):
+            for col_num, data in enumerate(job[1:]):
+                if col_num == 6:
+                    data = "Yes" if data else "No"
+                item = QTableWidgetItem("" if data is None else str(data))
+                item.setData(Qt.UserRole, job[0])
+                self.schedules_table.setItem(row_num, col_num, item)
+
+    def selected_report_schedule(self):
+        row = self.schedules_table.currentRow()
+        if row == -1:
+            QMessageBox.warning(self.schedules_window, "No Selection", "Please select a report job first.")
+            return None
+        return self.schedules_table.item(row, 0).data(Qt.UserRole)
+
+    def add_report_schedule(self):
+        name = self.job_name_input.text().strip()
+        if not name:
+            QMessageBox.warning(self.schedules_window, "Missing Name", "Please give the report job a name.")
+            return
+
+        try:
+            add_report_job(
+                self.cursor, name, self.job_schedule_input.text().strip(), self.job_period_combo.currentText(),
+                self.job_status_combo.currentText(), self.job_format_combo.currentText(), self.job_folder_input.text().strip() or "reports"
+            )
+            self.connector.commit()
+        except ValueError as e:
+            QMessageBox.warning(self.schedules_window, "Invalid Schedule", str(e))
+            return
+        except sqlite3.IntegrityError:
+            self.connector.rollback()
+            QMessageBox.warning(self.schedules_window, "Duplicate Name", f"A report job named {name} already exists.")
+            return
+
+        self.job_name_input.clear()
+        self.load_report_schedules()
+
+    def toggle_report_schedule(self):
+        job_id = self.selected_report_schedule()
+        if job_id is None:
+            return
+        self.cursor.execute("UPDATE ReportJobs SET ENABLED = 1 - ENABLED, NEXT_RUN_AT = NULL WHERE JOB_ID = ?", (job_id,))
+        self.connector.commit()
+        self.load_report_schedules()
+
+    def run_report_schedule_now(self):
+        job_id = self.selected_report_schedule()
+        if job_id is None:
+            return
+        self.cursor.execute(
+            "UPDATE ReportJobs SET NEXT_RUN_AT = ? WHERE JOB_ID = ? AND ENABLED = 1",
+            (datetime.now().strftime("%Y-%m-%d %H:%M"), job_id)
+        )
+        self.connector.commit()
+
+        scheduler = self.main_window.report_scheduler
+        if scheduler is not None:
+            scheduler.run_now()
+        elif isinstance(self.connector, sqlite3.Connection):
+            # No scheduler on this desk: run the due jobs once in the background
+            threading.Thread(target=run_due_report_jobs, args=("library.db",), name="report-run-now", daemon=True).start()
+        else:
+            QMessageBox.information(self.schedules_window, "Run Now", "The library server runs the job at its next check.")
+            return
+        QTimer.singleShot(1000, self.load_report_schedules)
+
+    def remove_report_schedule(self):
+        job_id = self.selected_report_schedule()
+        if job_id is None:
+            return
+        self.cursor.execute("DELETE FROM ReportJobs WHERE JOB_ID = ?", (job_id,))
+        self.connector.commit()
+        self.load_report_schedules()
+
     def return_book_from_report(self):
         selected_rows = self.get_selected_rows()
         
@@ -1950,6 +5265,15 @@ class BorrowerReportsWidget(QWidget):
             QMessageBox.information(self, "Already Returned", "This book has already been returned.")
             return
 
+        # The confirmation is built once and relabelled for each loan
+        if self.return_window is None:
+            self.build_return_window()
+        self.returning = (borrower_id, book_id)
+        self.return_header_label.setText(f"Return book for {borrower_name}?")
+        self.return_window.show()
+        self.return_window.raise_()
+
+    def build_return_window(self):
         self.return_window = QWidget()
         self.return_window.setWindowTitle("Return Book")
         
@@ -1960,36 +5284,21 @@ class BorrowerReportsWidget(QWidget):
         y = (screen.height() - window_height) // 2
         self.return_window.setGeometry(x, y, window_width, window_height)
 
-        self.return_window.setStyleSheet("""
-            QWidget {
-                background-color: #F9F9F9;
-                font-family: Helvetica;
-            }
-            QLabel {
-                font-size: 14px;
-                color: #2C3E50;
-            }
-            QPushButton {
-                border-radius: 5px;
-                padding: 10px;
-                font-size: 14px;
-                color: white;
-            }
-        """)
+        self.return_window.setObjectName("returnWindow")
 
         layout = QVBoxLayout()
         layout.setSpacing(15)
         layout.setContentsMargins(20, 20, 20, 20)
 
-        header_label = QLabel(f"Return book for {borrower_name}?")
-        header_label.setFont(QFont("Helvetica", 14, QFont.Bold))
-        header_label.setStyleSheet("color: #219150; margin-bottom: 15px;")
-        layout.addWidget(header_label)
+        self.return_header_label = QLabel()
+        self.return_header_label.setFont(QFont("Helvetica", 14, QFont.Bold))
+        self.return_header_label.setStyleSheet("color: #219150; margin-bottom: 15px;")
+        layout.addWidget(self.return_header_label)
 
         button_layout = QHBoxLayout()
         return_button = QPushButton("↩️ Confirm Return")
         return_button.setStyleSheet("background-color: #219150;")
-        return_button.clicked.connect(lambda: self.process_return_from_report(borrower_id, book_id))
+        return_button.clicked.connect(lambda: self.process_return_from_report(*self.returning))
         button_layout.addWidget(return_button)
 
         cancel_button = QPushButton("❌ Cancel")
@@ -1999,36 +5308,30 @@ class BorrowerReportsWidget(QWidget):
 
         layout.addLayout(button_layout)
         self.return_window.setLayout(layout)
-        self.return_window.show()
 
     def process_return_from_report(self, borrower_id, book_id):
         try:
-            self.cursor.execute("SELECT BK_ID, TOTAL_COPIES, AVAILABLE_COPIES FROM Library WHERE BK_ID = ?", (book_id,))
-            book_data = self.cursor.fetchone()
+            book = catalogue_cache.get(self.cursor, book_id)
 
-            print(f"Book ID being queried: {book_id}")
-            print(f"Book data retrieved: {book_data}")
-
-            if not book_data:
+            if not book:
                 QMessageBox.warning(self, "Error", f"Book ID {book_id} not found in the database!", QMessageBox.Ok)
                 return
 
-            total_copies, available_copies = book_data[1], book_data[2]
-            
-            if available_copies < total_copies:
-                available_copies += 1
-            else:
+            if book.available_copies >= book.total_copies:
                 QMessageBox.warning(self.main_window, "Error", "All copies of this book are already available!", QMessageBox.Ok)
                 return
 
-            date_returned = datetime.now().strftime("%Y-%m-%d %H:%M")
-            self.cursor.execute("UPDATE Borrowers SET DATE_RETURNED = ? WHERE BORROWER_ID = ?", (date_returned, borrower_id))
-            self.cursor.execute("UPDATE Library SET AVAILABLE_COPIES = ?, BK_STATUS = ? WHERE BK_ID = ?", 
-                (available_copies, "Available" if available_copies > 0 else "Fully Issued", book_id))
+            self.cursor.execute("SELECT COPY_ID FROM Borrowers WHERE BORROWER_ID = ?", (borrower_id,))
+            copy_id = self.cursor.fetchone()[0]
+
+            hold_borrower = return_loan(self.cursor, borrower_id, book_id, copy_id)
             
             self.connector.commit()
 
-            QMessageBox.information(self.main_window, "Success", "Book returned successfully!", QMessageBox.Ok)
+            if hold_borrower:
+                QMessageBox.information(self.main_window, "Success", f"Book returned successfully! The copy is now on loan to {hold_borrower}, next in the holds queue.", QMessageBox.Ok)
+            else:
+                QMessageBox.information(self.main_window, "Success", "Book returned successfully!", QMessageBox.Ok)
             self.return_window.close()
             self.load_borrower_reports()
 
@@ -2036,6 +5339,7 @@ class BorrowerReportsWidget(QWidget):
                 self.main_window.inventory_widget.load_records()
 
         except sqlite3.Error as e:
+            self.connector.rollback()
             QMessageBox.critical(self, "Error", f"Failed to return book: {e}", QMessageBox.Ok)
 
 
@@ -2066,99 +5370,26 @@ class BorrowerReportsWidget(QWidget):
             gender = self.reports_table.item(selected_row, 7).text()
             classification_value = self.reports_table.item(selected_row, 8).text()
 
-            self.edit_window = QWidget()
-            self.edit_window.setWindowTitle("Edit Borrower Details")
-            self.edit_window.setGeometry(400, 200, 420, 400)
-
-            self.edit_window.setStyleSheet("""
-                QWidget {
-                    background-color: white;
-                    font-family: Helvetica;
-                }
-                QLineEdit, QComboBox {
-                    border: 2px solid #219150;
-                    border-radius: 5px;
-                    padding: 8px;
-                    font-size: 14px;
-                    background-color: white;
-                }
-                QPushButton {
-                    border-radius: 5px;
-                    padding: 10px;
-                    font-size: 14px;
-                    color: white;
-                }
-                QLabel {
-                    font-size: 14px;
-                    color: #2C3E50;
-                }
-            """)
-
-            layout = QVBoxLayout()
-            form_layout = QFormLayout()
-
-            self.edit_name = QLineEdit(borrower_name)
-            self.edit_contact = QLineEdit(contact)
-            self.edit_email = QLineEdit(email)
-
-            self.edit_gender = QComboBox()
-            self.edit_gender.addItems(["Male", "Female"])
+            # The form is built once and refilled for each borrower
+            if self.edit_window is None:
+                self.build_edit_window()
+            self.editing_borrower_id = borrower_id
+            self.edit_name.setText(borrower_name)
+            self.edit_contact.setText(contact)
+            self.edit_email.setText(email)
             self.edit_gender.setCurrentText(gender)
 
-            self.edit_classification = QComboBox()
-            classification_options = ["Student", "Faculty", "REPS", "Other"]
-            self.edit_classification.addItems(classification_options)
-
-            self.other_classification_container = QWidget()
-            other_layout = QHBoxLayout(self.other_classification_container)
-            other_layout.setContentsMargins(0, 0, 0, 0)
-
-            other_label = QLabel("Other (Specify):")
-            self.other_classification_input = QLineEdit()
-            self.other_classification_input.setPlaceholderText("Please specify...")
-            self.other_classification_input.setMaximumWidth(280)
-
-            other_layout.addWidget(other_label)
-            other_layout.addWidget(self.other_classification_input)
-
-            classification_value = self.reports_table.item(selected_row, 8).text()
-
-            if classification_value in classification_options:
+            if classification_value in self.classification_options:
                 self.edit_classification.setCurrentText(classification_value)
+                self.other_classification_input.clear()
                 self.other_classification_container.hide()
             else:
                 self.edit_classification.setCurrentText("Other")
                 self.other_classification_input.setText(classification_value)
                 self.other_classification_container.show()
 
-            self.edit_classification.currentTextChanged.connect(
-                lambda value: self.other_classification_container.setVisible(value == "Other")
-            )
-
-            form_layout.addRow("Borrower Name:", self.edit_name)
-            form_layout.addRow("Contact Number:", self.edit_contact)
-            form_layout.addRow("Email Address:", self.edit_email)
-            form_layout.addRow("Gender:", self.edit_gender)
-            form_layout.addRow("Classification:", self.edit_classification)
-            form_layout.addRow(self.other_classification_container)
-
-            layout.addLayout(form_layout)
-
-            button_layout = QHBoxLayout()
-
-            self.save_button = QPushButton("💾 Save")
-            self.save_button.setStyleSheet("background-color: #219150; color: white; padding: 10px; min-width: 120px;")
-            self.save_button.clicked.connect(lambda: self.save_borrower_details(borrower_id))
-            button_layout.addWidget(self.save_button)
-
-            self.cancel_button = QPushButton("❌ Cancel")
-            self.cancel_button.setStyleSheet("background-color: #E74C3C; color: white; padding: 10px; min-width: 120px;")
-            self.cancel_button.clicked.connect(self.edit_window.close)
-            button_layout.addWidget(self.cancel_button)
-
-            layout.addLayout(button_layout)
-            self.edit_window.setLayout(layout)
             self.edit_window.show()
+            self.edit_window.raise_()
 
         else:  
             QMessageBox.information(
@@ -2168,6 +5399,67 @@ class BorrowerReportsWidget(QWidget):
             )
             return
 
+    def build_edit_window(self):
+        self.edit_window = QWidget()
+        self.edit_window.setWindowTitle("Edit Borrower Details")
+        self.edit_window.setGeometry(400, 200, 420, 400)
+
+        self.edit_window.setObjectName("editBorrowerWindow")
+
+        layout = QVBoxLayout()
+        form_layout = QFormLayout()
+
+        self.edit_name = QLineEdit()
+        self.edit_contact = QLineEdit()
+        self.edit_email = QLineEdit()
+
+        self.edit_gender = QComboBox()
+        self.edit_gender.addItems(["Male", "Female"])
+
+        self.edit_classification = QComboBox()
+        self.classification_options = ["Student", "Faculty", "REPS", "Other"]
+        self.edit_classification.addItems(self.classification_options)
+
+        self.other_classification_container = QWidget()
+        other_layout = QHBoxLayout(self.other_classification_container)
+        other_layout.setContentsMargins(0, 0, 0, 0)
+
+        other_label = QLabel("Other (Specify):")
+        self.other_classification_input = QLineEdit()
+        self.other_classification_input.setPlaceholderText("Please specify...")
+        self.other_classification_input.setMaximumWidth(280)
+
+        other_layout.addWidget(other_label)
+        other_layout.addWidget(self.other_classification_input)
+
+        self.edit_classification.currentTextChanged.connect(
+            lambda value: self.other_classification_container.setVisible(value == "Other")
+        )
+
+        form_layout.addRow("Borrower Name:", self.edit_name)
+        form_layout.addRow("Contact Number:", self.edit_contact)
+        form_layout.addRow("Email Address:", self.edit_email)
+        form_layout.addRow("Gender:", self.edit_gender)
+        form_layout.addRow("Classification:", self.edit_classification)
+        form_layout.addRow(self.other_classification_container)
+
+        layout.addLayout(form_layout)
+
+        button_layout = QHBoxLayout()
+
+        self.save_button = QPushButton("💾 Save")
+        self.save_button.setStyleSheet("background-color: #219150; color: white; padding: 10px; min-width: 120px;")
+        self.save_button.clicked.connect(lambda: self.save_borrower_details(self.editing_borrower_id))
+        button_layout.addWidget(self.save_button)
+
+        self.cancel_button = QPushButton("❌ Cancel")
+        self.cancel_button.setStyleSheet("background-color: #E74C3C; color: white; padding: 10px; min-width: 120px;")
+        self.cancel_button.clicked.connect(self.edit_window.close)
+        button_layout.addWidget(self.cancel_button)
+
+        layout.addLayout(button_layout)
+        self.edit_window.setLayout(layout)
+
     def save_borrower_details(self, borrower_id):
         new_name = self.edit_name.text().strip()
         new_contact = self.edit_contact.text().strip()
@@ -2185,13 +5477,13 @@ class BorrowerReportsWidget(QWidget):
             self.edit_window.activateWindow()
             return
 
-        if not self.is_valid_phone(new_contact):
+        if not is_valid_phone(new_contact):
             QMessageBox.warning(self.main_window, "Invalid Phone Number", "Please enter a valid phone number (10-15 digits)!")
             self.edit_window.raise_()
             self.edit_window.activateWindow()
             return
 
-        if not self.is_valid_email(new_email):
+        if not is_valid_email(new_email):
             QMessageBox.warning(self.main_window, "Invalid Email", "Please enter a valid email address!")
             self.edit_window.raise_()
             self.edit_window.activateWindow()
@@ -2213,6 +5505,9 @@ class BorrowerReportsWidget(QWidget):
             QMessageBox.critical(self, "Error", f"Failed to update borrower details: {e}")
 
     def delete_borrower_report(self):
+        if self.all_selected:
+            self.delete_all_matching()
+            return
         selected_rows = self.get_selected_rows()
         
         if not selected_rows:
@@ -2244,11 +5539,16 @@ class BorrowerReportsWidget(QWidget):
             return
         
         try:
+            deleted_at = datetime.now().strftime("%Y-%m-%d %H:%M")
             for borrower_id in selected_borrower_ids:
-                self.cursor.execute("DELETE FROM Borrowers WHERE BORROWER_ID = ?", (borrower_id,))
+                self.cursor.execute("SELECT BK_ID, COPY_ID, DATE_RETURNED FROM Borrowers WHERE BORROWER_ID = ?", (borrower_id,))
+                book_id, copy_id, date_returned = self.cursor.fetchone()
+                self.cursor.execute("UPDATE Borrowers SET IS_DELETED = 1, DELETED_AT = ? WHERE BORROWER_ID = ?", (deleted_at, borrower_id))
+                # Deleting an open loan puts its copy back, so the holds queue gets first claim on it
+                if date_returned is None:
+                    assign_next_hold(self.cursor, book_id, copy_id)
             
             self.connector.commit()
-            self.reorder_borrower_ids()
             self.load_borrower_reports()
             
             if len(selected_borrower_ids) == 1:
@@ -2257,36 +5557,30 @@ class BorrowerReportsWidget(QWidget):
                 QMessageBox.information(self.main_window, "Success", f"{len(selected_borrower_ids)} borrower reports deleted successfully.", QMessageBox.Ok)
         
         except sqlite3.Error as e:
+            self.connector.rollback()
             QMessageBox.critical(self.main_window, "Error", f"Failed to delete borrower report(s): {e}", QMessageBox.Ok)
 
-    def reorder_borrower_ids(self):
-        try:
-            self.cursor.execute("SELECT BORROWER_ID FROM Borrowers ORDER BY BORROWER_ID ASC")
-            borrowers = self.cursor.fetchall()
-
-            new_id = 1
-            for borrower in borrowers:
-                old_id = borrower[0]
-                self.cursor.execute("UPDATE Borrowers SET BORROWER_ID = ? WHERE BORROWER_ID = ?", (new_id, old_id))
-                new_id += 1
+    def delete_all_matching(self):
+        (period, status), count = self.all_selected
+        confirmation = QMessageBox.question(
+            self.main_window,
+            "Delete Confirmation",
+            f"Are you sure you want to delete all {count} borrower records matching the filters?",
+            QMessageBox.Yes | QMessageBox.No
+        )
 
-            self.connector.commit()
+        if confirmation == QMessageBox.No:
+            return
 
-            self.cursor.execute("DELETE FROM sqlite_sequence WHERE name='Borrowers'")
+        try:
+            deleted = delete_report_loans(self.cursor, period, status)
             self.connector.commit()
-
-            print("Borrower IDs reordered successfully.")
+            self.load_borrower_reports()
+            QMessageBox.information(self.main_window, "Success", f"{deleted} borrower reports deleted successfully.", QMessageBox.Ok)
 
         except sqlite3.Error as e:
-            print(f"Error reordering borrower IDs: {e}")
-
-    def is_valid_phone(self, phone):
-        digits_only = ''.join(filter(str.isdigit, phone))
-        return 10 <= len(digits_only) <= 15
-
-    def is_valid_email(self, email):
-        pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(pattern, email) is not None
+            self.connector.rollback()
+            QMessageBox.critical(self.main_window, "Error", f"Failed to delete borrower report(s): {e}", QMessageBox.Ok)
 
     def clear_fields(self):
         self.sort_combo.setCurrentIndex(0)
@@ -2297,16 +5591,482 @@ class BorrowerReportsWidget(QWidget):
         self.load_borrower_reports()
         
         self.has_selected_items = False
-        self.export_button.setText("📤 Export to Excel")
+        self.export_button.setText("📤 Export")
         self.delete_button.setText("🗑️ Delete Report")
         self.select_all_button.hide()
         self.deselect_all_button.hide()
 
+class CirculationWidget(QWidget):
+    def __init__(self, main_window, cursor, connector):
+        super().__init__()
+        self.main_window = main_window
+        self.cursor = cursor
+        self.connector = connector
+        self.patron = None
+        self.pending_copy = None
+        self.initUI()
+
+    def initUI(self):
+        self.setStyleSheet("""
+            QWidget {
+                background-color: white;
+                font-family: Helvetica;
+            }
+            QLineEdit, QComboBox {
+                border: 2px solid #16A085;
+                border-radius: 5px;
+                padding: 8px;
+                font-size: 14px;
+            }
+            QListWidget {
+                border: 2px solid #16A085;
+                border-radius: 5px;
+                font-size: 14px;
+            }
+            QPushButton {
+                background-color: #16A085;
+                color: white;
+                border-radius: 5px;
+                padding: 10px;
+                font-size: 14px;
+            }
+            QPushButton:hover {
+                background-color: #138D75;
+            }
+        """)
+
+        layout = QVBoxLayout(self)
+
+        header_label = QLabel("Circulation Desk")
+        header_label.setFont(QFont("Helvetica", 18, QFont.Bold))
+        header_label.setStyleSheet("color: white; background-color: #16A085; padding: 10px; border-radius: 3px;")
+        layout.addWidget(header_label)
+
+        hint_label = QLabel("Scan a patron card, then the barcode of each book they take. Scanning a book that is out returns it.")
+        hint_label.setStyleSheet("color: #2C3E50; font-size: 14px; padding: 5px;")
+        layout.addWidget(hint_label)
+
+        scan_layout = QHBoxLayout()
+        self.scan_input = QLineEdit()
+        self.scan_input.setPlaceholderText("Scan or type a patron ID or book barcode and press Enter")
+        self.scan_input.setStyleSheet("font-size: 20px; padding: 12px;")
+        self.scan_input.returnPressed.connect(self.handle_scan)
+        scan_layout.addWidget(self.scan_input)
+
+        self.end_session_button = QPushButton("✅ Done")
+        self.end_session_button.clicked.connect(self.end_session)
+        scan_layout.addWidget(self.end_session_button)
+        layout.addLayout(scan_layout)
+
+        self.patron_label = QLabel()
+        self.patron_label.setStyleSheet("color: #2C3E50; font-size: 16px; font-weight: bold; padding: 5px;")
+        layout.addWidget(self.patron_label)
+
+        self.status_label = QLabel()
+        self.status_label.setWordWrap(True)
+        self.status_label.setStyleSheet("font-size: 16px; padding: 10px; border-radius: 5px;")
+        layout.addWidget(self.status_label)
+
+        self.history_list = QListWidget()
+        layout.addWidget(self.history_list)
+
+        register_box = QGroupBox("Register Patron Card")
+        register_layout = QHBoxLayout(register_box)
+
+        self.patron_id_input = QLineEdit()
+        self.patron_id_input.setPlaceholderText("Card ID")
+        self.patron_name_input = QLineEdit()
+        self.patron_name_input.setPlaceholderText("Name")
+        self.patron_contact_input = QLineEdit()
+        self.patron_contact_input.setPlaceholderText("Contact number")
+        self.patron_email_input = QLineEdit()
+        self.patron_email_input.setPlaceholderText("Email")
+        self.patron_gender_input = QComboBox()
+        self.patron_gender_input.addItems(["Male", "Female"])
+        self.patron_classification_input = QComboBox()
+        self.patron_classification_input.addItems(["Student", "Faculty", "REPS", "Other"])
+
+        for widget in (self.patron_id_input, self.patron_name_input, self.patron_contact_input, self.patron_email_input,
+                       self.patron_gender_input, self.patron_classification_input):
+            register_layout.addWidget(widget)
+
+        self.register_button = QPushButton("➕ Register")
+        self.register_button.clicked.connect(self.register_patron)
+        register_layout.addWidget(self.register_button)
+        layout.addWidget(register_box)
+
+        self.end_session()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.scan_input.setFocus()
+
+    def show_feedback(self, message, ok=True):
+        color = "#1E8449" if ok else "#C0392B"
+        background = "#D5F5E3" if ok else "#FADBD8"
+        self.status_label.setText(message)
+        self.status_label.setStyleSheet(f"font-size: 16px; padding: 10px; border-radius: 5px; color: {color}; background-color: {background};")
+
+        item = QListWidgetItem(f"{datetime.now():%H:%M:%S}  {message}")
+        item.setForeground(QColor(color))
+        self.history_list.insertItem(0, item)
+        if self.history_list.count() > 200:
+            self.history_list.takeItem(self.history_list.count() - 1)
+        if not ok:
+            QApplication.beep()
+
+    def end_session(self):
+        self.patron = None
+        self.pending_copy = None
+        self.patron_label.setText("No patron scanned")
+        self.scan_input.setFocus()
+
+    def handle_scan(self):
+        code = self.scan_input.text().strip()
+        self.scan_input.clear()
+        if not code:
+            return
+
+        try:
+            copy = lookup_barcode(self.cursor, code)
+            if copy:
+                self.scan_copy(copy)
+                return
+
+            patron = find_patron(self.cursor, code)
+            if patron:
+                self.patron = patron
+                self.patron_label.setText(f"Patron: {patron[1]} ({patron[0]}, {patron[5]})")
+                if self.pending_copy:
+                    copy, self.pending_copy = self.pending_copy, None
+                    self.scan_copy(copy)
+                else:
+                    self.show_feedback(f"Patron {patron[1]} ready. Scan the books to lend.")
+                return
+
+            self.show_feedback(f"Unknown barcode or patron ID: {code}", ok=False)
+
+        except sqlite3.Error as e:
+            self.connector.rollback()
+            self.show_feedback(f"Database error: {e}", ok=False)
+
+    def scan_copy(self, copy):
+        copy_id, book_id, book_name, borrower_id, borrower_name, due_date = copy
+
+        if borrower_id is not None:
+            hold_borrower = return_loan(self.cursor, borrower_id, book_id, copy_id)
+            self.connector.commit()
+            message = f"Returned \"{book_name}\" from {borrower_name}."
+            if hold_borrower:
+                message += f" Now on loan to {hold_borrower} from the holds queue - set it aside."
+            self.show_feedback(message)
+            self.mark_pages_stale()
+            return
+
+        if self.patron is None:
+            self.pending_copy = copy
+            self.show_feedback(f"\"{book_name}\" is on the shelf. Scan the patron card to lend it.")
+            return
+
+        self.cursor.execute("SELECT HOLDS_QUEUED FROM Library WHERE BK_ID = ?", (book_id,))
+        if self.cursor.fetchone()[0] > 0:
+            self.show_feedback(f"\"{book_name}\" has holds waiting and cannot be lent from the desk.", ok=False)
+            return
+
+        patron_id, name, contact_number, email, gender, classification = self.patron
+        loan_id = insert_loan(self.cursor, book_id, copy_id, name, contact_number, email, gender, classification, patron_id=patron_id)
+        self.cursor.execute("SELECT DUE_DATE FROM Borrowers WHERE BORROWER_ID = ?", (loan_id,))
+        due_date = self.cursor.fetchone()[0]
+        self.connector.commit()
+        self.show_feedback(f"Lent \"{book_name}\" to {name}, due {due_date}.")
+        self.mark_pages_stale()
+
+    def mark_pages_stale(self):
+        # The other pages reload from the database when they are next shown
+        self.main_window.reports_stale = True
+
+    def register_patron(self):
+        patron_id = self.patron_id_input.text().strip()
+        name = self.patron_name_input.text().strip()
+        contact_number = self.patron_contact_input.text().strip()
+        email = self.patron_email_input.text().strip()
+
+        if not patron_id or not name or not contact_number or not email:
+            self.show_feedback("Card ID, name, contact number and email are required to register a patron.", ok=False)
+            return
+        if not is_valid_email(email):
+            self.show_feedback("Please enter a valid email address!", ok=False)
+            return
+        if not is_valid_phone(contact_number):
+            self.show_feedback("Please enter a valid phone number (10-15 digits)!", ok=False)
+            return
+
+        try:
+            self.cursor.execute(
+                "INSERT INTO Patrons (PATRON_ID, BORROWER_NAME, CONTACT_NUMBER, EMAIL, GENDER, CLASSIFICATION) VALUES (?, ?, ?, ?, ?, ?)",
+                (patron_id, name, contact_number, email, self.patron_gender_input.currentText(),
+                 self.patron_classification_input.currentText())
+            )
+            self.connector.commit()
+        except sqlite3.IntegrityError:
+            self.show_feedback(f"Card ID {patron_id} is already registered.", ok=False)
+            return
+
+        for widget in (self.patron_id_input, self.patron_name_input, self.patron_contact_input, self.patron_email_input):
+            widget.clear()
+        self.show_feedback(f"Registered {name} with card {patron_id}.")
+        self.scan_input.setFocus()
+
+
+class DiagnosticsWidget(QWidget):
+    def __init__(self, main_window, cursor, connector):
+        super().__init__()
+        self.main_window = main_window
+        self.cursor = cursor
+        self.connector = connector
+        self.initUI()
+
+    def initUI(self):
+        self.setStyleSheet("""
+            QWidget {
+                background-color: white;
+                font-family: Helvetica;
+            }
+            QTableWidget {
+                border: 2px solid #34495E;
+                border-radius: 5px;
+                gridline-color: #E0E0E0;
+                font-size: 13px;
+            }
+            QHeaderView::section {
+                background-color: #34495E;
+                color: white;
+                font-weight: bold;
+                padding: 8px;
+                border: none;
+            }
+            QPushButton {
+                background-color: #34495E;
+                color: white;
+                border-radius: 5px;
+                padding: 10px;
+                font-size: 14px;
+                min-width: 160px;
+            }
+            QPushButton:hover {
+                background-color: #2C3E50;
+            }
+        """)
+
+        layout = QVBoxLayout(self)
+
+        header_label = QLabel("Diagnostics")
+        header_label.setFont(QFont("Helvetica", 18, QFont.Bold))
+        header_label.setStyleSheet("color: white; background-color: #34495E; padding: 10px; border-radius: 3px;")
+        layout.addWidget(header_label)
+
+        self.query_summary_label = QLabel()
+        self.query_summary_label.setStyleSheet("color: #2C3E50; font-size: 14px; padding: 5px;")
+        layout.addWidget(self.query_summary_label)
+
+        self.cache_summary_label = QLabel()
+        self.cache_summary_label.setStyleSheet("color: #2C3E50; font-size: 14px; padding: 5px;")
+        layout.addWidget(self.cache_summary_label)
+
+        self.query_table = QTableWidget()
+        self.query_table.setColumnCount(8)
+        self.query_table.setHorizontalHeaderLabels(["Query", "Calls", "Rows", "Total (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Max (ms)"])
+        self.query_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        for col in range(1, 8):
+            self.query_table.horizontalHeader().setSectionResizeMode(col, QHeaderView.ResizeToContents)
+        self.query_table.setAlternatingRowColors(True)
+        layout.addWidget(self.query_table)
+
+        self.stall_summary_label = QLabel()
+        self.stall_summary_label.setStyleSheet("color: #2C3E50; font-size: 14px; padding: 5px;")
+        layout.addWidget(self.stall_summary_label)
+
+        self.stall_table = QTableWidget()
+        self.stall_table.setColumnCount(3)
+        self.stall_table.setHorizontalHeaderLabels(["Time", "Stalled (ms)", "Method"])
+        self.stall_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeToContents)
+        self.stall_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        self.stall_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.stall_table.setAlternatingRowColors(True)
+        self.stall_table.setMaximumHeight(200)
+        layout.addWidget(self.stall_table)
+
+        self.integrity_summary_label = QLabel("Run an integrity check to compare copy counts, holds and loans against the rows they summarise.")
+        self.integrity_summary_label.setStyleSheet("color: #2C3E50; font-size: 14px; padding: 5px;")
+        layout.addWidget(self.integrity_summary_label)
+
+        self.integrity_table = QTableWidget()
+        self.integrity_table.setColumnCount(3)
+        self.integrity_table.setHorizontalHeaderLabels(["Issue", "Book ID", "Detail"])
+        self.integrity_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeToContents)
+        self.integrity_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        self.integrity_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.integrity_table.setAlternatingRowColors(True)
+        self.integrity_table.setMaximumHeight(200)
+        layout.addWidget(self.integrity_table)
+
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+
+        self.refresh_button = QPushButton("🔄 Refresh")
+        self.refresh_button.clicked.connect(self.refresh_data)
+        button_layout.addWidget(self.refresh_button)
+
+        self.reset_button = QPushButton("🧹 Reset Statistics")
+        self.reset_button.clicked.connect(self.reset_statistics)
+        button_layout.addWidget(self.reset_button)
+
+        self.check_integrity_button = QPushButton("🩺 Check Integrity")
+        self.check_integrity_button.clicked.connect(self.check_integrity)
+        button_layout.addWidget(self.check_integrity_button)
+
+        self.repair_integrity_button = QPushButton("🛠️ Repair")
+        self.repair_integrity_button.clicked.connect(self.repair_integrity)
+        button_layout.addWidget(self.repair_integrity_button)
+
+        button_layout.addStretch()
+        layout.addLayout(button_layout)
+
+        self.refresh_data()
+
+    def refresh_data(self):
+        summary = query_profiler.summary()
+        self.query_summary_label.setText(
+            f"{sum(row['calls'] for row in summary)} statements in {len(summary)} query shapes. "
+            f"Statements slower than {query_profiler.slow_ms:g} ms are logged to {query_profiler.log_path} with their query plan."
+        )
+        cache = catalogue_cache.stats()
+        self.cache_summary_label.setText(
+            f"Catalogue cache: {cache['records']} of {cache['capacity']} books, about {cache['bytes'] / 1024:.0f} KiB; "
+            f"{cache['hit_rate']:.0%} of {cache['hits'] + cache['misses']} lookups served from memory, {cache['evictions']} evicted."
+        )
+
+        self.query_table.setRowCount(0)
+        for row_num, row in enumerate(summary):
+            self.query_table.insertRow(row_num)
+            values = [row["shape"], row["calls"], row["rows"], f"{row['total_ms']:.1f}", f"{row['p50_ms']:.2f}",
+                      f"{row['p95_ms']:.2f}", f"{row['p99_ms']:.2f}", f"{row['max_ms']:.2f}"]
+            for col_num, data in enumerate(values):
+                item = QTableWidgetItem(str(data))
+                item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
+                item.setToolTip(str(data))
+                self.query_table.setItem(row_num, col_num, item)
+
+        watchdog = getattr(self.main_window, "watchdog", None)
+        if watchdog is None:
+            self.stall_summary_label.setText("UI stall detection is off. Set LIBRARY_STALL_MS or start with --watch-stalls to enable it.")
+            self.stall_table.setRowCount(0)
+            return
+
+        entries = list(watchdog.entries)
+        self.stall_summary_label.setText(
+            f"{len(entries)} UI stalls longer than {watchdog.threshold * 1000:g} ms (full stacks in {watchdog.report_path})."
+        )
+        self.stall_table.setRowCount(0)
+        for row_num, entry in enumerate(reversed(entries)):
+            self.stall_table.insertRow(row_num)
+            for col_num, data in enumerate([entry["time"], f"{entry['duration_ms']:.0f}", entry["culprit"]]):
+                item = QTableWidgetItem(data)
+                item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
+                item.setToolTip(entry["stack"])
+                self.stall_table.setItem(row_num, col_num, item)
+
+    def check_integrity(self):
+        started = time.perf_counter()
+        try:
+            issues = check_integrity(self.cursor)
+        except sqlite3.Error as e:
+            QMessageBox.critical(self.main_window, "Error", f"Integrity check failed: {e}")
+            return
+
+        self.integrity_summary_label.setText(
+            f"{len(issues)} integrity issues found in {(time.perf_counter() - started) * 1000:.0f} ms."
+            + (" Use Repair to fix them." if issues else "")
+        )
+        self.integrity_table.setRowCount(0)
+        for row_num, issue in enumerate(issues[:1000]):
+            self.integrity_table.insertRow(row_num)
+            for col_num, data in enumerate(issue):
+                item = QTableWidgetItem(str(data))
+                item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
+                item.setToolTip(str(data))
+                self.integrity_table.setItem(row_num, col_num, item)
+        return issues
+
+    def repair_integrity(self):
+        confirm = QMessageBox.question(
+            self.main_window, "Repair Integrity",
+            "Mark loans of books that no longer exist as deleted, delete their copies and holds, and recompute "
+            "every copy and hold count?\n\nOver-issued books are listed but not changed.",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+        )
+        if confirm != QMessageBox.Yes:
+            return
+
+        try:
+            repaired = repair_integrity(self.cursor)
+            self.connector.commit()
+        except sqlite3.Error as e:
+            self.connector.rollback()
+            QMessageBox.critical(self.main_window, "Error", f"Repair failed: {e}")
+            return
+
+        QMessageBox.information(self.main_window, "Repair Complete",
+            "\n".join(f"{name.capitalize()}: {count}" for name, count in repaired.items()))
+        self.check_integrity()
+        self.main_window.reports_stale = True
+
+    def reset_statistics(self):
+        query_profiler.reset()
+        catalogue_cache.reset_statistics()
+        watchdog = getattr(self.main_window, "watchdog", None)
+        if watchdog is not None:
+            watchdog.entries.clear()
+        self.refresh_data()
+
 class LibraryApp(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.connector = sqlite3.connect("library.db")
+        QApplication.instance().setStyleSheet(APP_STYLESHEET)
+        QPixmapCache.setCacheLimit(32 * 1024)
+        self.connector = open_library_connection("library.db")
         self.cursor = self.connector.cursor()
+        remote = isinstance(self.connector, RemoteConnection)
+
+        self.watchdog = None
+        stall_ms = os.environ.get("LIBRARY_STALL_MS")
+        if stall_ms or "--watch-stalls" in sys.argv:
+            self.watchdog = EventLoopWatchdog(float(stall_ms or 250))
+            self.watchdog.start()
+
+        self.reporting_snapshot = None
+        snapshot_seconds = float(os.environ.get("LIBRARY_REPORTING_SNAPSHOT", 0) or 0)
+        if snapshot_seconds > 0 and not remote:
+            self.reporting_snapshot = ReportingSnapshot(self.connector)
+            self.snapshot_timer = QTimer(self)
+            self.snapshot_timer.timeout.connect(self.refresh_reporting_snapshot)
+            self.snapshot_timer.start(int(snapshot_seconds * 1000))
+
+        self.report_scheduler = None
+        # Local desks check every 30 seconds unless LIBRARY_SCHEDULER_SECONDS says otherwise (0 turns
+        # it off); jobs are claimed before they run, so several desks never run one twice
+        scheduler_seconds = float(os.environ.get("LIBRARY_SCHEDULER_SECONDS", 30) or 0)
+        if scheduler_seconds > 0 and not remote:
+            self.report_scheduler = ReportScheduler("library.db", scheduler_seconds)
+            self.report_scheduler.start()
+
+        # Page loads run on background threads; LIBRARY_QUERY_THREADS=0 keeps them on the GUI thread
+        self.query_executor = None
+        query_threads = int(os.environ.get("LIBRARY_QUERY_THREADS", 2) or 0)
+        if query_threads > 0:
+            self.query_executor = QueryExecutor("library.db", query_threads)
+
+        self.reports_stale = False
         self.initUI()
         
 
@@ -2333,7 +6093,7 @@ class LibraryApp(QMainWindow):
         self.content_stack = QStackedWidget()
         self.main_layout.addWidget(self.content_stack)
         
-        self.dashboard_widget = DashboardWidget(self.cursor, self.connector)
+        self.dashboard_widget = DashboardWidget(self.cursor, self.connector, self.query_executor, self)
         self.content_stack.addWidget(self.dashboard_widget)
         
         self.inventory_widget = InventoryWidget(self, self.cursor, self.connector)
@@ -2342,6 +6102,12 @@ class LibraryApp(QMainWindow):
         # Add this after self.inventory_widget:
         self.borrower_reports_widget = BorrowerReportsWidget(self, self.cursor, self.connector)
         self.content_stack.addWidget(self.borrower_reports_widget)
+
+        self.circulation_widget = CirculationWidget(self, self.cursor, self.connector)
+        self.content_stack.addWidget(self.circulation_widget)
+
+        self.diagnostics_widget = DiagnosticsWidget(self, self.cursor, self.connector)
+        self.content_stack.addWidget(self.diagnostics_widget)
         
         self.content_stack.setCurrentIndex(0)
         self.dashboard_button.setChecked(True)
@@ -2371,17 +6137,25 @@ class LibraryApp(QMainWindow):
         
         sidebar_layout.addWidget(logo_container)
         
-        self.dashboard_button = SidebarButton("  Dashboard", resource_path("images/dashboard.png"))
+        self.dashboard_button = SidebarButton("  Dashboard", "images/dashboard.png")
         self.dashboard_button.clicked.connect(lambda: self.change_page(0))
         sidebar_layout.addWidget(self.dashboard_button)
         
-        self.inventory_button = SidebarButton("  Inventory", resource_path("images/library.png"))
+        self.inventory_button = SidebarButton("  Inventory", "images/library.png")
         self.inventory_button.clicked.connect(lambda: self.change_page(1))
         sidebar_layout.addWidget(self.inventory_button)
 
-        self.borrowers_button = SidebarButton("  Borrower Reports", resource_path("images/reports.png"))
+        self.borrowers_button = SidebarButton("  Borrower Reports", "images/reports.png")
         self.borrowers_button.clicked.connect(lambda: self.change_page(2))
         sidebar_layout.addWidget(self.borrowers_button)
+
+        self.circulation_button = SidebarButton("  Circulation")
+        self.circulation_button.clicked.connect(lambda: self.change_page(3))
+        sidebar_layout.addWidget(self.circulation_button)
+
+        self.diagnostics_button = SidebarButton("  Diagnostics")
+        self.diagnostics_button.clicked.connect(lambda: self.change_page(4))
+        sidebar_layout.addWidget(self.diagnostics_button)
         
         sidebar_layout.addStretch()
         
@@ -2390,10 +6164,58 @@ class LibraryApp(QMainWindow):
         version_label.setAlignment(Qt.AlignCenter)
         sidebar_layout.addWidget(version_label)
         
+    def submit_report_query(self, key, cursor, function, args, on_result, on_error):
+        # With a reporting snapshot, dashboard and report reads wait for a copy that
+        # includes every commit so far, this desk's own included
+        snapshot = self.reporting_snapshot
+        if snapshot is None:
+            submit_query(self.query_executor, key, cursor, function, args, on_result, on_error)
+            return
+        snapshot.waiting[key] = (cursor, function, args, on_result, on_error)
+        self.refresh_reporting_snapshot()
+
+    def run_report_queries(self):
+        snapshot = self.reporting_snapshot
+        waiting, snapshot.waiting = snapshot.waiting, {}
+        for key, (cursor, function, args, on_result, on_error) in waiting.items():
+            submit_query(self.query_executor, key, cursor, snapshot.query, (function,) + tuple(args), on_result, on_error)
+
+    def refresh_reporting_snapshot(self):
+        # Only the version check runs here; the copy itself is taken on a query thread
+        snapshot = self.reporting_snapshot
+        if snapshot.copying:
+            return
+        try:
+            version = snapshot.source_version()
+        except sqlite3.Error as e:
+            print(f"Error refreshing reporting snapshot: {e}")
+            return
+        if version == snapshot.version:
+            self.run_report_queries()
+            return
+
+        snapshot.copying = True
+        submit_query(self.query_executor, "reporting snapshot", self.cursor, snapshot.copy, (),
+                     lambda connection: self.reporting_snapshot_copied(connection, version),
+                     self.reporting_snapshot_failed)
+
+    def reporting_snapshot_copied(self, connection, version):
+        self.reporting_snapshot.install(connection, version)
+        if self.content_stack.currentIndex() == 0:
+            self.dashboard_widget.refresh_data()
+        self.run_report_queries()
+
+    def reporting_snapshot_failed(self, message):
+        print(f"Error refreshing reporting snapshot: {message}")
+        self.reporting_snapshot.copying = False
+        self.run_report_queries()
+
     def change_page(self, index):
         self.dashboard_button.setChecked(False)
         self.inventory_button.setChecked(False)
         self.borrowers_button.setChecked(False)
+        self.circulation_button.setChecked(False)
+        self.diagnostics_button.setChecked(False)
 
         self.content_stack.setCurrentIndex(index)
 
@@ -2405,13 +6227,136 @@ class LibraryApp(QMainWindow):
             self.inventory_widget.load_records()
         elif index == 2:
             self.borrowers_button.setChecked(True)
+            if self.reports_stale:
+                self.reports_stale = False
+                self.borrower_reports_widget.load_borrower_reports()
+        elif index == 3:
+            self.circulation_button.setChecked(True)
+        elif index == 4:
+            self.diagnostics_button.setChecked(True)
+            self.diagnostics_widget.refresh_data()
+
+def command_line_value(flag, usage):
+    # The argument after flag; a missing one prints the usage and exits 1 instead of an IndexError
+    position = sys.argv.index(flag) + 1
+    if position >= len(sys.argv) or sys.argv[position].startswith("--"):
+        print(f'Usage: python "main 3.1.py" {flag} {usage}')
+        sys.exit(1)
+    return sys.argv[position]
 
 if __name__ == "__main__":
     import sys
+    if "--overdue-notices" in sys.argv:
+        notices_path = command_line_value("--overdue-notices", "FILE.csv")
+        print(f"{write_overdue_notices(cursor, notices_path)} overdue notices written to {notices_path}")
+        sys.exit(0)
+
+    if "--export" in sys.argv:
+        # Format follows the extension: .xlsx, .csv, .jsonl or .parquet (needs pyarrow)
+        export_path = command_line_value("--export", "FILE (.xlsx, .csv, .jsonl or .parquet)")
+        try:
+            count = export_loans(cursor, export_path)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        print(f"{count} loans exported to {export_path}")
+        sys.exit(0)
+
+    if "--export-changes" in sys.argv:
+        changes_path = command_line_value("--export-changes", "FILE [--append]")
+        try:
+            count = export_loan_changes(cursor, changes_path, append="--append" in sys.argv)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        connector.commit()
+        print(f"{count} new or changed loans exported to {changes_path}")
+        sys.exit(0)
+
+    if "--events-since" in sys.argv:
+        # JSON lines for a replica to apply; it passes back the last EVENT_ID it saw
+        after_event_id = command_line_value("--events-since", "EVENT_ID")
+        if not after_event_id.isdigit():
+            print('Usage: python "main 3.1.py" --events-since EVENT_ID')
+            sys.exit(1)
+        after_event_id = int(after_event_id)
+        for event_id, event_time, event_type, entity, book_id, borrower_id, row_data in events_since(cursor, after_event_id):
+            print(json.dumps({"event_id": event_id, "time": event_time, "type": event_type, "entity": entity,
+                              "book_id": book_id, "borrower_id": borrower_id, "row": json.loads(row_data)}))
+        sys.exit(0)
+
+    if "--serve" in sys.argv:
+        # --serve [HOST:]PORT; desk clients set LIBRARY_SERVER_URL=http://HOST:PORT
+        address = sys.argv[sys.argv.index("--serve") + 1] if len(sys.argv) > sys.argv.index("--serve") + 1 else "8765"
+        host, _, port = address.rpartition(":")
+        try:
+            library_server = LibraryServer(
+                "library.db", host or "127.0.0.1", int(port), int(os.environ.get("LIBRARY_SERVER_READERS", 4)),
+                os.environ.get("LIBRARY_SERVER_TOKEN")
+            )
+        except ValueError as e:
+            print(f"Cannot start the library server: {e}")
+            sys.exit(1)
+        scheduler_seconds = float(os.environ.get("LIBRARY_SCHEDULER_SECONDS", 30) or 0)
+        if scheduler_seconds > 0:
+            ReportScheduler("library.db", scheduler_seconds).start()
+        try:
+            library_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    if "--add-report-job" in sys.argv:
+        # --add-report-job NAME "SCHEDULE" [PERIOD [STATUS [FORMAT [DESTINATION]]]]
+        job_args = sys.argv[sys.argv.index("--add-report-job") + 1:]
+        if len(job_args) < 2:
+            print('Usage: python "main 3.1.py" --add-report-job NAME "SCHEDULE" [PERIOD [STATUS [FORMAT [DESTINATION]]]]')
+            sys.exit(1)
+        try:
+            add_report_job(cursor, *job_args[:6])
+            connector.commit()
+        except (ValueError, TypeError, sqlite3.Error) as e:
+            print(f"Could not add report job: {e}")
+            sys.exit(1)
+        print(f"Report job {job_args[0]} added")
+        sys.exit(0)
+
+    if "--run-due-reports" in sys.argv:
+        # One pass, for running from cron or Task Scheduler
+        run_due_report_jobs("library.db")
+        sys.exit(0)
+
+    if "--run-scheduler" in sys.argv:
+        print("Running scheduled reports; press Ctrl+C to stop")
+        try:
+            ReportScheduler("library.db", float(os.environ.get("LIBRARY_SCHEDULER_SECONDS", 30) or 30)).run()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    if "--check-integrity" in sys.argv or "--repair-integrity" in sys.argv:
+        issues = check_integrity(cursor)
+        for issue, book_id, detail in issues:
+            print(f"{issue}: {book_id}: {detail}")
+        print(f"{len(issues)} integrity issues found")
+        if issues and "--repair-integrity" in sys.argv:
+            repaired = repair_integrity(cursor)
+            for name, count in repaired.items():
+                print(f"{name}: {count}")
+            connector.commit()
+            # Over-issued books are left for a librarian, so they still fail the run
+            sys.exit(1 if repaired["over-issued books (not repaired)"] else 0)
+        sys.exit(1 if issues else 0)
+
     QApplication.setAttribute(Qt.AA_EnableHighDpiScaling, True)
     QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps, True)
     app = QApplication(sys.argv)
     app.setWindowIcon(QIcon(resource_path("images/cpaflogo.png")))
+    if "--prescale-images" in sys.argv:
+        prescale_images()
+        sys.exit(0)
+    if "--query-stats" in sys.argv:
+        app.aboutToQuit.connect(query_profiler.dump)
     window = LibraryApp()
     window.show()
     sys.exit(app.exec_())